@@ -0,0 +1,85 @@
+"""Microbenchmark de serialización: reflexión por fila vs. serializadores compilados.
+
+Compara, en filas por segundo, el camino anterior (``serialize_value`` sobre
+``obj.__table__.columns`` + ``json.dumps``) con los serializadores generados
+por ``SERIALIZERS`` a partir de instancias ORM y de filas Core, para
+``Appointment`` y ``AuditLog``. No necesita base de datos:
+
+    DATABASE_URL=sqlite:// python test/bench_serializers.py --rows 50000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from main import SERIALIZERS, Appointment, AuditLog, dumps_json, orjson, serialize_value
+
+
+def legacy_to_dict(obj):
+    # Implementación previa, tal cual: reflexión de columnas y cadena de
+    # isinstance por valor. En AuditLog getattr(obj, "metadata") devuelve el
+    # MetaData declarativo, por eso el json.dumps de abajo usa default=str.
+    return {c.name: serialize_value(getattr(obj, c.name)) for c in obj.__table__.columns}
+
+
+def appointment_rows(count):
+    base = datetime(2025, 1, 6, 9, 0)
+    for i in range(count):
+        start_at = base + timedelta(minutes=30 * i)
+        yield (i + 1, 1 + i % 500, 1 + i % 40, start_at, start_at + timedelta(minutes=30),
+               "booked", None, base, base)
+
+
+def audit_rows(count):
+    base = datetime(2025, 1, 6, 9, 0)
+    for i in range(count):
+        yield (i + 1, "patient", 1 + i % 500, "update", "appointments", i, "10.0.0.1",
+               {"status": ["booked", "canceled"]}, base + timedelta(seconds=i))
+
+
+def measure(label, func, items, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - started)
+    rate = len(items) / best
+    print(f"  {label:<42} {rate:>12,.0f} filas/s")
+    return rate
+
+
+def bench_model(model, rows, repeat):
+    columns = list(model.__table__.columns)
+    # El atributo ORM de la columna "metadata" de AuditLog es metadata_.
+    keys = [model.__mapper__.get_property_by_column(column).key for column in columns]
+    objects = [model(**dict(zip(keys, row))) for row in rows]
+
+    compiled_obj = SERIALIZERS.for_model(model)
+    compiled_row = SERIALIZERS.for_columns(columns)
+
+    print(f"{model.__name__} ({len(rows)} filas, mejor de {repeat})")
+    before = measure(
+        "antes: reflexión + json.dumps (ORM)",
+        lambda o: json.dumps(legacy_to_dict(o), default=str),
+        objects,
+        repeat,
+    )
+    measure("compilado (ORM) + dumps_json", lambda o: dumps_json(compiled_obj(o)), objects, repeat)
+    after = measure("compilado (fila Core) + dumps_json", lambda r: dumps_json(compiled_row(r)), rows, repeat)
+    print(f"  aceleración fila Core vs. antes: {after / before:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"codificador JSON: {'orjson' if orjson is not None else 'json (stdlib)'}")
+    bench_model(Appointment, list(appointment_rows(args.rows)), args.repeat)
+    bench_model(AuditLog, list(audit_rows(args.rows)), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
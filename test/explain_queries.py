@@ -0,0 +1,241 @@
+"""Verifica con EXPLAIN que las consultas calientes usen el índice previsto.
+
+Cada consulta reproduce la que ejecuta la app en la ruta indicada y declara
+los índices que su plan debe usar (``PRIMARY`` es la llave primaria; un
+``UNIQUE`` de una columna se llama como la columna, igual que en MySQL). En
+SQLite falla si el plan contiene un ``SCAN`` de tabla; en MySQL si algún
+acceso es ``type=ALL`` o no usa llave; en ambos si falta un índice previsto.
+Sale con código 1 si alguna consulta falla:
+
+    DATABASE_URL=sqlite:///loadtest.db python explain_queries.py
+    DATABASE_URL=sqlite:// python explain_queries.py --create   # base vacía creada desde los modelos
+"""
+import argparse
+import re
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from main import (
+    ACTIVE_APPOINTMENT_STATUSES,
+    Appointment,
+    Base,
+    NotificationOutbox,
+    Patient,
+    Provider,
+    ProviderAvailability,
+    WaitlistEntry,
+    agenda_queries,
+    calendar_query,
+    dashboard_queries,
+    engine,
+    exceptions_query,
+)
+
+
+def hot_queries():
+    """``(name, where it runs, statement, expected indexes)`` for every query on a hot path."""
+    now = datetime(2030, 1, 7, 9, 0)
+    start_at, end_at = now, now + timedelta(minutes=30)
+    return [
+        (
+            "login_patient",
+            "auth_login",
+            select(Patient).where(Patient.email == "juan.perez@example.com"),
+            ("email",),
+        ),
+        (
+            "login_provider",
+            "auth_login",
+            select(Provider).where(Provider.email == "dra.lopez@clinic.mx"),
+            ("email",),
+        ),
+        (
+            "booking_lock",
+            "lock_provider_row",
+            select(Provider.provider_id, Provider.timezone).where(Provider.provider_id == 1),
+            ("PRIMARY",),
+        ),
+        (
+            "appointment_overlaps",
+            "appointment_overlaps / book_appointment",
+            select(Appointment.appointment_id).where(
+                Appointment.provider_id == 1,
+                Appointment.status.in_(ACTIVE_APPOINTMENT_STATUSES),
+                Appointment.start_at < end_at,
+                Appointment.end_at > start_at,
+            ).limit(1),
+            ("idx_provider_time",),
+        ),
+        (
+            "availability_rules",
+            "provider_availability",
+            select(ProviderAvailability)
+            .where(ProviderAvailability.provider_id == 1)
+            .order_by(ProviderAvailability.weekday, ProviderAvailability.start_time),
+            ("idx_avail_provider_day",),
+        ),
+        (
+            "availability_exceptions",
+            "provider_availability / busy_ranges",
+            exceptions_query(1, now, now + timedelta(days=14)),
+            ("idx_exc_provider_series",),
+        ),
+        (
+            "availability_busy",
+            "provider_availability",
+            select(Appointment.start_at, Appointment.end_at).where(
+                Appointment.provider_id == 1,
+                Appointment.status.in_(ACTIVE_APPOINTMENT_STATUSES),
+                Appointment.start_at < now + timedelta(days=14),
+                Appointment.end_at > now,
+            ),
+            ("idx_provider_time",),
+        ),
+        (
+            "patient_appointments",
+            "GET /appointments?patient_id=",
+            select(Appointment).where(Appointment.patient_id == 1, Appointment.start_at >= now),
+            ("idx_patient_time",),
+        ),
+        (
+            "dashboard_appointments",
+            "GET /dashboard (paciente)",
+            dashboard_queries({"user_type": "patient", "user_id": 1})["appointments"],
+            ("idx_patient_time", "PRIMARY"),
+        ),
+        (
+            "dashboard_patients",
+            "GET /dashboard (proveedor)",
+            dashboard_queries({"user_type": "provider", "user_id": 1})["patients"],
+            ("idx_provider_time", "PRIMARY"),
+        ),
+        (
+            "agenda_appointments",
+            "GET /providers/<id>/agenda",
+            agenda_queries(1, now.date())[0],
+            ("idx_provider_time", "PRIMARY"),
+        ),
+        (
+            "agenda_counts",
+            "GET /providers/<id>/agenda",
+            agenda_queries(1, now.date())[1],
+            ("idx_provider_time",),
+        ),
+        (
+            "calendar_incremental",
+            "GET /providers/<id>/calendar.ics?since=",
+            calendar_query(1, now.date(), since=now - timedelta(hours=1)),
+            ("idx_provider_time", "PRIMARY"),
+        ),
+        (
+            "waitlist_hold",
+            "waitlist_hold / book_appointment",
+            select(WaitlistEntry).where(
+                WaitlistEntry.offered_provider_id == 1,
+                WaitlistEntry.status == "offered",
+                WaitlistEntry.offered_start_at < end_at,
+                WaitlistEntry.offered_end_at > start_at,
+                WaitlistEntry.offer_expires_at > now,
+            ).limit(1),
+            ("idx_waitlist_hold",),
+        ),
+        (
+            "waitlist_expiry",
+            "expire_waitlist_offers",
+            select(WaitlistEntry)
+            .where(WaitlistEntry.status == "offered", WaitlistEntry.offer_expires_at <= now)
+            .limit(100),
+            ("idx_waitlist_expiry",),
+        ),
+        (
+            "outbox_claim",
+            "outbox_worker.claim_batch",
+            select(NotificationOutbox.notif_id)
+            .where(NotificationOutbox.status == "queued", NotificationOutbox.send_after <= now)
+            .order_by(NotificationOutbox.send_after)
+            .limit(100),
+            ("idx_outbox_status_time",),
+        ),
+        (
+            "outbox_supersede",
+            "enqueue_appointment_notifications",
+            update(NotificationOutbox)
+            .where(NotificationOutbox.appointment_id == 1, NotificationOutbox.status == "queued")
+            .values(status="failed"),
+            ("idx_outbox_appointment",),
+        ),
+    ]
+
+
+SQLITE_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+def sqlite_index_name(conn, name):
+    """Name of a SQLite index as MySQL calls it: a one-column ``UNIQUE`` is named after the column."""
+    if not name.startswith("sqlite_autoindex_"):
+        return name
+    columns = conn.exec_driver_sql(f'PRAGMA index_info("{name}")').all()
+    return columns[0][2] if len(columns) == 1 else name
+
+
+def explain(conn, statement, expected=()):
+    """Return ``(plan lines, problems)`` for ``statement`` on the connected dialect.
+
+    Besides full scans, every index in ``expected`` missing from the plan is
+    a problem: a query that silently moves to another index can read far
+    more rows than the one it was designed for.
+    """
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + compiled.string, params).all()
+        lines = [row[-1] for row in rows]
+        problems = [line for line in lines if line.startswith("SCAN ") and "CONSTANT ROW" not in line]
+        used = {sqlite_index_name(conn, name) for line in lines for name in SQLITE_INDEX.findall(line)}
+        if any("PRIMARY KEY" in line for line in lines):
+            used.add("PRIMARY")
+    else:
+        result = conn.exec_driver_sql("EXPLAIN " + compiled.string, params)
+        columns = list(result.keys())
+        lines, problems, used = [], [], set()
+        for row in result:
+            row = dict(zip(columns, row))
+            line = f"{row.get('table')}: type={row.get('type')} key={row.get('key')} rows={row.get('rows')}"
+            lines.append(line)
+            if row.get("key"):
+                used.add(row["key"])
+            if row.get("table") and (row.get("type") == "ALL" or row.get("key") is None):
+                problems.append(line)
+    problems.extend(f"no usa {name} (usa: {', '.join(sorted(used)) or 'ninguno'})" for name in expected if name not in used)
+    return lines, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--create", action="store_true", help="crea las tablas desde los modelos antes de revisar")
+    parser.add_argument("--verbose", "-v", action="store_true", help="imprime el plan completo")
+    args = parser.parse_args()
+
+    if args.create:
+        Base.metadata.create_all(engine)
+    failures = 0
+    with engine.connect() as conn:
+        for name, site, statement, expected in hot_queries():
+            plan, problems = explain(conn, statement, expected)
+            failures += bool(problems)
+            print(f"{'FALLA' if problems else 'OK   '} {name:<26} ({site})")
+            for line in plan if args.verbose or problems else ():
+                print(f"        {line}")
+            for problem in problems:
+                print(f"      ! {problem}")
+    if failures:
+        print(f"{failures} consultas no usan el índice previsto", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
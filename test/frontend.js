@@ -59,6 +59,8 @@ let activeSession = null;
 let patientsCache = [];
 let providersCache = [];
 let availabilityCache = [];
+let appointmentsCache = [];
+let changeFeed = null;
 const STATUS_BADGE_CLASS = {
   booked: "primary",
   rescheduled: "info",
@@ -137,6 +139,7 @@ function persistSession() {
 }
 
 function clearSessionState() {
+  closeChangeFeed();
   sessionToken = null;
   activeSession = null;
   persistSession();
@@ -313,12 +316,112 @@ async function loadProtectedData() {
   if (!hasActiveSession()) {
     return;
   }
-  await Promise.all([
-    loadPatients(),
-    loadProviders(),
-    refreshAvailabilityData(),
-    loadAppointments(),
-  ]);
+  try {
+    // Una sola petición trae todo lo que la vista necesita según el rol.
+    const response = await fetch(`${API_BASE}/dashboard`, withAuthHeaders());
+    const data = await handleResponse(response);
+    renderPatients(data.patients);
+    availabilityCache = Array.isArray(data.availability) ? data.availability : [];
+    renderProviders(data.providers);
+    renderAppointments(data.appointments);
+    openChangeFeed();
+  } catch (error) {
+    console.error("Error cargando el tablero", error);
+  }
+}
+
+// ========== Cambios en vivo (long-poll) ==========
+// Long-poll en lugar de SSE: cada espera ocupa un hilo del servidor solo
+// mientras dura y el servidor limita cuántas esperan a la vez (responde con
+// Retry-After cuando está lleno), así varias pestañas no acaparan Waitress.
+const CHANGE_FEED_RETRY_MS = 5000;
+
+function openChangeFeed() {
+  closeChangeFeed();
+  if (!hasActiveSession()) {
+    return;
+  }
+  const params = new URLSearchParams();
+  if (activeSession.user_type === "patient") {
+    params.set("patient_id", activeSession.user_id);
+    params.set("tables", "appointments");
+  } else if (activeSession.user_type === "provider") {
+    params.set("provider_id", activeSession.user_id);
+  }
+  changeFeed = { controller: new AbortController() };
+  pollChangeFeed(changeFeed, params);
+}
+
+function waitMs(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+async function pollChangeFeed(feed, params) {
+  while (changeFeed === feed) {
+    let delayMs = 0;
+    try {
+      const response = await fetch(
+        `${API_BASE}/events?${params}`,
+        withAuthHeaders({ signal: feed.controller.signal })
+      );
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+      const data = await response.json();
+      if (changeFeed !== feed) {
+        return;
+      }
+      if (data.reset) {
+        // Se perdieron eventos: se recarga todo una vez (y se abre otro feed).
+        loadProtectedData();
+        return;
+      }
+      params.set("since", data.version);
+      data.events.forEach(applyChange);
+      const retryAfter = Number(response.headers.get("Retry-After"));
+      delayMs = retryAfter > 0 ? retryAfter * 1000 : 0;
+    } catch (error) {
+      if (changeFeed !== feed) {
+        return;
+      }
+      console.error("Error en el feed de cambios", error);
+      delayMs = CHANGE_FEED_RETRY_MS;
+    }
+    if (delayMs) {
+      await waitMs(delayMs);
+    }
+  }
+}
+
+function closeChangeFeed() {
+  if (changeFeed) {
+    changeFeed.controller.abort();
+    changeFeed = null;
+  }
+}
+
+function mergeById(items, idField, change) {
+  const rest = items.filter((item) => String(item[idField]) !== String(change.id));
+  if (change.op === "delete") {
+    return rest;
+  }
+  const previous = items.find((item) => String(item[idField]) === String(change.id));
+  return [...rest, { ...(previous || {}), ...change.data }];
+}
+
+function applyChange(change) {
+  if (change.table === "appointments") {
+    const merged = mergeById(appointmentsCache, "appointment_id", change);
+    merged.sort((a, b) => String(b.start_at).localeCompare(String(a.start_at)));
+    renderAppointments(merged);
+  } else if (change.table === "provider_availability") {
+    availabilityCache = mergeById(availabilityCache, "availability_id", change);
+    renderAvailabilityTable();
+  }
+  const selectedProvider = appointmentProviderSelect.value;
+  if (selectedProvider && change.provider_ids.map(String).includes(selectedProvider)) {
+    loadProviderAvailability(selectedProvider);
+  }
 }
 
 async function handleLogin(event) {
@@ -729,43 +832,45 @@ async function loadPatients() {
       `${API_BASE}/patients`,
       withAuthHeaders()
     );
-    const patients = await handleResponse(response);
-
-    // Limpiar tabla y selectores
-    patientsCache = Array.isArray(patients) ? patients : [];
-    patientsTableBody.innerHTML = "";
-    appointmentPatientSelect.innerHTML =
-      '<option value="" disabled selected>Selecciona un paciente</option>';
-
-    patientsCache.forEach((patient) => {
-      const row = document.createElement("tr");
-      row.innerHTML = `
-        <td>${patient.patient_id}</td>
-        <td>${patient.first_name}</td>
-        <td>${patient.last_name}</td>
-        <td>${patient.email}</td>
-        <td class="text-center">
-          <button class="btn btn-sm btn-outline-danger" data-id="${patient.patient_id}">
-            Eliminar
-          </button>
-        </td>
-      `;
-      patientsTableBody.appendChild(row);
-
-      const option = document.createElement("option");
-      option.value = patient.patient_id;
-      option.textContent = `${patient.patient_id} - ${patient.first_name} ${patient.last_name}`;
-      appointmentPatientSelect.appendChild(option);
-    });
-
-    if (activeSession && activeSession.user_type === "patient") {
-      appointmentPatientSelect.value = String(activeSession.user_id || "");
-    }
+    renderPatients(await handleResponse(response));
   } catch (error) {
     console.error("Error cargando pacientes", error);
   }
 }
 
+function renderPatients(patients) {
+  // Limpiar tabla y selectores
+  patientsCache = Array.isArray(patients) ? patients : [];
+  patientsTableBody.innerHTML = "";
+  appointmentPatientSelect.innerHTML =
+    '<option value="" disabled selected>Selecciona un paciente</option>';
+
+  patientsCache.forEach((patient) => {
+    const row = document.createElement("tr");
+    row.innerHTML = `
+      <td>${patient.patient_id}</td>
+      <td>${patient.first_name}</td>
+      <td>${patient.last_name}</td>
+      <td>${patient.email}</td>
+      <td class="text-center">
+        <button class="btn btn-sm btn-outline-danger" data-id="${patient.patient_id}">
+          Eliminar
+        </button>
+      </td>
+    `;
+    patientsTableBody.appendChild(row);
+
+    const option = document.createElement("option");
+    option.value = patient.patient_id;
+    option.textContent = `${patient.patient_id} - ${patient.first_name} ${patient.last_name}`;
+    appointmentPatientSelect.appendChild(option);
+  });
+
+  if (activeSession && activeSession.user_type === "patient") {
+    appointmentPatientSelect.value = String(activeSession.user_id || "");
+  }
+}
+
 async function createPatient(event) {
   event.preventDefault();
   if (!ensureAuthenticated()) {
@@ -862,39 +967,42 @@ async function loadProviders() {
       `${API_BASE}/providers`,
       withAuthHeaders()
     );
-    const providers = await handleResponse(response);
-    providersCache = Array.isArray(providers) ? providers : [];
+    renderProviders(await handleResponse(response));
+  } catch (error) {
+    console.error("Error cargando proveedores", error);
+    resetProviderAvailabilityDisplay();
+  }
+}
 
-    populateProviderSelect(
-      appointmentProviderSelect,
-      providersCache,
-      "Selecciona un proveedor"
-    );
-    populateProviderSelect(
-      availabilityProviderSelect,
-      providersCache,
-      "Proveedor para administrar horarios"
-    );
+function renderProviders(providers) {
+  providersCache = Array.isArray(providers) ? providers : [];
 
-    let providerForPreview = appointmentProviderSelect.value;
-    if (activeSession && activeSession.user_type === "provider" && activeSession.user_id) {
-      const providerId = String(activeSession.user_id);
-      appointmentProviderSelect.value = providerId;
-      availabilityProviderSelect.value = providerId;
-      providerForPreview = providerId;
-    }
+  populateProviderSelect(
+    appointmentProviderSelect,
+    providersCache,
+    "Selecciona un proveedor"
+  );
+  populateProviderSelect(
+    availabilityProviderSelect,
+    providersCache,
+    "Proveedor para administrar horarios"
+  );
 
-    if (providerForPreview) {
-      loadProviderAvailability(providerForPreview);
-    } else {
-      resetProviderAvailabilityDisplay();
-    }
-    updateProviderSelectionState();
-    renderAvailabilityTable();
-  } catch (error) {
-    console.error("Error cargando proveedores", error);
+  let providerForPreview = appointmentProviderSelect.value;
+  if (activeSession && activeSession.user_type === "provider" && activeSession.user_id) {
+    const providerId = String(activeSession.user_id);
+    appointmentProviderSelect.value = providerId;
+    availabilityProviderSelect.value = providerId;
+    providerForPreview = providerId;
+  }
+
+  if (providerForPreview) {
+    loadProviderAvailability(providerForPreview);
+  } else {
     resetProviderAvailabilityDisplay();
   }
+  updateProviderSelectionState();
+  renderAvailabilityTable();
 }
 
 async function refreshAvailabilityData() {
@@ -1076,47 +1184,50 @@ async function loadAppointments() {
       `${API_BASE}/appointments`,
       withAuthHeaders()
     );
-    const appointments = await handleResponse(response);
-
-    appointmentsTableBody.innerHTML = "";
-    appointments.forEach((appointment) => {
-      const row = document.createElement("tr");
-      const isCancelable = CANCELABLE_STATUSES.has(appointment.status);
-      const statusClass = STATUS_BADGE_CLASS[appointment.status] || "light";
-      row.innerHTML = `
-        <td>${appointment.appointment_id}</td>
-        <td>
-          <div class="fw-semibold">${escapeHtml(
-            getPatientLabel(appointment.patient_id)
-          )}</div>
-          <div class="text-muted small">ID ${appointment.patient_id}</div>
-        </td>
-        <td>
-          <div class="fw-semibold">${escapeHtml(
-            getProviderLabel(appointment.provider_id)
-          )}</div>
-          <div class="text-muted small">ID ${appointment.provider_id}</div>
-        </td>
-        <td>${escapeHtml(formatDateTimeDisplay(appointment.start_at))}</td>
-        <td>${escapeHtml(formatDateTimeDisplay(appointment.end_at))}</td>
-        <td><span class="badge text-bg-${statusClass}">${escapeHtml(
-          appointment.status
-        )}</span></td>
-        <td class="text-center">
-          ${
-            isCancelable
-              ? `<button class="btn btn-sm btn-outline-warning" data-cancel-id="${appointment.appointment_id}">Cancelar</button>`
-              : ""
-          }
-        </td>
-      `;
-      appointmentsTableBody.appendChild(row);
-    });
+    renderAppointments(await handleResponse(response));
   } catch (error) {
     console.error("Error cargando citas", error);
   }
 }
 
+function renderAppointments(appointments) {
+  appointmentsCache = Array.isArray(appointments) ? appointments : [];
+  appointmentsTableBody.innerHTML = "";
+  appointmentsCache.forEach((appointment) => {
+    const row = document.createElement("tr");
+    const isCancelable = CANCELABLE_STATUSES.has(appointment.status);
+    const statusClass = STATUS_BADGE_CLASS[appointment.status] || "light";
+    row.innerHTML = `
+      <td>${appointment.appointment_id}</td>
+      <td>
+        <div class="fw-semibold">${escapeHtml(
+          appointment.patient_name || getPatientLabel(appointment.patient_id)
+        )}</div>
+        <div class="text-muted small">ID ${appointment.patient_id}</div>
+      </td>
+      <td>
+        <div class="fw-semibold">${escapeHtml(
+          appointment.provider_name || getProviderLabel(appointment.provider_id)
+        )}</div>
+        <div class="text-muted small">ID ${appointment.provider_id}</div>
+      </td>
+      <td>${escapeHtml(formatDateTimeDisplay(appointment.start_at))}</td>
+      <td>${escapeHtml(formatDateTimeDisplay(appointment.end_at))}</td>
+      <td><span class="badge text-bg-${statusClass}">${escapeHtml(
+        appointment.status
+      )}</span></td>
+      <td class="text-center">
+        ${
+          isCancelable
+            ? `<button class="btn btn-sm btn-outline-warning" data-cancel-id="${appointment.appointment_id}">Cancelar</button>`
+            : ""
+        }
+      </td>
+    `;
+    appointmentsTableBody.appendChild(row);
+  });
+}
+
 function formatDateTimeLocal(date) {
   const year = date.getFullYear();
   const month = String(date.getMonth() + 1).padStart(2, "0");
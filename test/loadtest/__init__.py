@@ -0,0 +1,14 @@
+"""Pruebas de carga reproducibles para los requisitos no funcionales del SRS.
+
+- ``seed``: genera una base sintética (proveedores, reglas semanales,
+  excepciones, pacientes y citas) de tamaño configurable.
+- ``run``: levanta la app (o usa un servidor existente) y la somete a una
+  mezcla de login, consulta de disponibilidad, reserva y cancelación con
+  muchos clientes concurrentes; reporta en JSON el rendimiento y los
+  p50/p95/p99 por operación frente a las metas del SRS.
+
+Se ejecutan desde ``test/``::
+
+    python -m loadtest.seed --database-url sqlite:///loadtest.db --providers 200 --appointments 1000000
+    python -m loadtest.run --database-url sqlite:///loadtest.db --clients 500 --duration 120
+"""
@@ -0,0 +1,279 @@
+"""Prueba de carga: mezcla de login, disponibilidad, reserva y cancelación.
+
+Levanta la app en el mismo proceso (Waitress si está instalado, si no el
+servidor de Werkzeug) sobre ``--database-url``, o ataca un servidor ya en
+ejecución con ``--base-url``. Cada cliente virtual inicia sesión como un
+paciente sembrado por ``loadtest.seed`` y repite operaciones elegidas según
+``--mix`` durante ``--duration`` segundos. Imprime en stdout un reporte JSON
+con rendimiento y p50/p95/p99 por operación y lo compara con las metas del
+SRS (p95 <= 3 s, >= 50 citas/min, 500 usuarios concurrentes):
+
+    python -m loadtest.run --database-url sqlite:///loadtest.db --clients 500 --duration 120 \
+        --output reporte.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+DEFAULT_MIX = "login=5,availability=50,book=30,cancel=15"
+P95_TARGET_MS = 3000
+BOOKINGS_PER_MINUTE_TARGET = 50
+CONCURRENT_USERS_TARGET = 500
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--base-url", help="servidor ya en ejecución")
+    target.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///loadtest.db"))
+    parser.add_argument("--server-threads", type=int, default=32, help="hilos del servidor embebido")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=60.0, help="segundos de medición")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="segundos para arrancar a todos los clientes")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pausa media entre operaciones (s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="pesos por operación")
+    parser.add_argument("--patients", type=int, default=5000, help="pacientes sembrados (patient<N>@loadtest.omas)")
+    parser.add_argument("--providers", type=int, default=50, help="proveedores sembrados")
+    parser.add_argument("--pin", default=os.getenv("DEMO_LOGIN_PIN", "4321"))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="archivo donde guardar el reporte JSON")
+    return parser.parse_args(argv)
+
+
+def parse_mix(raw):
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in VirtualClient.OPERATIONS:
+            raise SystemExit(f"Operación desconocida en --mix: {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+def start_embedded_server(args):
+    """Serve ``main.app`` on a free local port in a daemon thread; returns ``(base_url, stop)``."""
+    os.environ["DATABASE_URL"] = args.database_url
+    from main import app
+
+    try:
+        from waitress import create_server
+    except ImportError:
+        from werkzeug.serving import make_server
+
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        port, stop = server.server_port, server.shutdown
+        serve = server.serve_forever
+    else:
+        server = create_server(app, host="127.0.0.1", port=0, threads=args.server_threads)
+        port, stop = server.effective_port, server.close
+        serve = server.run
+    threading.Thread(target=serve, name="loadtest-server", daemon=True).start()
+    return f"http://127.0.0.1:{port}", stop
+
+
+class Recorder:
+    """Thread-safe collection of ``(operation, outcome, latency_ms)`` samples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.recording = False
+
+    def add(self, operation, outcome, latency_ms):
+        if not self.recording:
+            return
+        with self._lock:
+            self.samples.setdefault(operation, []).append((outcome, latency_ms))
+
+
+class VirtualClient:
+    """One simulated patient: logs in, browses providers, books and cancels."""
+
+    OPERATIONS = ("login", "availability", "book", "cancel")
+
+    def __init__(self, base_url, args, recorder, rng):
+        self.base_url = base_url
+        self.args = args
+        self.recorder = recorder
+        self.rng = rng
+        self.http = requests.Session()
+        self.patient_id = None
+        self.slots = {}
+        self.booked = []
+
+    def call(self, operation, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=30, **kwargs)
+        except requests.RequestException:
+            self.recorder.add(operation, "error", (time.perf_counter() - started) * 1000)
+            return None
+        latency_ms = (time.perf_counter() - started) * 1000
+        if response.status_code < 400:
+            outcome = "ok"
+        elif response.status_code == 409:
+            # Otro cliente ganó el horario: es contención esperada, no un fallo.
+            outcome = "conflict"
+        else:
+            outcome = "error"
+        self.recorder.add(operation, outcome, latency_ms)
+        return response
+
+    def login(self):
+        patient = self.rng.randint(1, self.args.patients)
+        response = self.call(
+            "login", "POST", "/auth/login",
+            json={"user_type": "patient", "email": f"patient{patient}@loadtest.omas", "pin": self.args.pin},
+        )
+        if response is not None and response.ok:
+            body = response.json()
+            self.http.headers["X-Session-Token"] = body["token"]
+            self.patient_id = body["user"]["user_id"]
+            self.booked = []
+
+    def availability(self):
+        provider_id = self.rng.randint(1, self.args.providers)
+        response = self.call("availability", "GET", f"/providers/{provider_id}/availability")
+        if response is not None and response.ok:
+            self.slots[provider_id] = response.json().get("upcoming_slots", [])
+
+    def book(self):
+        candidates = [provider_id for provider_id, slots in self.slots.items() if slots]
+        if not candidates:
+            return self.availability()
+        provider_id = self.rng.choice(candidates)
+        slots = self.slots[provider_id]
+        slot = slots.pop(self.rng.randrange(min(len(slots), 10)))
+        response = self.call(
+            "book", "POST", "/appointments/book",
+            json={
+                "patient_id": self.patient_id,
+                "provider_id": provider_id,
+                "start_at": slot["start_at"],
+                "end_at": slot["end_at"],
+            },
+        )
+        if response is not None and response.status_code == 201:
+            self.booked.append(response.json()["appointment_id"])
+
+    def cancel(self):
+        if not self.booked:
+            return self.book()
+        appointment_id = self.booked.pop(self.rng.randrange(len(self.booked)))
+        self.call("cancel", "POST", f"/appointments/{appointment_id}/cancel")
+
+    def run(self, mix, deadline):
+        self.login()
+        operations = list(mix)
+        weights = [mix[name] for name in operations]
+        while time.monotonic() < deadline:
+            if self.patient_id is None:
+                self.login()
+            else:
+                getattr(self, self.rng.choices(operations, weights)[0])()
+            if self.args.think_time:
+                time.sleep(self.rng.expovariate(1 / self.args.think_time))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values))) - 1))
+    return round(sorted_values[rank], 2)
+
+
+def build_report(args, recorder, elapsed):
+    operations = {}
+    for operation, samples in sorted(recorder.samples.items()):
+        latencies = sorted(latency for _, latency in samples)
+        outcomes = {}
+        for outcome, _ in samples:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        operations[operation] = {
+            "requests": len(samples),
+            "ok": outcomes.get("ok", 0),
+            "conflicts": outcomes.get("conflict", 0),
+            "errors": outcomes.get("error", 0),
+            "throughput_rps": round(len(samples) / elapsed, 2),
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": round(latencies[-1], 2) if latencies else None,
+        }
+    total = sum(item["requests"] for item in operations.values())
+    bookings_per_minute = operations.get("book", {}).get("ok", 0) / elapsed * 60
+    worst_p95 = max((item["p95_ms"] or 0 for item in operations.values()), default=0)
+    return {
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "config": {
+            "clients": args.clients,
+            "duration_s": args.duration,
+            "think_time_s": args.think_time,
+            "mix": args.mix,
+            "patients": args.patients,
+            "providers": args.providers,
+            "seed": args.seed,
+            "target": args.base_url or args.database_url,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "total_requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "bookings_per_minute": round(bookings_per_minute, 1),
+        "operations": operations,
+        "nfr": {
+            "p95_le_3s": worst_p95 <= P95_TARGET_MS,
+            "bookings_per_minute_ge_50": bookings_per_minute >= BOOKINGS_PER_MINUTE_TARGET,
+            "concurrent_users_ge_500": args.clients >= CONCURRENT_USERS_TARGET,
+        },
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mix = parse_mix(args.mix)
+    stop_server = None
+    base_url = args.base_url
+    if base_url is None:
+        base_url, stop_server = start_embedded_server(args)
+    base_url = base_url.rstrip("/")
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    clients = [VirtualClient(base_url, args, recorder, random.Random(rng.random())) for _ in range(args.clients)]
+    deadline = time.monotonic() + args.ramp_up + args.duration
+    threads = []
+    for client in clients:
+        thread = threading.Thread(target=client.run, args=(mix, deadline), daemon=True)
+        threads.append(thread)
+        thread.start()
+        time.sleep(args.ramp_up / max(len(clients), 1))
+
+    # Solo se mide la ventana posterior al arranque gradual.
+    recorder.recording = True
+    started = time.monotonic()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    if stop_server is not None:
+        stop_server()
+
+    report = build_report(args, recorder, elapsed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    print(text)
+    for name, passed in report["nfr"].items():
+        print(f"{'OK   ' if passed else 'FALLA'} {name}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Generador de datos sintéticos para las pruebas de carga.
+
+Crea proveedores con reglas semanales, excepciones únicas y un bloqueo semanal
+recurrente por proveedor, pacientes y un historial
+de citas sin traslapes (más una fracción de citas futuras), todo con
+inserciones ``executemany`` por bloques e ids explícitos. Con la misma
+``--seed`` produce siempre la misma base:
+
+    python -m loadtest.seed --database-url sqlite:///loadtest.db --reset \
+        --providers 200 --patients 50000 --appointments 1000000
+"""
+import argparse
+import importlib
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from datetime import time as dt_time
+
+SPECIALTIES = ("Cardiology", "Dermatology", "Pediatrics", "General", "Neurology", "Orthopedics")
+TIMEZONES = ("America/Mexico_City", "America/Mexico_City", "America/Monterrey", "America/Tijuana")
+# (inicio, fin) en horas de los turnos de un día laboral.
+SHIFTS = ((9, 13), (15, 19))
+SLOT_MINUTES = 30
+PAST_STATUSES = ("completed",) * 17 + ("no_show", "canceled", "canceled")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///loadtest.db"))
+    parser.add_argument("--reset", action="store_true", help="borra y recrea las tablas antes de sembrar")
+    parser.add_argument("--providers", type=int, default=50)
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument("--appointments", type=int, default=100000, help="citas pasadas a generar")
+    parser.add_argument("--future-days", type=int, default=14)
+    parser.add_argument("--future-fill", type=float, default=0.3, help="fracción de horarios futuros ocupados")
+    parser.add_argument("--exceptions", type=int, default=4, help="excepciones por proveedor")
+    parser.add_argument("--recurring-weeks", type=int, default=52, help="semanas del bloqueo recurrente (0 = sin él)")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def load_app(database_url):
+    """Import ``main`` bound to ``database_url`` (it reads DATABASE_URL at import)."""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("AUDIT_MODE", "off")
+    return importlib.import_module("main")
+
+
+def insert_chunks(conn, table, rows, chunk_size):
+    """Insert an iterable of dicts with one ``executemany`` per chunk; returns the row count."""
+    total = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            conn.execute(table.insert(), chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        conn.execute(table.insert(), chunk)
+        total += len(chunk)
+    return total
+
+
+def provider_rows(count, rng):
+    now = datetime.utcnow()
+    for provider_id in range(1, count + 1):
+        yield {
+            "provider_id": provider_id,
+            "display_name": f"Proveedor {provider_id}",
+            "specialty": SPECIALTIES[provider_id % len(SPECIALTIES)],
+            "email": f"provider{provider_id}@loadtest.omas",
+            "timezone": rng.choice(TIMEZONES),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def patient_rows(count):
+    now = datetime.utcnow()
+    for patient_id in range(1, count + 1):
+        yield {
+            "patient_id": patient_id,
+            "first_name": "Paciente",
+            "last_name": str(patient_id),
+            "email": f"patient{patient_id}@loadtest.omas",
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def provider_weekdays(provider_id):
+    # Lunes a viernes; uno de cada tres proveedores atiende también el sábado.
+    return range(1, 7) if provider_id % 3 == 0 else range(1, 6)
+
+
+def availability_rows(providers):
+    availability_id = 0
+    for provider_id in range(1, providers + 1):
+        for weekday in provider_weekdays(provider_id):
+            for start_hour, end_hour in SHIFTS:
+                availability_id += 1
+                yield {
+                    "availability_id": availability_id,
+                    "provider_id": provider_id,
+                    "weekday": weekday,
+                    "start_time": dt_time(start_hour),
+                    "end_time": dt_time(end_hour),
+                    "location": f"Consultorio {provider_id % 20 + 1}",
+                }
+
+
+def exception_rows(providers, per_provider, future_days, recurring_weeks, rng):
+    exception_id = 0
+    today = date.today()
+    for provider_id in range(1, providers + 1):
+        for _ in range(per_provider):
+            exception_id += 1
+            day = today + timedelta(days=rng.randint(-60, future_days))
+            start_at = datetime.combine(day, dt_time(rng.choice((9, 11, 15, 17))))
+            yield {
+                "exception_id": exception_id,
+                "provider_id": provider_id,
+                "start_at": start_at,
+                "end_at": start_at + timedelta(hours=2),
+                "reason": "Bloqueo sintético",
+                "is_blocking": True,
+                # executemany toma las columnas de la primera fila: todas llevan las mismas llaves.
+                "recurrence": None,
+                "recurrence_interval": 1,
+                "recurrence_until": None,
+                "recurrence_count": None,
+                "series_end_at": start_at + timedelta(hours=2),
+                "created_at": datetime.utcnow(),
+            }
+        if recurring_weeks:
+            # Una tarde por semana bloqueada desde hace dos meses.
+            exception_id += 1
+            day = today - timedelta(weeks=8) + timedelta(days=rng.randint(0, 4) - today.weekday())
+            start_at = datetime.combine(day, dt_time(17))
+            yield {
+                "exception_id": exception_id,
+                "provider_id": provider_id,
+                "start_at": start_at,
+                "end_at": start_at + timedelta(hours=2),
+                "reason": "Bloqueo semanal sintético",
+                "is_blocking": True,
+                "recurrence": "weekly",
+                "recurrence_interval": 1,
+                "recurrence_until": None,
+                "recurrence_count": recurring_weeks,
+                "series_end_at": start_at + timedelta(weeks=recurring_weeks - 1, hours=2),
+                "created_at": datetime.utcnow(),
+            }
+
+
+def day_slots(day):
+    for start_hour, end_hour in SHIFTS:
+        slot = datetime.combine(day, dt_time(start_hour))
+        end = datetime.combine(day, dt_time(end_hour))
+        while slot + timedelta(minutes=SLOT_MINUTES) <= end:
+            yield slot
+            slot += timedelta(minutes=SLOT_MINUTES)
+
+
+def appointment_rows(args, rng):
+    """Past appointments walking back from yesterday, then booked future ones.
+
+    Each provider gets ``appointments / providers`` past rows filling 80% of its
+    slots, so rows never overlap and history depth grows with the volume.
+    """
+    appointment_id = 0
+    now = datetime.utcnow()
+    today = date.today()
+    per_provider, remainder = divmod(args.appointments, args.providers)
+    for provider_id in range(1, args.providers + 1):
+        weekdays = set(provider_weekdays(provider_id))
+        pending = per_provider + (1 if provider_id <= remainder else 0)
+        day = today - timedelta(days=1)
+        while pending > 0:
+            if day.isoweekday() in weekdays:
+                for slot in day_slots(day):
+                    if pending == 0:
+                        break
+                    if rng.random() < 0.8:
+                        pending -= 1
+                        appointment_id += 1
+                        yield {
+                            "appointment_id": appointment_id,
+                            "patient_id": rng.randint(1, args.patients),
+                            "provider_id": provider_id,
+                            "start_at": slot,
+                            "end_at": slot + timedelta(minutes=SLOT_MINUTES),
+                            "status": rng.choice(PAST_STATUSES),
+                            "created_at": now,
+                            "updated_at": now,
+                        }
+            day -= timedelta(days=1)
+
+        for offset in range(1, args.future_days + 1):
+            day = today + timedelta(days=offset)
+            if day.isoweekday() not in weekdays:
+                continue
+            for slot in day_slots(day):
+                if rng.random() < args.future_fill:
+                    appointment_id += 1
+                    yield {
+                        "appointment_id": appointment_id,
+                        "patient_id": rng.randint(1, args.patients),
+                        "provider_id": provider_id,
+                        "start_at": slot,
+                        "end_at": slot + timedelta(minutes=SLOT_MINUTES),
+                        "status": "booked",
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+
+
+def seed(omas, args):
+    """Populate the database of ``omas`` (the imported ``main`` module); returns row counts."""
+    rng = random.Random(args.seed)
+    if args.reset:
+        omas.Base.metadata.drop_all(omas.engine)
+    omas.Base.metadata.create_all(omas.engine)
+
+    counts = {}
+    steps = (
+        (omas.Provider, lambda: provider_rows(args.providers, rng)),
+        (omas.Patient, lambda: patient_rows(args.patients)),
+        (omas.ProviderAvailability, lambda: availability_rows(args.providers)),
+        (omas.ProviderException, lambda: exception_rows(args.providers, args.exceptions, args.future_days, args.recurring_weeks, rng)),
+        (omas.Appointment, lambda: appointment_rows(args, rng)),
+    )
+    with omas.engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+    for model, rows in steps:
+        started = time.perf_counter()
+        with omas.engine.begin() as conn:
+            counts[model.__tablename__] = insert_chunks(conn, model.__table__, rows(), args.chunk_size)
+        print(
+            f"{model.__tablename__}: {counts[model.__tablename__]} filas en {time.perf_counter() - started:.1f}s",
+            file=sys.stderr,
+        )
+    return counts
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.providers < 1 or args.patients < 1:
+        raise SystemExit("Se necesita al menos un proveedor y un paciente.")
+    omas = load_app(args.database_url)
+    seed(omas, args)
+
+
+if __name__ == "__main__":
+    main()
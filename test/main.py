@@ -1,20 +1,44 @@
 # main.py
+import atexit
+import calendar
+import hashlib
+import heapq
+import hmac
+import json
 import logging
 import os
+import queue
 import secrets
-from datetime import datetime, date, time, timezone, timedelta
+import sqlite3
+import tempfile
+import threading
+import time as monotonic_clock
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from datetime import MAXYEAR, datetime, date, time, timezone, timedelta
 from decimal import Decimal
 from functools import wraps
+from itertools import chain, islice
 from pathlib import Path
-from flask import Flask, jsonify, request, send_from_directory, g
+from urllib.parse import urlencode
+from flask import Flask, Response, jsonify, request, send_from_directory, g, has_request_context
 from sqlalchemy import (
     create_engine, Column, BigInteger, Integer, String, Text, Date, DateTime, Time,
-    Enum, ForeignKey, Boolean, Numeric, JSON, func
+    Enum, ForeignKey, Boolean, Numeric, JSON, Index, UniqueConstraint, func, insert, or_, select, text,
+    tuple_, union_all, update, event
 )
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+try:
+    import orjson
+except ImportError:  # dependencia opcional: se usa json de la biblioteca estándar
+    orjson = None
+
 # ========= Config =========
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
@@ -22,6 +46,55 @@ DATABASE_URL = os.getenv(
 )
 DEMO_LOGIN_PIN = os.getenv("DEMO_LOGIN_PIN", "4321")
 SESSION_DURATION_MINUTES = int(os.getenv("SESSION_DURATION_MINUTES", "60"))
+# Procesos que sirven la app. Con más de uno, los contadores de versión, la
+# caché, el feed y las sesiones se comparten en SQLite (SHARED_STATE_SQLITE_PATH):
+# con estado por proceso, un 304 podría validar datos que otro proceso ya cambió.
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+SHARED_STATE_SQLITE_PATH = os.getenv("SHARED_STATE_SQLITE_PATH") or (
+    os.path.join(tempfile.gettempdir(), "omas-shared.db") if WEB_WORKERS > 1 else ""
+)
+SESSION_STORE_SQLITE_PATH = os.getenv("SESSION_STORE_SQLITE_PATH", SHARED_STATE_SQLITE_PATH)
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", "500"))
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", "1000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+AVAILABILITY_INDEX_TTL_SECONDS = int(os.getenv("AVAILABILITY_INDEX_TTL_SECONDS", "300"))
+AVAILABILITY_CACHE_SIZE = int(os.getenv("AVAILABILITY_CACHE_SIZE", "1024"))
+AVAILABILITY_CACHE_TTL_SECONDS = int(os.getenv("AVAILABILITY_CACHE_TTL_SECONDS", "60"))
+AVAILABILITY_CACHE_SQLITE_PATH = os.getenv("AVAILABILITY_CACHE_SQLITE_PATH", SHARED_STATE_SQLITE_PATH)
+TABLE_VERSIONS_SQLITE_PATH = os.getenv("TABLE_VERSIONS_SQLITE_PATH", AVAILABILITY_CACHE_SQLITE_PATH)
+NOTIFICATION_PREFERENCES_TTL_SECONDS = int(os.getenv("NOTIFICATION_PREFERENCES_TTL_SECONDS", "300"))
+AUDIT_MODE = os.getenv("AUDIT_MODE", "batched")  # batched | sync | off
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1.0"))
+BOOKING_LOCK_STRIPES = int(os.getenv("BOOKING_LOCK_STRIPES", "64"))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "20000"))
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "5"))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+CHANGE_FEED_SIZE = int(os.getenv("CHANGE_FEED_SIZE", "1000"))
+CHANGE_FEED_SQLITE_PATH = os.getenv("CHANGE_FEED_SQLITE_PATH", AVAILABILITY_CACHE_SQLITE_PATH)
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_STREAM_SECONDS = float(os.getenv("EVENTS_STREAM_SECONDS", "300"))
+EVENTS_LONG_POLL_SECONDS = float(os.getenv("EVENTS_LONG_POLL_SECONDS", "25"))
+# Esperas abiertas (SSE o long-poll) por proceso; conviene dejarlo en la mitad
+# de los hilos de Waitress (ver README) para que el resto del API siga libre.
+EVENTS_MAX_WAITERS = int(os.getenv("EVENTS_MAX_WAITERS", "8"))
+EVENTS_BUSY_RETRY_SECONDS = int(os.getenv("EVENTS_BUSY_RETRY_SECONDS", "5"))
+# Proveedores que pueden ver el tablero del día de toda la clínica (lista separada por comas).
+ADMIN_PROVIDER_IDS = {int(value) for value in os.getenv("ADMIN_PROVIDER_IDS", "").split(",") if value.strip()}
+WAITLIST_HOLD_MINUTES = int(os.getenv("WAITLIST_HOLD_MINUTES", "15"))
+WAITLIST_SWEEP_SECONDS = float(os.getenv("WAITLIST_SWEEP_SECONDS", "30"))
+WAITLIST_INDEX_TTL_SECONDS = int(os.getenv("WAITLIST_INDEX_TTL_SECONDS", "300"))
+CALENDAR_PAST_DAYS = int(os.getenv("CALENDAR_PAST_DAYS", "30"))
+CALENDAR_FUTURE_DAYS = int(os.getenv("CALENDAR_FUTURE_DAYS", "180"))
+CALENDAR_CACHE_SIZE = int(os.getenv("CALENDAR_CACHE_SIZE", "50000"))
+# Sin secreto fijo, los enlaces de calendario dejan de servir al reiniciar.
+CALENDAR_FEED_SECRET = os.getenv("CALENDAR_FEED_SECRET") or secrets.token_hex(16)
 
 engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
@@ -31,14 +104,141 @@ logger = logging.getLogger(__name__)
 
 
 # ========= Sesiones ligeras =========
-SESSIONS = {}
+class SQLiteBackend:
+    """Base for small stores shared between worker processes through a SQLite file."""
 
+    schema = ()
 
-def _cleanup_sessions():
-    now = datetime.utcnow()
-    expired_tokens = [token for token, data in SESSIONS.items() if data["expires_at"] <= now]
-    for token in expired_tokens:
-        SESSIONS.pop(token, None)
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        for statement in self.schema:
+            conn.execute(statement)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+
+def _epoch(value):
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class MemorySessionStore:
+    """Per-process session store.
+
+    Expirations are kept in a min-heap, so each request only pops the tokens
+    that are already due instead of scanning every session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._expirations = []
+
+    def put(self, token, session_data):
+        with self._lock:
+            self._sessions[token] = session_data
+            heapq.heappush(self._expirations, (session_data["expires_at"], token))
+            self._purge(datetime.utcnow())
+
+    def get(self, token):
+        now = datetime.utcnow()
+        with self._lock:
+            self._purge(now)
+            session_data = self._sessions.get(token)
+        if session_data and session_data["expires_at"] <= now:
+            return None
+        return session_data
+
+    def pop(self, token):
+        # La entrada del heap se descarta cuando le llegue su expiración.
+        with self._lock:
+            return self._sessions.pop(token, None)
+
+    def _purge(self, now):
+        while self._expirations and self._expirations[0][0] <= now:
+            _, token = heapq.heappop(self._expirations)
+            session_data = self._sessions.get(token)
+            if session_data is not None and session_data["expires_at"] <= now:
+                del self._sessions[token]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SQLiteBackend):
+    """Session store shared by several worker processes.
+
+    Lookups are primary-key reads filtered by expiry; expired rows are purged
+    through the ``expires_at`` index at most once per ``purge_interval``.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        " token TEXT PRIMARY KEY,"
+        " data TEXT NOT NULL,"
+        " expires_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)",
+    )
+
+    def __init__(self, path, purge_interval=60):
+        super().__init__(path)
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+
+    def put(self, token, session_data):
+        data = {k: v for k, v in session_data.items() if k != "expires_at"}
+        self._connect().execute(
+            "INSERT OR REPLACE INTO sessions (token, data, expires_at) VALUES (?, ?, ?)",
+            (token, json.dumps(data), _epoch(session_data["expires_at"])),
+        )
+        self._maybe_purge()
+
+    def get(self, token):
+        now = _epoch(datetime.utcnow())
+        self._maybe_purge()
+        row = self._connect().execute(
+            "SELECT data, expires_at FROM sessions WHERE token = ? AND expires_at > ?",
+            (token, now),
+        ).fetchone()
+        if not row:
+            return None
+        session_data = json.loads(row[0])
+        session_data["expires_at"] = datetime.utcfromtimestamp(row[1])
+        return session_data
+
+    def pop(self, token):
+        session_data = self.get(token)
+        self._connect().execute("DELETE FROM sessions WHERE token = ?", (token,))
+        return session_data
+
+    def _maybe_purge(self):
+        now = monotonic_clock.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        self._connect().execute(
+            "DELETE FROM sessions WHERE expires_at <= ?", (_epoch(datetime.utcnow()),)
+        )
+
+    def __len__(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (_epoch(datetime.utcnow()),)
+        ).fetchone()
+        return row[0]
+
+
+SESSIONS = (
+    SQLiteSessionStore(SESSION_STORE_SQLITE_PATH)
+    if SESSION_STORE_SQLITE_PATH
+    else MemorySessionStore()
+)
 
 
 def _session_payload(session_data):
@@ -50,14 +250,7 @@ def _session_payload(session_data):
 def _resolve_session(token):
     if not token:
         return None
-    _cleanup_sessions()
-    session_data = SESSIONS.get(token)
-    if not session_data:
-        return None
-    if session_data["expires_at"] <= datetime.utcnow():
-        SESSIONS.pop(token, None)
-        return None
-    return session_data
+    return SESSIONS.get(token)
 
 
 def create_session(user_type: str, user_obj):
@@ -77,7 +270,7 @@ def create_session(user_type: str, user_obj):
         "email": user_obj.email,
         "expires_at": datetime.utcnow() + timedelta(minutes=SESSION_DURATION_MINUTES),
     }
-    SESSIONS[token] = session_data
+    SESSIONS.put(token, session_data)
     return session_data
 
 
@@ -106,6 +299,182 @@ def require_auth(allowed_roles=None):
 
     return decorator
 
+# ========= Réplicas de lectura =========
+class Replica:
+    __slots__ = ("url", "engine", "healthy", "failures", "last_error")
+
+    def __init__(self, url):
+        self.url = url
+        self.engine = create_engine(url, pool_pre_ping=True, future=True)
+        self.healthy = True
+        self.failures = 0
+        self.last_error = None
+
+
+class ReplicaPool:
+    """Round-robin over the read replicas that passed their last health check.
+
+    A replica is ejected as soon as a query on it fails with a connection
+    error, and a daemon thread probes every replica each ``check_seconds`` to
+    eject unreachable ones and put recovered ones back in rotation.
+    """
+
+    # Consulta de salud: además de la conexión, confirma que el esquema existe.
+    PROBE = text("SELECT 1 FROM providers LIMIT 1")
+
+    def __init__(self, urls, check_seconds):
+        self.replicas = [Replica(url) for url in urls]
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._next = 0
+        self._thread = None
+        for replica in self.replicas:
+            event.listen(replica.engine, "handle_error", self._on_error(replica))
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def pick(self):
+        """Return the next healthy replica, or ``None`` when all are ejected."""
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+                if replica.healthy:
+                    return replica
+        return None
+
+    def eject(self, replica, error):
+        with self._lock:
+            if replica.healthy:
+                logger.warning("Réplica %s fuera de rotación: %s", replica.url, error)
+            replica.healthy = False
+            replica.failures += 1
+            replica.last_error = str(error)
+
+    def _on_error(self, replica):
+        def handle_error(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+                self.eject(replica, context.original_exception)
+        return handle_error
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    conn.execute(self.PROBE)
+            except Exception as exc:
+                self.eject(replica, exc)
+            else:
+                with self._lock:
+                    if not replica.healthy:
+                        logger.info("Réplica %s de vuelta en rotación", replica.url)
+                    replica.healthy = True
+
+    def start(self):
+        if not self.replicas or self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                monotonic_clock.sleep(self.check_seconds)
+                self.check()
+
+        self._thread = threading.Thread(target=loop, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return [
+                {"url": replica.url, "healthy": replica.healthy, "failures": replica.failures}
+                for replica in self.replicas
+            ]
+
+
+REPLICAS = ReplicaPool(DATABASE_REPLICA_URLS, REPLICA_CHECK_SECONDS)
+REPLICAS.start()
+
+# token de sesión -> momento de su última escritura (solo en este proceso).
+_RECENT_WRITERS = OrderedDict()
+_RECENT_WRITERS_LOCK = threading.Lock()
+
+
+def _session_token():
+    current = g.get("current_session")
+    return current["token"] if current else None
+
+
+def _recently_wrote(token):
+    if not token:
+        return False
+    cutoff = monotonic_clock.monotonic() - REPLICA_STICKY_SECONDS
+    with _RECENT_WRITERS_LOCK:
+        while _RECENT_WRITERS and next(iter(_RECENT_WRITERS.values())) < cutoff:
+            _RECENT_WRITERS.popitem(last=False)
+        return token in _RECENT_WRITERS
+
+
+def _pin_primary_after_commit(session):
+    """A commit on the primary keeps the rest of the request, and the caller's
+    reads for ``REPLICA_STICKY_SECONDS``, on the primary."""
+    if not REPLICAS or "replica" in session.info or not has_request_context():
+        return
+    g.pinned_primary = True
+    token = _session_token()
+    if token:
+        with _RECENT_WRITERS_LOCK:
+            _RECENT_WRITERS.pop(token, None)
+            _RECENT_WRITERS[token] = monotonic_clock.monotonic()
+
+
+event.listen(SessionLocal, "after_commit", _pin_primary_after_commit)
+
+
+def read_session():
+    """Session for a read-only handler: a healthy replica when routing allows it.
+
+    Falls back to the primary outside :func:`read_only` handlers, after a
+    write in the same request or by the same session token, or when every
+    replica is ejected.
+    """
+    if (
+        REPLICAS
+        and has_request_context()
+        and g.get("read_only")
+        and not g.get("pinned_primary")
+        and not _recently_wrote(_session_token())
+    ):
+        replica = REPLICAS.pick()
+        if replica is not None:
+            db = SessionLocal(bind=replica.engine)
+            db.info["replica"] = replica
+            g.used_replica = replica
+            return db
+    return SessionLocal()
+
+
+def read_only(func):
+    """Route the handler's :func:`read_session` calls to the replicas.
+
+    If a replica fails mid-request it is ejected and the handler runs once
+    more against the primary.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as exc:
+            replica = g.pop("used_replica", None)
+            if replica is None:
+                raise
+            if replica.healthy:
+                REPLICAS.eject(replica, exc)
+            g.pinned_primary = True
+            return func(*args, **kwargs)
+
+    return wrapper
+
 # ========= Util =========
 def serialize_value(v):
     if isinstance(v, Decimal):
@@ -118,8 +487,120 @@ def serialize_value(v):
         return v.isoformat(timespec="seconds")
     return v
 
+def _serialized_expression(column, ref):
+    """Python expression that renders ``ref`` like :func:`serialize_value` for ``column``."""
+    if isinstance(column.type, DateTime):
+        return f"(None if {ref} is None else {ref}.isoformat(sep=' ', timespec='seconds'))"
+    if isinstance(column.type, Date):
+        return f"(None if {ref} is None else {ref}.isoformat())"
+    if isinstance(column.type, Time):
+        return f"(None if {ref} is None else {ref}.isoformat(timespec='seconds'))"
+    if isinstance(column.type, Numeric):
+        return f"(None if {ref} is None else float({ref}))"
+    return ref
+
+
+class SerializerRegistry:
+    """Per-model serializers generated once from the column types.
+
+    ``for_model`` returns ``fn(obj) -> dict`` for ORM instances and
+    ``for_columns`` returns ``fn(row) -> dict`` for Core rows selected over
+    those columns, so list endpoints never build ORM instances. Each function
+    is compiled to straight-line code: no reflection or ``isinstance`` chain
+    per row.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_model = {}
+        self._by_columns = {}
+
+    def for_model(self, model):
+        serializer = self._by_model.get(model)
+        if serializer is None:
+            attrs = [(attr.key, attr.columns[0]) for attr in sa_inspect(model).column_attrs]
+            lines = [f"    v{i} = obj.{key}" for i, (key, _) in enumerate(attrs)]
+            items = [
+                f"{column.name!r}: {_serialized_expression(column, f'v{i}')}"
+                for i, (_, column) in enumerate(attrs)
+            ]
+            serializer = self._compile(f"serialize_{model.__tablename__}", "obj", lines, items)
+            with self._lock:
+                self._by_model[model] = serializer
+        return serializer
+
+    def for_columns(self, columns):
+        columns = tuple(columns)
+        serializer = self._by_columns.get(columns)
+        if serializer is None:
+            names = ", ".join(f"v{i}" for i in range(len(columns)))
+            lines = [f"    {names}, = row"]
+            items = [
+                f"{column.name!r}: {_serialized_expression(column, f'v{i}')}"
+                for i, column in enumerate(columns)
+            ]
+            serializer = self._compile("serialize_row", "row", lines, items)
+            with self._lock:
+                self._by_columns[columns] = serializer
+        return serializer
+
+    @staticmethod
+    def _compile(name, arg, lines, items):
+        source = "\n".join([f"def {name}({arg}):", *lines, "    return {" + ", ".join(items) + "}"])
+        namespace = {}
+        exec(compile(source, f"<serializer {name}>", "exec"), namespace)
+        return namespace[name]
+
+
+SERIALIZERS = SerializerRegistry()
+
+
 def to_dict(obj):
-    return {c.name: serialize_value(getattr(obj, c.name)) for c in obj.__table__.columns}
+    return SERIALIZERS.for_model(type(obj))(obj)
+
+
+def row_to_dict(row):
+    """Serialize an arbitrary Core result row (prefer ``SERIALIZERS.for_columns``)."""
+    return {key: serialize_value(value) for key, value in row._mapping.items()}
+
+
+def dumps_json(payload):
+    """Encode ``payload`` to JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(payload, status=200):
+    return Response(dumps_json(payload), status=status, mimetype="application/json")
+
+
+def row_snapshot(obj):
+    """Return the raw column values of an ORM instance keyed by column name."""
+    return {
+        attr.columns[0].name: getattr(obj, attr.key)
+        for attr in sa_inspect(obj).mapper.column_attrs
+    }
+
+
+def resolve_timezone(name):
+    """Return ``(tzinfo, name)`` for a provider timezone, falling back to UTC."""
+    if name:
+        try:
+            return ZoneInfo(name), name
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return timezone.utc, "UTC"
+
+
+def local_to_utc(moment, tz):
+    """Naive UTC instant of the naive wall time ``moment`` in ``tz``."""
+    return moment.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def utc_to_local(moment, tz):
+    """Naive wall time in ``tz`` of the naive UTC instant ``moment``."""
+    return moment.replace(tzinfo=timezone.utc).astimezone(tz).replace(tzinfo=None)
 
 
 def normalize_datetime(value):
@@ -171,25 +652,210 @@ def normalize_numeric(value):
     raise ValueError(f"Unsupported numeric value: {value!r}")
 
 
-def coerce_payload(model, data):
-    """Convert string payload values to the SQLAlchemy column python types."""
-    for column in model.__table__.columns:
-        key = column.name
-        if key not in data:
-            continue
-        value = data[key]
-        try:
-            if isinstance(column.type, DateTime):
-                data[key] = normalize_datetime(value)
-            elif isinstance(column.type, Date):
-                data[key] = normalize_date(value)
-            elif isinstance(column.type, Time):
-                data[key] = normalize_time(value)
-            elif isinstance(column.type, Numeric):
-                data[key] = normalize_numeric(value)
-        except ValueError as exc:
-            raise ValueError(f"Invalid value for {key}: {exc}") from exc
-    return data
+def normalize_email(value):
+    """Emails are stored trimmed and lower-cased so logins can use the unique index."""
+    if value is None:
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"Unsupported email value: {value!r}")
+    return value.strip().lower()
+
+
+def coerce_integer(value):
+    if isinstance(value, bool):
+        raise ValueError(f"Unsupported integer value: {value!r}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip():
+        return int(value.strip())
+    raise ValueError(f"Unsupported integer value: {value!r}")
+
+
+def coerce_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in {"1", "true", "yes"}:
+            return True
+        if lowered in {"0", "false", "no"}:
+            return False
+    raise ValueError(f"Unsupported boolean value: {value!r}")
+
+
+def _string_coercer(length):
+    def coerce_string(value):
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f"Unsupported text value: {value!r}")
+        value = str(value)
+        if length and len(value) > length:
+            raise ValueError(f"excede {length} caracteres")
+        return value
+    return coerce_string
+
+
+def _enum_coercer(choices):
+    allowed = frozenset(choices)
+
+    def coerce_enum(value):
+        if value not in allowed:
+            raise ValueError(f"debe ser uno de: {', '.join(choices)}")
+        return value
+    return coerce_enum
+
+
+def _identity(value):
+    return value
+
+
+def _normalized(normalize, coercer):
+    def coerce(value):
+        return coercer(normalize(value))
+    return coerce
+
+
+_COLUMN_COERCERS = {}
+
+
+def column_coercer(column):
+    """Return the cached ``value -> python value`` function for ``column``."""
+    coercer = _COLUMN_COERCERS.get(column)
+    if coercer is None:
+        coltype = column.type
+        if isinstance(coltype, TypeDecorator):
+            coltype = coltype.impl
+        if isinstance(coltype, DateTime):
+            coercer = normalize_datetime
+        elif isinstance(coltype, Date):
+            coercer = normalize_date
+        elif isinstance(coltype, Time):
+            coercer = normalize_time
+        elif isinstance(coltype, Numeric):
+            coercer = normalize_numeric
+        elif isinstance(coltype, Boolean):
+            coercer = coerce_boolean
+        elif isinstance(coltype, Integer):
+            coercer = coerce_integer
+        elif isinstance(coltype, Enum):
+            coercer = _enum_coercer(coltype.enums)
+        elif isinstance(coltype, String):
+            coercer = _string_coercer(coltype.length)
+        else:
+            coercer = _identity
+        if column.name == "email":
+            coercer = _normalized(normalize_email, coercer)
+        _COLUMN_COERCERS[column] = coercer
+    return coercer
+
+
+class PayloadError(ValueError):
+    """Invalid request payload; ``errors`` maps every offending field to its message."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(
+            "Datos inválidos: " + "; ".join(f"{field}: {message}" for field, message in errors.items())
+        )
+
+
+# Columnas que administra el servidor y que nunca se aceptan en la entrada.
+READ_ONLY_COLUMNS = {"created_at", "updated_at", "series_end_at"}
+
+
+class ModelSchema:
+    """Input schema compiled once per model: field name -> (attribute, coercer, nullable).
+
+    Validation only walks the fields present in the payload; unknown and
+    read-only fields (primary key, timestamps) are rejected up front and every
+    error is reported together in a :class:`PayloadError`.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = {}
+        self.read_only = set()
+        self.required = set()
+        for attr in sa_inspect(model).column_attrs:
+            column = attr.columns[0]
+            if column.primary_key or column.name in READ_ONLY_COLUMNS:
+                self.read_only.add(column.name)
+                continue
+            self.fields[column.name] = (attr.key, column_coercer(column), column.nullable)
+            if not column.nullable and column.default is None and column.server_default is None:
+                self.required.add(column.name)
+
+    def validate(self, data, partial=False):
+        """Return the coerced payload keyed by attribute name.
+
+        ``partial`` (updates) skips the required-field check.
+        """
+        if not isinstance(data, dict):
+            raise PayloadError({"_": "el cuerpo debe ser un objeto JSON"})
+        errors = {}
+        payload = {}
+        for name, value in data.items():
+            field = self.fields.get(name)
+            if field is None:
+                errors[name] = "campo de solo lectura" if name in self.read_only else "campo desconocido"
+                continue
+            key, coercer, nullable = field
+            if value is not None:
+                try:
+                    value = coercer(value)
+                except (ValueError, TypeError, ArithmeticError) as exc:
+                    errors[name] = str(exc) or "valor inválido"
+                    continue
+            if value is None and not nullable:
+                errors[name] = "es obligatorio"
+                continue
+            payload[key] = value
+        if not partial:
+            for name in self.required.difference(data):
+                errors[name] = "es obligatorio"
+        if errors:
+            raise PayloadError(errors)
+        return payload
+
+    def validate_many(self, items, partial=False):
+        """Validate a list of payloads; returns ``(payloads, {index: errors})``.
+
+        Invalid items are ``None`` in ``payloads`` so results keep their position.
+        """
+        payloads = []
+        errors = {}
+        for index, item in enumerate(items):
+            try:
+                payloads.append(self.validate(item, partial=partial))
+            except PayloadError as exc:
+                payloads.append(None)
+                errors[index] = exc.errors
+        return payloads, errors
+
+
+SCHEMAS = {}
+
+
+def schema_for(model):
+    schema = SCHEMAS.get(model)
+    if schema is None:
+        schema = SCHEMAS[model] = ModelSchema(model)
+    return schema
+
+
+def coerce_payload(model, data, partial=False):
+    """Validate ``data`` against the compiled schema of ``model`` (see :class:`ModelSchema`)."""
+    return schema_for(model).validate(data, partial=partial)
+
+
+def error_body(exc):
+    body = {"error": str(exc)}
+    if isinstance(exc, PayloadError):
+        body["fields"] = exc.errors
+    return body
 
 
 def appointment_overlaps(db_session, provider_id, start_at, end_at, exclude_id=None):
@@ -208,9 +874,13 @@ def appointment_overlaps(db_session, provider_id, start_at, end_at, exclude_id=N
     return query.first() is not None
 
 # ========= Modelos =========
+# En SQLite solo INTEGER PRIMARY KEY es autoincremental (base local de pruebas de carga).
+BigId = BigInteger().with_variant(Integer, "sqlite")
+
+
 class Patient(Base):
     __tablename__ = "patients"
-    patient_id   = Column(BigInteger, primary_key=True, autoincrement=True)
+    patient_id   = Column(BigId, primary_key=True, autoincrement=True)
     first_name   = Column(String(80), nullable=False)
     last_name    = Column(String(80), nullable=False)
     email        = Column(String(190), unique=True, nullable=False)
@@ -221,7 +891,11 @@ class Patient(Base):
 
 class Provider(Base):
     __tablename__ = "providers"
-    provider_id  = Column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (
+        Index("idx_provider_specialty", "specialty"),
+        Index("idx_provider_name", "display_name"),
+    )
+    provider_id  = Column(BigId, primary_key=True, autoincrement=True)
     display_name = Column(String(120), nullable=False)
     specialty    = Column(String(120), nullable=False)
     email        = Column(String(190), unique=True, nullable=False)
@@ -232,7 +906,8 @@ class Provider(Base):
 
 class ProviderAvailability(Base):
     __tablename__ = "provider_availability"
-    availability_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (Index("idx_avail_provider_day", "provider_id", "weekday", "start_time"),)
+    availability_id = Column(BigId, primary_key=True, autoincrement=True)
     provider_id     = Column(BigInteger, ForeignKey("providers.provider_id"), nullable=False)
     weekday         = Column(Integer, nullable=False)
     start_time      = Column(Time, nullable=False)
@@ -242,18 +917,33 @@ class ProviderAvailability(Base):
 
 class ProviderException(Base):
     __tablename__ = "provider_exceptions"
-    exception_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (
+        Index("idx_exc_provider_time", "provider_id", "start_at", "end_at"),
+        Index("idx_exc_provider_series", "provider_id", "series_end_at"),
+    )
+    exception_id = Column(BigId, primary_key=True, autoincrement=True)
     provider_id  = Column(BigInteger, ForeignKey("providers.provider_id"), nullable=False)
     start_at     = Column(DateTime, nullable=False)
     end_at       = Column(DateTime, nullable=False)
     reason       = Column(String(160))
     is_blocking  = Column(Boolean, nullable=False, default=True)
+    # Repetición estilo RRULE: start_at/end_at son la primera ocurrencia.
+    recurrence          = Column(Enum("weekly","monthly", name="exception_recurrence"))
+    recurrence_interval = Column(Integer, nullable=False, default=1)
+    recurrence_until    = Column(DateTime)
+    recurrence_count    = Column(Integer)
+    # Fin de la última ocurrencia (cota superior); NULL si la serie no termina.
+    series_end_at       = Column(DateTime)
     created_at   = Column(DateTime, default=datetime.utcnow)
     provider     = relationship("Provider")
 
 class Appointment(Base):
     __tablename__ = "appointments"
-    appointment_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (
+        Index("idx_patient_time", "patient_id", "start_at"),
+        Index("idx_provider_time", "provider_id", "start_at"),
+    )
+    appointment_id = Column(BigId, primary_key=True, autoincrement=True)
     patient_id     = Column(BigInteger, ForeignKey("patients.patient_id"), nullable=False)
     provider_id    = Column(BigInteger, ForeignKey("providers.provider_id"), nullable=False)
     start_at       = Column(DateTime, nullable=False)
@@ -268,7 +958,8 @@ class Appointment(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
-    payment_id     = Column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (Index("idx_pay_status_created", "status", "created_at"),)
+    payment_id     = Column(BigId, primary_key=True, autoincrement=True)
     appointment_id = Column(BigInteger, ForeignKey("appointments.appointment_id"))
     amount         = Column(Numeric(10, 2), nullable=False)
     currency       = Column(String(3), nullable=False, default="MXN")
@@ -281,7 +972,8 @@ class Payment(Base):
 
 class NotificationPreference(Base):
     __tablename__ = "notification_preferences"
-    pref_id     = Column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (UniqueConstraint("user_type", "user_id", "channel", name="uq_pref"),)
+    pref_id     = Column(BigId, primary_key=True, autoincrement=True)
     user_type   = Column(Enum("patient","provider", name="user_type"), nullable=False)
     user_id     = Column(BigInteger, nullable=False)
     channel     = Column(Enum("email","sms","push", name="notify_channel"), nullable=False)
@@ -290,7 +982,11 @@ class NotificationPreference(Base):
 
 class NotificationOutbox(Base):
     __tablename__ = "notifications_outbox"
-    notif_id     = Column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (
+        Index("idx_outbox_status_time", "status", "send_after"),
+        Index("idx_outbox_appointment", "appointment_id", "status"),
+    )
+    notif_id     = Column(BigId, primary_key=True, autoincrement=True)
     appointment_id = Column(BigInteger, ForeignKey("appointments.appointment_id"))
     channel      = Column(Enum("email","sms","push", name="outbox_channel"), nullable=False)
     template     = Column(String(80), nullable=False)
@@ -303,9 +999,36 @@ class NotificationOutbox(Base):
     updated_at   = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     appointment  = relationship("Appointment")
 
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist"
+    __table_args__ = (
+        Index("idx_waitlist_status_window", "status", "window_end"),
+        Index("idx_waitlist_hold", "offered_provider_id", "status", "offer_expires_at"),
+        Index("idx_waitlist_expiry", "status", "offer_expires_at"),
+        Index("idx_waitlist_patient", "patient_id", "status"),
+    )
+    waitlist_id  = Column(BigId, primary_key=True, autoincrement=True)
+    patient_id   = Column(BigInteger, ForeignKey("patients.patient_id"), nullable=False)
+    provider_id  = Column(BigInteger, ForeignKey("providers.provider_id"))
+    specialty    = Column(String(120))
+    window_start = Column(DateTime, nullable=False)
+    window_end   = Column(DateTime, nullable=False)
+    status       = Column(Enum("waiting","offered","booked","expired","canceled", name="waitlist_status"),
+                          nullable=False, default="waiting")
+    offered_provider_id = Column(BigInteger, ForeignKey("providers.provider_id"))
+    offered_start_at = Column(DateTime)
+    offered_end_at   = Column(DateTime)
+    offer_expires_at = Column(DateTime)
+    created_at   = Column(DateTime, default=datetime.utcnow)
+    updated_at   = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
-    audit_id   = Column(BigInteger, primary_key=True, autoincrement=True)
+    __table_args__ = (
+        Index("idx_audit_entity", "entity_type", "entity_id", "event_ts"),
+        Index("idx_audit_actor", "actor_type", "actor_id", "event_ts"),
+    )
+    audit_id   = Column(BigId, primary_key=True, autoincrement=True)
     actor_type = Column(Enum("patient","provider","admin","system", name="actor_type"), nullable=False)
     actor_id   = Column(BigInteger)
     action     = Column(String(80), nullable=False)
@@ -315,124 +1038,3131 @@ class AuditLog(Base):
     metadata_  = Column("metadata", JSON)
     event_ts   = Column(DateTime, default=datetime.utcnow)
 
-# ========= Flask + CRUD genérico =========
-APP_DIR = Path(__file__).resolve().parent
-FRONTEND_ENTRY = "frontend.html"
+# ========= Listados: paginación, filtros y proyección =========
+# Columnas filtrables por tabla. Reflejan los índices declarados en sql.txt
+# para que los filtros nunca obliguen a recorrer la tabla completa.
+LIST_FILTER_COLUMNS = {
+    "patients":                 ("email",),
+    "providers":                ("specialty", "display_name", "email"),
+    "provider_availability":    ("provider_id", "weekday"),
+    "provider_exceptions":      ("provider_id", "start_at", "end_at"),
+    "appointments":             ("provider_id", "patient_id", "status", "start_at"),
+    "payments":                 ("appointment_id", "status", "created_at"),
+    "notification_preferences": ("user_type", "user_id", "channel"),
+    "notifications_outbox":     ("status", "send_after", "appointment_id"),
+    "audit_logs":               ("entity_type", "entity_id", "actor_type", "actor_id", "event_ts"),
+}
 
-app = Flask(__name__)
+LIST_RANGE_OPERATORS = {
+    "gt":  lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt":  lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+}
 
-RESOURCES = [
-    ("/patients",                Patient,               "patient_id"),
-    ("/providers",               Provider,              "provider_id"),
-    ("/provider-availability",   ProviderAvailability,  "availability_id"),
-    ("/provider-exceptions",     ProviderException,     "exception_id"),
-    ("/appointments",            Appointment,           "appointment_id"),
-    ("/payments",                Payment,               "payment_id"),
-    ("/notification-preferences",NotificationPreference,"pref_id"),
-    ("/notifications-outbox",    NotificationOutbox,    "notif_id"),
-    ("/audit-logs",              AuditLog,              "audit_id"),
-]
+LIST_RESERVED_PARAMS = {"limit", "after", "fields", "stream", "session_token"}
+NDJSON_MIMETYPE = "application/x-ndjson"
 
-def register_crud(path: str, model, pk_column: str):
-    table = model.__tablename__
 
-    # ----- handlers -----
-    @require_auth()
-    def list_items():
-        db = SessionLocal()
-        try:
-            items = db.query(model).all()
-            return jsonify([to_dict(x) for x in items])
-        finally:
-            db.close()
+def parse_query_value(column, raw):
+    """Convert a query-string value to the python type of ``column``."""
+    try:
+        return column_coercer(column)(raw)
+    except (ValueError, ArithmeticError) as exc:
+        raise ValueError(f"Invalid value for {column.name}: {exc}") from exc
 
-    @require_auth()
-    def create_item():
-        data = request.get_json(force=True, silent=False)
-        db = SessionLocal()
-        try:
-            payload = coerce_payload(model, data)
-            if model is Appointment:
-                start_at = payload.get("start_at")
-                end_at = payload.get("end_at")
-                provider_id = payload.get("provider_id")
-                if not start_at or not end_at:
-                    db.rollback()
-                    return jsonify({"error": "La cita debe incluir hora de inicio y fin."}), 400
-                if start_at >= end_at:
-                    db.rollback()
-                    return jsonify({"error": "La hora de inicio debe ser anterior a la de fin."}), 400
-                if appointment_overlaps(db, provider_id, start_at, end_at):
-                    db.rollback()
-                    return jsonify({"error": "El proveedor ya tiene una cita reservada en ese horario."}), 409
 
-            obj = model(**payload)
-            db.add(obj)
-            db.commit()
-            db.refresh(obj)
-            return jsonify(to_dict(obj)), 201
-        except IntegrityError as e:
-            db.rollback()
-            return jsonify({"error": str(e.orig)}), 400
-        except ValueError as e:
-            db.rollback()
-            return jsonify({"error": str(e)}), 400
-        finally:
-            db.close()
+def parse_list_limit(args):
+    raw = args.get("limit")
+    if raw in (None, ""):
+        return LIST_DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise ValueError("El parámetro limit debe ser un entero.") from None
+    if limit < 1:
+        raise ValueError("El parámetro limit debe ser mayor que cero.")
+    return min(limit, LIST_MAX_LIMIT)
 
-    @require_auth()
-    def get_item(pk):
-        db = SessionLocal()
+
+def build_list_query(model, pk_column, args, stream=False):
+    """Build the keyset-paginated ``select`` for a CRUD list request.
+
+    Supports ``limit``/``after`` (cursor on the primary key), equality and
+    range filters (``col``, ``col__in``, ``col__gt``, ``col__gte``, ``col__lt``,
+    ``col__lte``) on the indexed columns of ``LIST_FILTER_COLUMNS`` and a
+    ``fields=`` projection. Returns ``(statement, limit)``; the statement
+    fetches ``limit + 1`` rows so the caller can tell if there is a next page.
+    Pages are only cut when the client sends ``limit`` or ``after`` (only
+    ``limit`` in ``stream`` mode); otherwise the whole list is returned and
+    ``limit`` is ``None``.
+    """
+    table = model.__table__
+    pk = table.c[pk_column]
+    allowed = {pk_column, *LIST_FILTER_COLUMNS.get(table.name, ())}
+    paginated = args.get("limit") not in (None, "") or (
+        not stream and args.get("after") not in (None, "")
+    )
+    limit = parse_list_limit(args) if paginated else None
+
+    columns = list(table.columns)
+    fields = args.get("fields")
+    if fields:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in table.c]
+        if unknown:
+            raise ValueError(f"Campos desconocidos en {table.name}: {', '.join(unknown)}")
+        if pk_column not in names:
+            # La llave primaria es el cursor de paginación, siempre se devuelve.
+            names.insert(0, pk_column)
+        columns = [table.c[name] for name in dict.fromkeys(names)]
+
+    stmt = select(*columns)
+    for key in args.keys():
+        if key in LIST_RESERVED_PARAMS:
+            continue
+        name, _, op = key.partition("__")
+        if name not in table.c:
+            continue
+        if name not in allowed:
+            raise ValueError(f"El filtro '{name}' no está permitido en {table.name}.")
+        column = table.c[name]
+        if not op:
+            values = [parse_query_value(column, raw) for raw in args.getlist(key)]
+            stmt = stmt.where(column == values[0] if len(values) == 1 else column.in_(values))
+        elif op == "in":
+            values = [
+                parse_query_value(column, raw)
+                for raw in args.get(key, "").split(",")
+                if raw.strip()
+            ]
+            stmt = stmt.where(column.in_(values))
+        elif op in LIST_RANGE_OPERATORS:
+            stmt = stmt.where(LIST_RANGE_OPERATORS[op](column, parse_query_value(column, args[key])))
+        else:
+            raise ValueError(f"Operador de filtro no soportado: {op}")
+
+    after = args.get("after")
+    if after not in (None, ""):
+        stmt = stmt.where(pk > parse_query_value(pk, after))
+
+    stmt = stmt.order_by(pk)
+    if limit is None:
+        return stmt, None
+    if stream:
+        return stmt.limit(limit), limit
+    return stmt.limit(limit + 1), limit
+
+
+def wants_stream(args):
+    if args.get("stream", "").strip().lower() in {"1", "true", "ndjson"}:
+        return True
+    return NDJSON_MIMETYPE in request.headers.get("Accept", "")
+
+
+def stream_list_response(stmt):
+    """Stream ``stmt`` rows as NDJSON or as a chunked JSON array.
+
+    Rows are read with a server-side cursor in batches of ``STREAM_BATCH_SIZE``
+    so memory stays flat regardless of the table size. NDJSON is used when the
+    client sends ``Accept: application/x-ndjson`` or ``stream=ndjson``.
+
+    The query runs and its first batch is read before the ``Response`` is
+    built, so a failing replica raises inside :func:`read_only` and the
+    request is retried on the primary instead of sending a truncated body.
+    """
+    ndjson = (
+        NDJSON_MIMETYPE in request.headers.get("Accept", "")
+        or request.args.get("stream", "").strip().lower() == "ndjson"
+    )
+    serialize = SERIALIZERS.for_columns(stmt.selected_columns)
+    stmt = stmt.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+    db = read_session()
+    try:
+        batches = db.execute(stmt).partitions()
+        first = next(batches, None)
+    except Exception:
+        db.close()
+        raise
+
+    def all_batches():
+        if first is not None:
+            yield first
+            yield from batches
+
+    def generate():
         try:
-            obj = db.get(model, pk)
-            if not obj:
-                return jsonify({"error": f"{table} not found"}), 404
-            return jsonify(to_dict(obj))
+            if ndjson:
+                for batch in all_batches():
+                    yield b"".join(dumps_json(serialize(row)) + b"\n" for row in batch)
+                return
+            yield b"["
+            separator = b""
+            for batch in all_batches():
+                yield separator + b",".join(dumps_json(serialize(row)) for row in batch)
+                separator = b","
+            yield b"]"
         finally:
             db.close()
 
-    @require_auth()
-    def update_item(pk):
-        data = request.get_json(force=True, silent=False)
-        db = SessionLocal()
-        try:
-            obj = db.get(model, pk)
-            if not obj:
-                return jsonify({"error": f"{table} not found"}), 404
-            payload = coerce_payload(model, data)
+    return Response(generate(), mimetype=NDJSON_MIMETYPE if ndjson else "application/json")
 
+
+def next_page_link(cursor):
+    args = request.args.copy()
+    args["after"] = cursor
+    return f"{request.base_url}?{urlencode(list(args.items(multi=True)))}"
+
+
+# ========= Motor de disponibilidad =========
+SLOT_MINUTES_DEFAULT = 30
+SLOT_MINUTES_RANGE = (5, 240)
+SEARCH_DAYS_DEFAULT = 14
+SEARCH_DAYS_RANGE = (1, 90)
+
+
+def parse_int_param(args, name, default, bounds):
+    raw = args.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"El parámetro {name} debe ser un entero.") from None
+    low, high = bounds
+    if not low <= value <= high:
+        raise ValueError(f"El parámetro {name} debe estar entre {low} y {high}.")
+    return value
+
+
+def normalize_weekday(value):
+    """Return the Python weekday index (0=Monday) for a stored rule value, or None."""
+    try:
+        weekday_value = int(value)
+    except (TypeError, ValueError):
+        return None
+
+    # UI almacena 1-7 (lunes-domingo). Normalizamos a 0-6 para
+    # compararlo con datetime.weekday(). Si ya está en 0-6 lo usamos tal cual.
+    if 1 <= weekday_value <= 7:
+        weekday_value = (weekday_value - 1) % 7
+
+    if 0 <= weekday_value <= 6:
+        return weekday_value
+    return None
+
+
+def weekly_windows(rules):
+    """Group weekly rules into ``{weekday: [(start_time, end_time), ...]}`` sorted by start."""
+    windows = {}
+    for rule in rules:
+        weekday = normalize_weekday(rule.weekday)
+        if weekday is None:
+            continue
+        if not isinstance(rule.start_time, time) or not isinstance(rule.end_time, time):
+            continue
+        windows.setdefault(weekday, []).append((rule.start_time, rule.end_time))
+    for day_windows in windows.values():
+        day_windows.sort()
+    return windows
+
+
+def merge_intervals(intervals):
+    """Sort ``(start, end)`` intervals and coalesce the ones that overlap or touch."""
+    merged = []
+    for start, end in sorted(intervals):
+        if start > end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def iter_free_slots(windows, busy, start_date, search_days, slot_minutes, now=None):
+    """Yield free ``(start, end)`` slots of a weekly schedule in time order.
+
+    ``windows`` comes from :func:`weekly_windows` and ``busy`` must already be
+    coalesced by :func:`merge_intervals`. Slots are aligned to the start of
+    each rule window and the busy list is swept alongside every window, so the
+    cost is linear in slots plus busy intervals instead of their product.
+    Slots that end at or before ``now`` are skipped. Days are produced lazily,
+    which lets callers stop as soon as they have enough slots.
+    """
+    slot_delta = timedelta(minutes=slot_minutes)
+
+    for day_offset in range(search_days + 1):
+        current_date = start_date + timedelta(days=day_offset)
+        day_slots = set()
+        for start_time, end_time in windows.get(current_date.weekday(), ()):
+            window_start = datetime.combine(current_date, start_time)
+            window_end = datetime.combine(current_date, end_time)
+
+            slot_start = window_start
+            if now is not None and now > window_start:
+                slot_start += ((now - window_start) // slot_delta) * slot_delta
+
+            index = max(bisect_right(busy, (slot_start, datetime.max)) - 1, 0)
+            while slot_start + slot_delta <= window_end:
+                slot_end = slot_start + slot_delta
+                while index < len(busy) and busy[index][1] <= slot_start:
+                    index += 1
+                if index < len(busy) and busy[index][0] < slot_end:
+                    # Saltamos al primer slot alineado que empieza al terminar el bloqueo.
+                    steps = -(-(busy[index][1] - window_start) // slot_delta)
+                    slot_start = window_start + steps * slot_delta
+                    continue
+                day_slots.add((slot_start, slot_end))
+                slot_start = slot_end
+        yield from sorted(day_slots)
+
+
+def free_slots(windows, busy, start_date, search_days, slot_minutes, now=None):
+    """Return the sorted free slots for ``busy`` given as any ``(start, end)`` iterable."""
+    return list(
+        iter_free_slots(windows, merge_intervals(busy), start_date, search_days, slot_minutes, now=now)
+    )
+
+
+def slot_payload(slot_start, slot_end, slot_minutes):
+    return {
+        "start_at": serialize_value(slot_start),
+        "end_at": serialize_value(slot_end),
+        "date": serialize_value(slot_start.date()),
+        "weekday": slot_start.weekday(),
+        "slot_minutes": slot_minutes,
+    }
+
+
+# ----- Excepciones recurrentes -----
+RECURRENCE_INTERVAL_RANGE = (1, 52)
+RECURRENCE_COUNT_RANGE = (1, 1000)
+
+# Sin campos de recurrencia describe un intervalo único.
+ExceptionRule = namedtuple(
+    "ExceptionRule",
+    "start_at end_at recurrence recurrence_interval recurrence_until recurrence_count",
+    defaults=(None, None, None, None),
+)
+
+
+def exception_rule(values):
+    """Build an :data:`ExceptionRule` from a row snapshot dict."""
+    return ExceptionRule(*(values.get(name) for name in ExceptionRule._fields))
+
+
+def add_months(moment, months):
+    """``moment`` moved ``months`` calendar months, or None if that month lacks its day."""
+    year, month = divmod(moment.month - 1 + months, 12)
+    year += moment.year
+    if moment.day > calendar.monthrange(year, month + 1)[1]:
+        return None
+    return moment.replace(year=year, month=month + 1)
+
+
+def _recurrence_starts(rule, window_start, duration):
+    """Yield ``(number, start)`` from the first occurrence that can reach ``window_start``."""
+    start_at, interval = rule.start_at, rule.recurrence_interval or 1
+    if rule.recurrence == "weekly":
+        step = timedelta(weeks=interval)
+        number = max(0, (window_start - duration - start_at) // step + 1)
+        while True:
+            yield number, start_at + number * step
+            number += 1
+
+    # Las ocurrencias anteriores a dos periodos antes del mes de la ventana
+    # terminan antes de ella (duran menos de un periodo). Sin meses saltados
+    # (día <= 28) el número de ocurrencia es el del periodo; con count y días
+    # 29-31 hay que contar desde el inicio.
+    months = (window_start.year - start_at.year) * 12 + window_start.month - start_at.month
+    jump = rule.recurrence_count is None or start_at.day <= 28
+    period = max(0, months // interval - 2) if jump else 0
+    number = period
+    while True:
+        if start_at.year + (start_at.month - 1 + period * interval) // 12 > MAXYEAR:
+            return
+        moment = add_months(start_at, period * interval)
+        period += 1
+        if moment is not None:
+            yield number, moment
+            number += 1
+
+
+def iter_exception_occurrences(rule, window_start, window_end):
+    """Yield the ``(start, end)`` occurrences of an exception overlapping the window, in order.
+
+    One-off exceptions yield at most their own interval. Recurring ones are
+    expanded lazily from the window: weekly rules jump straight to its first
+    occurrence and monthly rules to two periods before it, so the cost does
+    not grow with the age of the series. Monthly rules keep the day of month
+    of ``start_at`` and skip the months that lack it (as RFC 5545 does);
+    ``recurrence_count`` only counts real occurrences.
+    """
+    start_at, end_at = rule.start_at, rule.end_at
+    if not rule.recurrence:
+        if start_at < window_end and end_at > window_start:
+            yield start_at, end_at
+        return
+    duration = end_at - start_at
+    until, count = rule.recurrence_until, rule.recurrence_count
+    for number, occurrence_start in _recurrence_starts(rule, window_start, duration):
+        if occurrence_start >= window_end:
+            return
+        if (count is not None and number >= count) or (until is not None and occurrence_start > until):
+            return
+        if occurrence_start + duration > window_start:
+            yield occurrence_start, occurrence_start + duration
+
+
+def _tagged_occurrences(exception, window_start, window_end):
+    for start_at, end_at in iter_exception_occurrences(exception, window_start, window_end):
+        yield start_at, end_at, exception
+
+
+def iter_exceptions(exceptions, window_start, window_end):
+    """Merge one-off and recurring exceptions into one ``(start, end, exception)`` stream in time order."""
+    streams = [_tagged_occurrences(exception, window_start, window_end) for exception in exceptions]
+    return heapq.merge(*streams, key=lambda item: (item[0], item[1]))
+
+
+def exceptions_query(provider_id, window_start, window_end, blocking_only=False):
+    """Exceptions of the provider that can have an occurrence in the window.
+
+    Both branches read ``idx_exc_provider_series``: one-off rows and
+    finished series are a range on ``series_end_at > window_start``, so the
+    provider's past is never read, and open-ended series (``NULL``) are
+    always candidates. ``start_at`` is left out on purpose: with it the
+    planner may range over ``idx_exc_provider_time`` and read the whole
+    history instead, and the few future rows past ``window_end`` yield no
+    occurrence. The branches are a ``UNION ALL`` because an ``OR`` cannot
+    use the range.
+    """
+    criteria = [ProviderException.provider_id == provider_id]
+    if blocking_only:
+        criteria.append(ProviderException.is_blocking.is_(True))
+    bounded = select(ProviderException).where(*criteria, ProviderException.series_end_at > window_start)
+    open_ended = select(ProviderException).where(*criteria, ProviderException.series_end_at.is_(None))
+    return select(ProviderException).from_statement(union_all(bounded, open_ended))
+
+
+def exception_series_end(rule):
+    """Upper bound of the end of the last occurrence, or None for an open-ended series.
+
+    Raises ``ValueError`` when the recurrence fields are inconsistent.
+    """
+    if rule.start_at is None or rule.end_at is None:
+        return rule.end_at
+    if not rule.recurrence:
+        if rule.recurrence_until is not None or rule.recurrence_count is not None:
+            raise ValueError("recurrence_until y recurrence_count requieren recurrence.")
+        return rule.end_at
+    if rule.start_at >= rule.end_at:
+        raise ValueError("La hora de inicio debe ser anterior a la de fin.")
+    # Al insertar sin recurrence_interval, el default de la columna aún no se aplicó.
+    interval = 1 if rule.recurrence_interval is None else rule.recurrence_interval
+    count, until = rule.recurrence_count, rule.recurrence_until
+    low, high = RECURRENCE_INTERVAL_RANGE
+    if not low <= interval <= high:
+        raise ValueError(f"recurrence_interval debe estar entre {low} y {high}.")
+    if count is not None and until is not None:
+        raise ValueError("Indica recurrence_until o recurrence_count, no ambos.")
+    low, high = RECURRENCE_COUNT_RANGE
+    if count is not None and not low <= count <= high:
+        raise ValueError(f"recurrence_count debe estar entre {low} y {high}.")
+    if until is not None and until < rule.start_at:
+        raise ValueError("recurrence_until no puede ser anterior a start_at.")
+    duration = rule.end_at - rule.start_at
+    period = timedelta(weeks=interval) if rule.recurrence == "weekly" else timedelta(days=28 * interval)
+    if duration >= period:
+        raise ValueError("Cada ocurrencia debe durar menos que su periodo de repetición.")
+
+    if until is not None:
+        return until + duration
+    if count is None:
+        return None
+    if rule.recurrence == "weekly":
+        return rule.start_at + (count - 1) * period + duration
+    last = None
+    for last in islice(iter_exception_occurrences(rule, rule.start_at, datetime.max), count):
+        pass
+    return last[1] if last else rule.end_at
+
+
+@event.listens_for(ProviderException, "before_insert")
+@event.listens_for(ProviderException, "before_update")
+def set_exception_series_end(mapper, connection, target):
+    target.series_end_at = exception_series_end(target)
+
+
+# ========= Índice de disponibilidad (búsqueda por especialidad) =========
+ACTIVE_APPOINTMENT_STATUSES = ("booked", "rescheduled")
+SLOT_SEARCH_DEFAULT_LIMIT = 20
+SLOT_SEARCH_LIMIT_RANGE = (1, 200)
+
+WeeklyRule = namedtuple("WeeklyRule", "weekday start_time end_time")
+
+
+class ProviderSchedule:
+    """Weekly windows and coalesced busy intervals of one provider.
+
+    ``busy`` maps ``(kind, id)`` to that row's intervals: one for an
+    appointment, the expanded occurrences for an exception.
+    """
+
+    __slots__ = ("provider_id", "display_name", "specialty", "tz", "tz_name",
+                 "rules", "windows", "busy", "merged_busy")
+
+    def __init__(self, provider_id, display_name, specialty, tz_name):
+        self.provider_id = provider_id
+        self.display_name = display_name
+        self.specialty = specialty
+        self.tz, self.tz_name = resolve_timezone(tz_name)
+        self.rules = {}
+        self.windows = {}
+        self.busy = {}
+        self.merged_busy = []
+
+    def rebuild_windows(self):
+        self.windows = weekly_windows(self.rules.values())
+
+    def rebuild_busy(self):
+        # Se reemplaza la lista completa para que las búsquedas en curso
+        # sigan iterando sobre una copia consistente.
+        self.merged_busy = merge_intervals(chain.from_iterable(self.busy.values()))
+
+
+class AvailabilityIndex:
+    """In-process index of every provider's schedule used by ``/slots/search``.
+
+    The index is loaded with a handful of set-based queries the first time it
+    is used and then kept up to date by :func:`publish_change` after every
+    write, so a search only walks in-memory sorted arrays. It is reloaded
+    after ``AVAILABILITY_INDEX_TTL_SECONDS`` to pick up writes made by other
+    worker processes.
+    """
+
+    def __init__(self, ttl_seconds=AVAILABILITY_INDEX_TTL_SECONDS):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self._lock = threading.RLock()
+        self._providers = {}
+        self._by_specialty = {}
+        self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at and datetime.utcnow() - self._loaded_at < self.ttl:
+                return
+            db = SessionLocal()
+            try:
+                self._load(db)
+            finally:
+                db.close()
+
+    @staticmethod
+    def _expansion_window():
+        # Margen de un día a cada lado por la diferencia entre UTC y la hora local.
+        now = datetime.utcnow()
+        return now - timedelta(days=1), now + timedelta(days=SEARCH_DAYS_RANGE[1] + 2)
+
+    def _load(self, db):
+        horizon, horizon_end = self._expansion_window()
+        providers = {}
+        for row in db.execute(
+            select(Provider.provider_id, Provider.display_name, Provider.specialty, Provider.timezone)
+        ):
+            providers[row.provider_id] = ProviderSchedule(*row)
+
+        for row in db.execute(
+            select(
+                ProviderAvailability.availability_id,
+                ProviderAvailability.provider_id,
+                ProviderAvailability.weekday,
+                ProviderAvailability.start_time,
+                ProviderAvailability.end_time,
+            )
+        ):
+            schedule = providers.get(row.provider_id)
+            if schedule:
+                schedule.rules[row.availability_id] = WeeklyRule(row.weekday, row.start_time, row.end_time)
+
+        for row in db.execute(
+            select(
+                ProviderException.exception_id,
+                ProviderException.provider_id,
+                *(getattr(ProviderException, name) for name in ExceptionRule._fields),
+            ).where(
+                ProviderException.is_blocking.is_(True),
+                ProviderException.start_at < horizon_end,
+                or_(ProviderException.series_end_at > horizon, ProviderException.series_end_at.is_(None)),
+            )
+        ):
+            schedule = providers.get(row.provider_id)
+            if schedule:
+                schedule.busy[("exception", row.exception_id)] = list(
+                    iter_exception_occurrences(row, horizon, horizon_end)
+                )
+
+        for row in db.execute(
+            select(
+                Appointment.appointment_id,
+                Appointment.provider_id,
+                Appointment.start_at,
+                Appointment.end_at,
+            ).where(Appointment.status.in_(ACTIVE_APPOINTMENT_STATUSES), Appointment.end_at > horizon)
+        ):
+            schedule = providers.get(row.provider_id)
+            if schedule:
+                schedule.busy[("appointment", row.appointment_id)] = [(row.start_at, row.end_at)]
+
+        by_specialty = {}
+        for schedule in providers.values():
+            schedule.rebuild_windows()
+            schedule.rebuild_busy()
+            by_specialty.setdefault((schedule.specialty or "").lower(), set()).add(schedule.provider_id)
+
+        self._providers = providers
+        self._by_specialty = by_specialty
+        self._loaded_at = datetime.utcnow()
+
+    # ----- actualizaciones incrementales -----
+    def apply_change(self, model, before, after):
+        """Update the index from the before/after snapshots of a committed write."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if model is Provider:
+                self._apply_provider(before, after)
+            elif model is ProviderAvailability:
+                self._apply_keyed(before, after, "availability_id", self._set_rule)
+            elif model is ProviderException:
+                self._apply_keyed(before, after, "exception_id", self._set_exception)
+            elif model is Appointment:
+                self._apply_keyed(before, after, "appointment_id", self._set_appointment)
+
+    def _apply_provider(self, before, after):
+        if before:
+            self._by_specialty.get((before["specialty"] or "").lower(), set()).discard(before["provider_id"])
+        if not after:
+            self._providers.pop(before["provider_id"], None)
+            return
+        schedule = self._providers.get(after["provider_id"])
+        fresh = ProviderSchedule(after["provider_id"], after["display_name"], after["specialty"], after["timezone"])
+        if schedule:
+            fresh.rules, fresh.windows = schedule.rules, schedule.windows
+            fresh.busy, fresh.merged_busy = schedule.busy, schedule.merged_busy
+        self._providers[fresh.provider_id] = fresh
+        self._by_specialty.setdefault((fresh.specialty or "").lower(), set()).add(fresh.provider_id)
+
+    def _apply_keyed(self, before, after, pk_name, setter):
+        if before:
+            setter(before["provider_id"], before[pk_name], None)
+        if after:
+            setter(after["provider_id"], after[pk_name], after)
+
+    def _set_rule(self, provider_id, key, values):
+        schedule = self._providers.get(provider_id)
+        if not schedule:
+            return
+        schedule.rules.pop(key, None)
+        if values:
+            schedule.rules[key] = WeeklyRule(values["weekday"], values["start_time"], values["end_time"])
+        schedule.rebuild_windows()
+
+    def _set_busy(self, provider_id, key, intervals):
+        schedule = self._providers.get(provider_id)
+        if not schedule:
+            return
+        schedule.busy.pop(key, None)
+        if intervals:
+            schedule.busy[key] = intervals
+        schedule.rebuild_busy()
+
+    def _set_exception(self, provider_id, key, values):
+        intervals = None
+        if values and values.get("is_blocking") is not False:
+            intervals = list(iter_exception_occurrences(exception_rule(values), *self._expansion_window()))
+        self._set_busy(provider_id, ("exception", key), intervals)
+
+    def _set_appointment(self, provider_id, key, values):
+        active = values and values.get("status", "booked") in ACTIVE_APPOINTMENT_STATUSES
+        intervals = [(values["start_at"], values["end_at"])] if active else None
+        self._set_busy(provider_id, ("appointment", key), intervals)
+
+    # ----- búsqueda -----
+    def search(self, specialty, window_from, window_to, slot_minutes, limit):
+        """Return the earliest ``limit`` free slots across the matching providers.
+
+        ``window_from``/``window_to`` are naive UTC. Each provider's slots are
+        generated in its local time and merged by their UTC start, so
+        providers in different timezones come out in real time order.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if specialty:
+                provider_ids = self._by_specialty.get(specialty.lower(), ())
+            else:
+                provider_ids = self._providers.keys()
+            schedules = [self._providers[pid] for pid in sorted(provider_ids)]
+            # Referencias a las estructuras actuales; las escrituras las reemplazan.
+            snapshots = [(s, s.windows, s.merged_busy) for s in schedules]
+
+        streams = [
+            self._provider_slots(schedule, windows, busy, window_from, window_to, slot_minutes)
+            for schedule, windows, busy in snapshots
+        ]
+        merged = heapq.merge(*streams, key=lambda item: (item[0], item[3].provider_id))
+        return [
+            {
+                **slot_payload(slot_start, slot_end, slot_minutes),
+                "start_at_utc": serialize_value(start_utc),
+                "end_at_utc": serialize_value(local_to_utc(slot_end, schedule.tz)),
+                "provider_id": schedule.provider_id,
+                "display_name": schedule.display_name,
+                "specialty": schedule.specialty,
+                "timezone": schedule.tz_name,
+            }
+            for start_utc, slot_start, slot_end, schedule in islice(merged, limit)
+        ]
+
+    @staticmethod
+    def _provider_slots(schedule, windows, busy, window_from, window_to, slot_minutes):
+        """Yield ``(start_utc, start, end, schedule)`` for the free local slots inside the UTC window."""
+        tz = schedule.tz
+        now = datetime.utcnow()
+        start = max(window_from, now) if window_from else now
+        start_local = utc_to_local(start, tz)
+        last_day = start_local.date() + timedelta(days=SEARCH_DAYS_RANGE[1])
+        if window_to:
+            end_local = min(utc_to_local(window_to, tz), datetime.combine(last_day, time.max))
+        else:
+            end_local = datetime.combine(start_local.date() + timedelta(days=SEARCH_DAYS_DEFAULT), time.max)
+        if start_local >= end_local:
+            return
+        search_days = (end_local.date() - start_local.date()).days
+        for slot_start, slot_end in iter_free_slots(
+            windows, busy, start_local.date(), search_days, slot_minutes, now=start_local
+        ):
+            start_utc = local_to_utc(slot_start, tz)
+            # Las horas que se salta el cambio de horario no existen; sin ellas
+            # el orden local coincide con el de UTC.
+            if utc_to_local(start_utc, tz) != slot_start:
+                continue
+            if start_utc < start:
+                continue
+            if slot_end > end_local:
+                return
+            yield start_utc, slot_start, slot_end, schedule
+
+
+AVAILABILITY_INDEX = AvailabilityIndex()
+
+
+# ========= Notificaciones automáticas =========
+APPOINTMENT_TEMPLATES = {
+    "booked": "appointment_booked",
+    "rescheduled": "appointment_rescheduled",
+    "canceled": "appointment_canceled",
+}
+
+
+class NotificationPreferenceIndex:
+    """In-memory ``(user_type, user_id) -> {channel: lead_minutes}`` of enabled preferences.
+
+    Loaded once with a single query and kept fresh by :func:`publish_change`
+    when the ``/notification-preferences`` endpoints write, so enqueueing
+    notifications on the booking path costs no extra round trip. Reloaded
+    after the TTL to pick up writes from other workers.
+    """
+
+    def __init__(self, ttl_seconds=NOTIFICATION_PREFERENCES_TTL_SECONDS):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._prefs = {}
+        self._loaded_at = None
+
+    def get(self, user_type, user_id):
+        self._ensure_loaded()
+        return list(self._prefs.get((user_type, user_id), {}).items())
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at and datetime.utcnow() - self._loaded_at < self.ttl:
+                return
+            db = SessionLocal()
+            try:
+                rows = db.execute(
+                    select(
+                        NotificationPreference.user_type,
+                        NotificationPreference.user_id,
+                        NotificationPreference.channel,
+                        NotificationPreference.lead_minutes,
+                    ).where(NotificationPreference.enabled.is_(True))
+                ).all()
+            finally:
+                db.close()
+            prefs = {}
+            for row in rows:
+                prefs.setdefault((row.user_type, row.user_id), {})[row.channel] = row.lead_minutes
+            self._prefs = prefs
+            self._loaded_at = datetime.utcnow()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def apply_change(self, before, after):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if before:
+                channels = self._prefs.get((before["user_type"], before["user_id"]), {})
+                channels.pop(before["channel"], None)
+            if after and after.get("enabled") is not False:
+                key = (after["user_type"], int(after["user_id"]))
+                self._prefs.setdefault(key, {})[after["channel"]] = int(after.get("lead_minutes") or 0)
+
+
+NOTIFICATION_PREFERENCES = NotificationPreferenceIndex()
+
+
+def appointment_event(previous, appointment):
+    """Classify an appointment update as ``canceled``, ``rescheduled`` or ``None``."""
+    provider_id, start_at, end_at, status = previous
+    if appointment.status == "canceled" and status != "canceled":
+        return "canceled"
+    if (appointment.provider_id, appointment.start_at, appointment.end_at) != (provider_id, start_at, end_at):
+        return "rescheduled"
+    return None
+
+
+RECIPIENT_MODELS = {"patient": Patient, "provider": Provider}
+# Dirección que usa cada canal; push la resuelve el gateway con user_type/user_id.
+CHANNEL_ADDRESS_FIELDS = {"email": "email", "sms": "phone"}
+
+
+def recipient_contact(db, user_type, user_id):
+    """``{"email", "phone"}`` of a notification recipient (empty if it no longer exists).
+
+    Resolved when the row is queued so the worker's adapters never have to
+    look the recipient up.
+    """
+    model = RECIPIENT_MODELS[user_type]
+    pk = sa_inspect(model).primary_key[0]
+    row = db.execute(select(model.email, model.phone).where(pk == user_id)).first()
+    return {"email": row.email, "phone": row.phone} if row else {}
+
+
+def recipient_fields(contact, channel):
+    """Payload fields for ``channel``: the contact plus its address in ``to``."""
+    address = contact.get(CHANNEL_ADDRESS_FIELDS.get(channel))
+    return {**contact, "to": address} if address else contact
+
+
+def enqueue_appointment_notifications(db, appointment, event, tz_name=None):
+    """Add one outbox row per enabled channel of the patient and the provider.
+
+    Rows are added to ``db`` so they commit together with the appointment
+    change. Reminders are due ``lead_minutes`` before the appointment (in UTC,
+    never in the past); cancellations are due immediately. Queued rows of a
+    rescheduled or canceled appointment are superseded.
+    """
+    now = datetime.utcnow()
+    if event != "booked":
+        db.execute(
+            update(NotificationOutbox)
+            .where(
+                NotificationOutbox.appointment_id == appointment.appointment_id,
+                NotificationOutbox.status == "queued",
+            )
+            .values(status="failed", last_error="Reemplazada por un cambio posterior de la cita.")
+            .execution_options(synchronize_session=False)
+        )
+
+    tz, _ = resolve_timezone(tz_name)
+    start_utc = appointment.start_at.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+    payload = {
+        "event": event,
+        "appointment_id": appointment.appointment_id,
+        "patient_id": appointment.patient_id,
+        "provider_id": appointment.provider_id,
+        "start_at": serialize_value(appointment.start_at),
+        "end_at": serialize_value(appointment.end_at),
+    }
+    for user_type, user_id in (("patient", appointment.patient_id), ("provider", appointment.provider_id)):
+        channels = NOTIFICATION_PREFERENCES.get(user_type, user_id)
+        contact = recipient_contact(db, user_type, user_id) if channels else {}
+        for channel, lead_minutes in channels:
+            if event == "canceled":
+                send_after = now
+            else:
+                send_after = max(now, start_utc - timedelta(minutes=lead_minutes))
+            db.add(
+                NotificationOutbox(
+                    appointment_id=appointment.appointment_id,
+                    channel=channel,
+                    template=APPOINTMENT_TEMPLATES[event],
+                    payload={
+                        **payload,
+                        "user_type": user_type,
+                        "user_id": user_id,
+                        **recipient_fields(contact, channel),
+                    },
+                    send_after=send_after,
+                )
+            )
+
+
+# ========= Caché de disponibilidad =========
+class LocalGenerationStore:
+    """Per-process provider generation counters (default cache backend).
+
+    ``epoch`` is unique per instance: validators derived from these counters
+    never match the ones another worker produced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generations = {}
+        self.epoch = secrets.token_hex(4)
+
+    def get(self, provider_id):
+        return self._generations.get(provider_id, 0)
+
+    def bump(self, provider_id):
+        with self._lock:
+            self._generations[provider_id] = self._generations.get(provider_id, 0) + 1
+
+
+class SQLiteGenerationStore(SQLiteBackend):
+    """Provider generation counters shared by every worker through a SQLite file."""
+
+    epoch = "shared"
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS provider_generations ("
+        " provider_id INTEGER PRIMARY KEY,"
+        " generation INTEGER NOT NULL)",
+    )
+
+    def get(self, provider_id):
+        row = self._connect().execute(
+            "SELECT generation FROM provider_generations WHERE provider_id = ?", (provider_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, provider_id):
+        self._connect().execute(
+            "INSERT INTO provider_generations (provider_id, generation) VALUES (?, 1) "
+            "ON CONFLICT(provider_id) DO UPDATE SET generation = generation + 1",
+            (provider_id,),
+        )
+
+
+class AvailabilityCache:
+    """LRU + TTL cache of computed ``/providers/<id>/availability`` payloads.
+
+    Keys start with the provider id. Every entry remembers the provider
+    generation it was computed under; :meth:`invalidate_provider` bumps that
+    generation, so only the affected provider's entries go stale. With a
+    shared generation store every worker sees the same invalidations.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, generations):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generations = generations
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_provider = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, key):
+        """Return ``(value, generation)``; ``value`` is ``None`` on a miss.
+
+        The generation must be passed back to :meth:`store` so a value computed
+        while the provider was being modified is never served.
+        """
+        generation = self.generations.get(key[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, entry_generation, value = entry
+                if entry_generation == generation and expires_at > monotonic_clock.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, generation
+                self._discard(key)
+            self.misses += 1
+            return None, generation
+
+    def store(self, key, value, generation):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (monotonic_clock.monotonic() + self.ttl_seconds, generation, value)
+            self._keys_by_provider.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate_provider(self, provider_id):
+        if provider_id is None:
+            return
+        self.generations.bump(provider_id)
+        with self._lock:
+            for key in list(self._keys_by_provider.get(provider_id, ())):
+                self._discard(key)
+            self.invalidations += 1
+
+    def _discard(self, key):
+        if self._entries.pop(key, None) is not None:
+            keys = self._keys_by_provider.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_provider[key[0]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+AVAILABILITY_CACHE = AvailabilityCache(
+    AVAILABILITY_CACHE_SIZE,
+    AVAILABILITY_CACHE_TTL_SECONDS,
+    SQLiteGenerationStore(AVAILABILITY_CACHE_SQLITE_PATH)
+    if AVAILABILITY_CACHE_SQLITE_PATH
+    else LocalGenerationStore(),
+)
+
+# ========= Peticiones condicionales (ETag / Last-Modified) =========
+class SQLiteTableVersionStore(SQLiteBackend):
+    """Per-table version counters shared by every worker through a SQLite file."""
+
+    epoch = "shared"
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS table_versions ("
+        " name TEXT PRIMARY KEY,"
+        " version INTEGER NOT NULL)",
+    )
+
+    def get(self, name):
+        row = self._connect().execute("SELECT version FROM table_versions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name):
+        self._connect().execute(
+            "INSERT INTO table_versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+            (name,),
+        )
+
+
+# Versión por tabla, incrementada en publish_change. LocalGenerationStore
+# sirve tal cual: sus llaves pueden ser nombres de tabla.
+TABLE_VERSIONS = (
+    SQLiteTableVersionStore(TABLE_VERSIONS_SQLITE_PATH)
+    if TABLE_VERSIONS_SQLITE_PATH
+    else LocalGenerationStore()
+)
+
+# Tablas que también escriben el despachador y la bitácora (fuera de
+# publish_change): su versión no es confiable y no llevan ETag.
+UNVERSIONED_TABLES = {"notifications_outbox", "audit_logs"}
+
+
+def make_etag(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def table_etag(table, *parts):
+    """Strong ETag for a read of ``table`` (``None`` when the table is unversioned)."""
+    if table in UNVERSIONED_TABLES:
+        return None
+    return make_etag(TABLE_VERSIONS.epoch, table, TABLE_VERSIONS.get(table), *parts)
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the request validators match, else ``None``.
+
+    ``If-None-Match`` takes precedence; ``If-Modified-Since`` is only
+    consulted when the request carries no ``If-None-Match``.
+    """
+    if request.if_none_match:
+        if etag is None or not request.if_none_match.contains(etag):
+            return None
+    elif last_modified is None or request.if_modified_since is None:
+        return None
+    elif last_modified.replace(microsecond=0, tzinfo=timezone.utc) > request.if_modified_since:
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified=None, cache_control="private, no-cache"):
+    """Attach ``ETag``/``Last-Modified`` so clients revalidate instead of refetching."""
+    if has_request_context() and g.get("used_replica") is not None:
+        # Una réplica atrasada podría etiquetar datos viejos con la versión nueva.
+        etag = last_modified = None
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def static_file(name):
+    """Serve a frontend file with validators derived from its mtime and size."""
+    stat = (APP_DIR / name).stat()
+    etag = make_etag(name, stat.st_mtime_ns, stat.st_size)
+    last_modified = datetime.utcfromtimestamp(int(stat.st_mtime))
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return with_validators(cached, etag, last_modified, "no-cache")
+    response = send_from_directory(APP_DIR, name, conditional=False)
+    return with_validators(response, etag, last_modified, "no-cache")
+
+
+# ========= Bitácora de auditoría =========
+class AuditWriter:
+    """Writes ``audit_logs`` rows off the request path.
+
+    In ``batched`` mode entries go to a bounded in-memory queue and a daemon
+    thread flushes them with one multi-row insert when ``batch_size`` entries
+    are waiting or ``flush_seconds`` have passed. If the queue is full the
+    entry is written inline rather than dropped. ``sync`` mode writes every
+    entry before the request returns; ``off`` disables auditing.
+    """
+
+    def __init__(self, mode, queue_size, batch_size, flush_seconds):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.written = 0
+        self.overflows = 0
+        self.errors = 0
+
+    def record(self, entry):
+        if self.mode == "off":
+            return
+        if self.mode == "sync":
+            self._write([entry])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.overflows += 1
+            self._write([entry])
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = [self._queue.get(timeout=self.flush_seconds)]
+            except queue.Empty:
+                continue
+            deadline = monotonic_clock.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - monotonic_clock.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, entries):
+        db = SessionLocal()
+        try:
+            db.execute(insert(AuditLog.__table__), entries)
+            db.commit()
+            self.written += len(entries)
+        except Exception:
+            db.rollback()
+            self.errors += len(entries)
+            logger.exception("No se pudieron guardar %s registros de auditoría", len(entries))
+        finally:
+            db.close()
+
+    def flush(self):
+        """Write everything still queued in the calling thread."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def shutdown(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+
+AUDIT_LOG = AuditWriter(AUDIT_MODE, AUDIT_QUEUE_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_SECONDS)
+atexit.register(AUDIT_LOG.shutdown)
+
+
+def client_ip():
+    forwarded = request.headers.get("X-Forwarded-For", "")
+    return (forwarded.split(",")[0].strip() or request.remote_addr or "")[:45] or None
+
+
+def audit(action, entity_type, entity_id=None, metadata=None, actor=None):
+    """Queue an audit entry; the actor defaults to ``g.current_session``."""
+    ip = None
+    if has_request_context():
+        actor = actor or g.get("current_session")
+        ip = client_ip()
+    AUDIT_LOG.record(
+        {
+            "actor_type": actor["user_type"] if actor else "system",
+            "actor_id": actor["user_id"] if actor else None,
+            "action": action,
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "ip": ip,
+            "metadata": metadata,
+            "event_ts": datetime.utcnow(),
+        }
+    )
+
+
+def change_diff(before, after):
+    """Return ``{column: [old, new]}`` for the columns that changed (JSON-ready)."""
+    before = {key: serialize_value(value) for key, value in (before or {}).items()}
+    after = {key: serialize_value(value) for key, value in (after or {}).items()}
+    return {
+        key: [before.get(key), after.get(key)]
+        for key in dict.fromkeys([*before, *after])
+        if before.get(key) != after.get(key)
+    }
+
+
+def audit_change(model, before, after):
+    if model is AuditLog:
+        return
+    if before is None:
+        action = "create"
+    elif after is None:
+        action = "delete"
+    elif model is Appointment and after.get("status") == "canceled" != before.get("status"):
+        action = "cancel"
+    else:
+        action = "update"
+    pk_name = sa_inspect(model).primary_key[0].name
+    entity_id = (after or before).get(pk_name)
+    audit(action, model.__tablename__, entity_id, change_diff(before, after))
+
+
+# ========= Feed de cambios =========
+CHANGE_FEED_MODELS = (Appointment, ProviderAvailability, ProviderException)
+CHANGE_FEED_TABLES = {model.__tablename__ for model in CHANGE_FEED_MODELS}
+CHANGE_FEED_BATCH = 200
+CHANGE_FEED_POLL_SECONDS = 0.5
+
+
+class MemoryChangeFeed:
+    """Per-process ring buffer with the last ``size`` change events.
+
+    Versions are consecutive, so the events after a version are a slice of
+    the buffer. Readers block on a condition until a newer event arrives.
+    """
+
+    def __init__(self, size):
+        self._events = deque(maxlen=size)
+        self._changed = threading.Condition()
+        self._version = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def append(self, event):
+        with self._changed:
+            self._version += 1
+            self._events.append({"version": self._version, **event})
+            self._changed.notify_all()
+
+    def read(self, since, limit):
+        """Return ``(events, reset)`` for the events after ``since``.
+
+        ``reset`` is true when some of them are no longer available (the
+        buffer wrapped, or ``since`` comes from a previous process).
+        """
+        with self._changed:
+            oldest = self._events[0]["version"] if self._events else self._version + 1
+            if since > self._version or since < oldest - 1:
+                return [], True
+            start = since - oldest + 1
+            return list(islice(self._events, start, start + limit)), False
+
+    def wait(self, since, timeout):
+        """Block until there is an event after ``since``; false on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self._version > since, timeout)
+
+
+class SQLiteChangeFeed(SQLiteBackend):
+    """Change events shared by every worker through a SQLite file.
+
+    ``AUTOINCREMENT`` keeps versions growing after old rows are trimmed, and
+    waiting readers poll every ``CHANGE_FEED_POLL_SECONDS``.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS change_events ("
+        " version INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " payload TEXT NOT NULL)",
+    )
+
+    def __init__(self, path, size):
+        super().__init__(path)
+        self.size = size
+
+    @property
+    def version(self):
+        row = self._connect().execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_events'").fetchone()
+        return row[0] if row else 0
+
+    def append(self, event):
+        conn = self._connect()
+        version = conn.execute(
+            "INSERT INTO change_events (payload) VALUES (?)", (dumps_json(event).decode(),)
+        ).lastrowid
+        conn.execute("DELETE FROM change_events WHERE version <= ?", (version - self.size,))
+
+    def read(self, since, limit):
+        conn = self._connect()
+        latest = self.version
+        oldest = conn.execute("SELECT MIN(version) FROM change_events").fetchone()[0] or latest + 1
+        if since > latest or since < oldest - 1:
+            return [], True
+        rows = conn.execute(
+            "SELECT version, payload FROM change_events WHERE version > ? ORDER BY version LIMIT ?",
+            (since, limit),
+        ).fetchall()
+        return [{"version": version, **json.loads(payload)} for version, payload in rows], False
+
+    def wait(self, since, timeout):
+        deadline = monotonic_clock.monotonic() + timeout
+        while self.version <= since:
+            remaining = deadline - monotonic_clock.monotonic()
+            if remaining <= 0:
+                return False
+            monotonic_clock.sleep(min(CHANGE_FEED_POLL_SECONDS, remaining))
+        return True
+
+
+CHANGE_FEED = (
+    SQLiteChangeFeed(CHANGE_FEED_SQLITE_PATH, CHANGE_FEED_SIZE)
+    if CHANGE_FEED_SQLITE_PATH
+    else MemoryChangeFeed(CHANGE_FEED_SIZE)
+)
+
+
+def change_event(model, before, after):
+    """Feed event for a committed write (same arguments as :func:`publish_change`)."""
+    pk = sa_inspect(model).primary_key[0].name
+    snapshots = [snapshot for snapshot in (before, after) if snapshot]
+    return {
+        "table": model.__tablename__,
+        "op": "create" if before is None else "delete" if after is None else "update",
+        "id": snapshots[-1][pk],
+        "data": None if after is None else {k: serialize_value(v) for k, v in after.items()},
+        # Antes y después: una cita movida de proveedor le interesa a ambos.
+        "provider_ids": sorted({s["provider_id"] for s in snapshots if s.get("provider_id") is not None}),
+        "patient_ids": sorted({s["patient_id"] for s in snapshots if s.get("patient_id") is not None}),
+        "at": serialize_value(datetime.utcnow()),
+    }
+
+
+def visible_to(session, event):
+    """Whether ``session`` may see ``event``, with the same scope as ``/dashboard``.
+
+    Providers only see events of their own provider id; patients see the
+    appointment events they are part of plus every availability change.
+    """
+    if session["user_type"] == "provider":
+        return session["user_id"] in event["provider_ids"]
+    return event["table"] != "appointments" or session["user_id"] in event["patient_ids"]
+
+
+def event_filter(session, tables=None, provider_id=None, patient_id=None):
+    def wanted(event):
+        return (
+            (tables is None or event["table"] in tables)
+            and (provider_id is None or provider_id in event["provider_ids"])
+            and (patient_id is None or patient_id in event["patient_ids"])
+            and visible_to(session, event)
+        )
+
+    return wanted
+
+
+def sse_frame(event_type, version, payload):
+    return b"event: %s\nid: %d\ndata: %s\n\n" % (event_type.encode(), version, dumps_json(payload))
+
+
+def stream_events(since, wanted):
+    """SSE generator: replays events after ``since`` and follows the feed.
+
+    Sends a comment every ``EVENTS_HEARTBEAT_SECONDS`` so proxies keep the
+    connection open, and ends after ``EVENTS_STREAM_SECONDS`` to free the
+    worker thread; ``EventSource`` reconnects with ``Last-Event-ID``.
+    """
+    deadline = monotonic_clock.monotonic() + EVENTS_STREAM_SECONDS
+    cursor = since
+    yield b"retry: 3000\n\n"
+    while True:
+        events, reset = CHANGE_FEED.read(cursor, CHANGE_FEED_BATCH)
+        if reset:
+            cursor = CHANGE_FEED.version
+            yield sse_frame("reset", cursor, {"version": cursor})
+            continue
+        for event in events:
+            cursor = event["version"]
+            if wanted(event):
+                yield sse_frame("change", cursor, event)
+        if events:
+            continue
+        remaining = deadline - monotonic_clock.monotonic()
+        if remaining <= 0:
+            return
+        if not CHANGE_FEED.wait(cursor, min(EVENTS_HEARTBEAT_SECONDS, remaining)):
+            yield b": keepalive\n\n"
+
+
+# Cada espera ocupa un hilo del servidor hasta que termina.
+EVENT_WAITERS = threading.BoundedSemaphore(EVENTS_MAX_WAITERS)
+
+
+def poll_events(since, wanted, timeout):
+    """Long-poll: the matching events after ``since``, waiting up to ``timeout`` for one."""
+    deadline = monotonic_clock.monotonic() + timeout
+    cursor = since
+    while True:
+        events, reset = CHANGE_FEED.read(cursor, CHANGE_FEED_BATCH)
+        if reset:
+            return {"version": CHANGE_FEED.version, "reset": True, "events": []}
+        if events:
+            cursor = events[-1]["version"]
+        matched = [event for event in events if wanted(event)]
+        if matched or len(events) == CHANGE_FEED_BATCH:
+            return {"version": cursor, "reset": False, "events": matched}
+        remaining = deadline - monotonic_clock.monotonic()
+        if remaining <= 0 or not CHANGE_FEED.wait(cursor, remaining):
+            return {"version": cursor, "reset": False, "events": []}
+
+
+# ========= Propagación de cambios =========
+# Modelos cuyo cambio altera la disponibilidad calculada de un proveedor.
+AVAILABILITY_MODELS = (Provider, ProviderAvailability, ProviderException, Appointment)
+
+
+def publish_change(model, before, after):
+    """Propagate a committed write to the audit log and in-process derived state.
+
+    ``before``/``after`` are :func:`row_snapshot` dicts (``None`` on create and
+    delete respectively).
+    """
+    audit_change(model, before, after)
+    TABLE_VERSIONS.bump(model.__tablename__)
+    if model in CHANGE_FEED_MODELS:
+        CHANGE_FEED.append(change_event(model, before, after))
+    if model in AVAILABILITY_MODELS:
+        for snapshot in (before, after):
+            if snapshot:
+                AVAILABILITY_CACHE.invalidate_provider(snapshot.get("provider_id"))
+    if model is NotificationPreference:
+        NOTIFICATION_PREFERENCES.apply_change(before, after)
+    try:
+        AVAILABILITY_INDEX.apply_change(model, before, after)
+    except Exception:
+        logger.exception("No se pudo actualizar el índice de disponibilidad")
+        AVAILABILITY_INDEX.invalidate()
+    if model is WaitlistEntry:
+        WAITLIST_INDEX.apply_change(before, after)
+    released = released_range(model, before, after)
+    if released:
+        try:
+            offer_released_range(*released)
+        except Exception:
+            logger.exception("No se pudo ofrecer el horario liberado a la lista de espera")
+
+
+# ========= Reservas atómicas =========
+_BOOKING_LOCKS = [threading.Lock() for _ in range(BOOKING_LOCK_STRIPES)]
+
+
+class BookingConflict(Exception):
+    """The requested time overlaps a blocking appointment of the provider."""
+
+
+@contextmanager
+def provider_booking_lock(*provider_ids):
+    """Hold the in-process lock stripes of ``provider_ids`` (always in the same order)."""
+    stripes = sorted({provider_id % len(_BOOKING_LOCKS) for provider_id in provider_ids})
+    for stripe in stripes:
+        _BOOKING_LOCKS[stripe].acquire()
+    try:
+        yield
+    finally:
+        for stripe in reversed(stripes):
+            _BOOKING_LOCKS[stripe].release()
+
+
+def lock_provider_row(db, provider_id):
+    """Lock the provider row until the transaction ends.
+
+    Returns the ``(provider_id, timezone)`` row, or ``None`` if the provider
+    does not exist.
+    """
+    query = select(Provider.provider_id, Provider.timezone).where(Provider.provider_id == provider_id)
+    if db.get_bind().dialect.name == "sqlite":
+        # SQLite ignora FOR UPDATE: una escritura vacía toma el candado de
+        # escritura de la base y serializa a los demás procesos.
+        db.execute(
+            text("UPDATE providers SET provider_id = provider_id WHERE provider_id = :provider_id"),
+            {"provider_id": provider_id},
+        )
+        return db.execute(query).first()
+    return db.execute(query.with_for_update()).first()
+
+
+def book_appointment(db, payload, appointment=None):
+    """Create ``payload`` as an appointment, or apply it to ``appointment``, atomically.
+
+    The overlap check and the write happen under the provider's lock stripe
+    and the provider row lock, so concurrent bookings for the same provider
+    are serialized while unrelated providers never contend. Commits and
+    returns the refreshed appointment. Raises ``ValueError`` for invalid
+    input, ``LookupError`` for an unknown provider and
+    :class:`BookingConflict` when the slot is taken.
+    """
+    current = appointment or Appointment()
+    start_at = payload.get("start_at", current.start_at)
+    end_at = payload.get("end_at", current.end_at)
+    if not start_at or not end_at:
+        raise ValueError("La cita debe incluir hora de inicio y fin.")
+    if start_at >= end_at:
+        raise ValueError("La hora de inicio debe ser anterior a la de fin.")
+    try:
+        provider_id = int(payload.get("provider_id", current.provider_id))
+    except (TypeError, ValueError):
+        raise ValueError("La cita debe indicar un proveedor válido.") from None
+    payload["provider_id"] = provider_id
+
+    provider_ids = {provider_id}
+    if appointment is not None:
+        provider_ids.add(appointment.provider_id)
+
+    with provider_booking_lock(*provider_ids):
+        locked = {}
+        for locked_id in sorted(provider_ids):
+            locked[locked_id] = lock_provider_row(db, locked_id)
+            if locked[locked_id] is None:
+                raise LookupError("El proveedor solicitado no existe.")
+        exclude_id = appointment.appointment_id if appointment is not None else None
+        if appointment_overlaps(db, provider_id, start_at, end_at, exclude_id=exclude_id):
+            raise BookingConflict("El proveedor ya tiene una cita reservada en ese horario.")
+        hold = waitlist_hold(db, provider_id, start_at, end_at)
+        held = None
+        if hold is not None:
+            if hold.patient_id != payload.get("patient_id", current.patient_id):
+                raise BookingConflict("El horario está apartado para un paciente de la lista de espera.")
+            held = row_snapshot(hold)
+            hold.status = "booked"
+
+        if appointment is None:
+            appointment = Appointment(**payload)
+            db.add(appointment)
+            event = "booked"
+        else:
+            previous = (appointment.provider_id, appointment.start_at, appointment.end_at, appointment.status)
+            for k, v in payload.items():
+                if hasattr(appointment, k):
+                    setattr(appointment, k, v)
+            event = appointment_event(previous, appointment)
+        if event:
+            db.flush()
+            enqueue_appointment_notifications(db, appointment, event, locked[provider_id].timezone)
+        db.commit()
+    db.refresh(appointment)
+    if held is not None:
+        publish_change(WaitlistEntry, held, row_snapshot(hold))
+    return appointment
+
+
+# ========= Lista de espera (F18) =========
+WAITLIST_SWEEP_BATCH = 100
+# Horarios revisados por cada rango liberado (una excepción larga puede abarcar semanas).
+WAITLIST_MAX_SLOTS = 50
+
+
+class IntervalBucket:
+    """Intervals sorted by start plus a segment tree of the maximum end.
+
+    :meth:`containing` finds every interval that covers ``[start, end)``:
+    a bisect bounds the candidates that start early enough, and the tree only
+    descends into subtrees whose maximum end reaches ``end``, so the cost is
+    ``O(log n)`` per match instead of a scan. Writes mark the bucket dirty
+    and the arrays are rebuilt on the next query.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self._dirty = True
+
+    def put(self, key, start, end):
+        self.items[key] = (start, end)
+        self._dirty = True
+
+    def discard(self, key):
+        if self.items.pop(key, None) is not None:
+            self._dirty = True
+
+    def _rebuild(self):
+        ordered = sorted((start, end, key) for key, (start, end) in self.items.items())
+        self._starts = [start for start, _, _ in ordered]
+        self._keys = [key for _, _, key in ordered]
+        size = 1
+        while size < len(ordered):
+            size *= 2
+        tree = [None] * (2 * size)
+        for index, (_, end, _) in enumerate(ordered):
+            tree[size + index] = end
+        for node in range(size - 1, 0, -1):
+            children = [end for end in (tree[2 * node], tree[2 * node + 1]) if end is not None]
+            tree[node] = max(children) if children else None
+        self._size = size
+        self._tree = tree
+        self._dirty = False
+
+    def containing(self, start, end):
+        """Keys of the intervals with ``interval.start <= start`` and ``interval.end >= end``."""
+        if self._dirty:
+            self._rebuild()
+        limit = bisect_right(self._starts, start)
+        found = []
+        stack = [(1, 0, self._size)]
+        while stack:
+            node, low, high = stack.pop()
+            if low >= limit or self._tree[node] is None or self._tree[node] < end:
+                continue
+            if high - low == 1:
+                found.append(self._keys[low])
+                continue
+            middle = (low + high) // 2
+            stack.append((2 * node + 1, middle, high))
+            stack.append((2 * node, low, middle))
+        return found
+
+
+class WaitlistIndex:
+    """In-memory ``waiting`` entries bucketed by provider and by specialty.
+
+    Loaded with one query and kept current by :func:`publish_change`, like
+    :class:`AvailabilityIndex`; reloaded after ``WAITLIST_INDEX_TTL_SECONDS``
+    to pick up entries created by other workers.
+    """
+
+    def __init__(self, ttl_seconds=WAITLIST_INDEX_TTL_SECONDS):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self._lock = threading.RLock()
+        self._buckets = {}
+        self._bucket_of = {}
+        self._loaded_at = None
+
+    @staticmethod
+    def bucket_key(provider_id, specialty):
+        if provider_id is not None:
+            return ("provider", int(provider_id))
+        return ("specialty", (specialty or "").strip().lower())
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at and datetime.utcnow() - self._loaded_at < self.ttl:
+                return
+            # Las ventanas están en hora local del proveedor: un día de margen.
+            horizon = datetime.utcnow() - timedelta(days=1)
+            db = SessionLocal()
+            try:
+                rows = db.execute(
+                    select(
+                        WaitlistEntry.waitlist_id,
+                        WaitlistEntry.provider_id,
+                        WaitlistEntry.specialty,
+                        WaitlistEntry.window_start,
+                        WaitlistEntry.window_end,
+                    ).where(WaitlistEntry.status == "waiting", WaitlistEntry.window_end > horizon)
+                ).all()
+            finally:
+                db.close()
+            self._buckets = {}
+            self._bucket_of = {}
+            for row in rows:
+                self._put(row.waitlist_id, self.bucket_key(row.provider_id, row.specialty), row.window_start, row.window_end)
+            self._loaded_at = datetime.utcnow()
+
+    def _put(self, waitlist_id, key, start, end):
+        self._buckets.setdefault(key, IntervalBucket()).put(waitlist_id, start, end)
+        self._bucket_of[waitlist_id] = key
+
+    def _discard(self, waitlist_id):
+        key = self._bucket_of.pop(waitlist_id, None)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.discard(waitlist_id)
+            if not bucket.items:
+                del self._buckets[key]
+
+    def apply_change(self, before, after):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if before:
+                self._discard(before["waitlist_id"])
+            if after and after.get("status", "waiting") == "waiting":
+                key = self.bucket_key(after.get("provider_id"), after.get("specialty"))
+                self._put(after["waitlist_id"], key, after["window_start"], after["window_end"])
+
+    def candidates(self, provider_id, specialty, start_at, end_at):
+        """Ids of the waiting entries whose window covers the slot, oldest first."""
+        self._ensure_loaded()
+        with self._lock:
+            found = []
+            for key in (self.bucket_key(provider_id, None), self.bucket_key(None, specialty)):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    found.extend(bucket.containing(start_at, end_at))
+        return sorted(found)
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._bucket_of)
+
+
+WAITLIST_INDEX = WaitlistIndex()
+
+
+def waitlist_hold(db, provider_id, start_at, end_at):
+    """The unexpired waitlist offer holding a slot that overlaps ``[start_at, end_at)``."""
+    return db.execute(
+        select(WaitlistEntry).where(
+            WaitlistEntry.offered_provider_id == provider_id,
+            WaitlistEntry.status == "offered",
+            WaitlistEntry.offered_start_at < end_at,
+            WaitlistEntry.offered_end_at > start_at,
+            WaitlistEntry.offer_expires_at > datetime.utcnow(),
+        ).limit(1)
+    ).scalars().first()
+
+
+def busy_ranges(db, provider_id, start_at, end_at):
+    """Active appointments and blocking exceptions of the provider overlapping the range."""
+    appointments = db.execute(
+        select(Appointment.start_at, Appointment.end_at).where(
+            Appointment.provider_id == provider_id,
+            Appointment.status.in_(ACTIVE_APPOINTMENT_STATUSES),
+            Appointment.start_at < end_at,
+            Appointment.end_at > start_at,
+        )
+    ).all()
+    exceptions = db.execute(exceptions_query(provider_id, start_at, end_at, blocking_only=True)).scalars()
+    return [*appointments, *((start, end) for start, end, _ in iter_exceptions(exceptions, start_at, end_at))]
+
+
+def released_range(model, before, after):
+    """``(provider_id, freed, exact)`` for the time a committed write freed, or ``None``.
+
+    ``freed`` is an :data:`ExceptionRule` with the previous interval (or
+    series). A canceled, moved or deleted appointment frees exactly its slot
+    (``exact``); a removed or changed blocking exception frees its occurrences,
+    which are cut into slots along the provider's weekly rules.
+    """
+    if not before:
+        return None
+    if model is Appointment:
+        if before.get("status") not in ACTIVE_APPOINTMENT_STATUSES:
+            return None
+        still_held = after and after.get("status") in ACTIVE_APPOINTMENT_STATUSES
+        exact = True
+    elif model is ProviderException:
+        if before.get("is_blocking") is False:
+            return None
+        still_held = after and after.get("is_blocking") is not False
+        exact = False
+    else:
+        return None
+    fields = ("provider_id", *ExceptionRule._fields)
+    if still_held and all(after.get(name) == before.get(name) for name in fields):
+        return None
+    return before["provider_id"], exception_rule(before), exact
+
+
+def released_slots(db, provider_id, freed, exact, now_local):
+    if exact:
+        return [(freed.start_at, freed.end_at)] if freed.start_at >= now_local else []
+    horizon = now_local + timedelta(days=SEARCH_DAYS_RANGE[1])
+    ranges = list(iter_exception_occurrences(freed, now_local, horizon))
+    if not ranges:
+        return []
+    start_at, end_at = ranges[0][0], ranges[-1][1]
+    first_day = max(start_at, now_local).date()
+    days = (end_at.date() - first_day).days
+    rules = db.execute(
+        select(ProviderAvailability).where(ProviderAvailability.provider_id == provider_id)
+    ).scalars().all()
+    busy = merge_intervals(busy_ranges(db, provider_id, start_at, end_at))
+    slots = iter_free_slots(weekly_windows(rules), busy, first_day, days, SLOT_MINUTES_DEFAULT, now=now_local)
+    # Las ocurrencias no se traslapan: basta la última que empieza antes del slot.
+    starts = [start for start, _ in ranges]
+
+    def inside(slot):
+        position = bisect_right(starts, slot[0]) - 1
+        return position >= 0 and ranges[position][1] >= slot[1]
+
+    return list(islice(filter(inside, slots), WAITLIST_MAX_SLOTS))
+
+
+def enqueue_waitlist_offer(db, entry_values, now):
+    """Queue the offer for every enabled channel of the patient (email if none)."""
+    patient_id = entry_values["patient_id"]
+    payload = {
+        "event": "waitlist_offer",
+        "waitlist_id": entry_values["waitlist_id"],
+        "patient_id": patient_id,
+        "provider_id": entry_values["offered_provider_id"],
+        "start_at": serialize_value(entry_values["offered_start_at"]),
+        "end_at": serialize_value(entry_values["offered_end_at"]),
+        "expires_at": serialize_value(entry_values["offer_expires_at"]),
+        "user_type": "patient",
+        "user_id": patient_id,
+    }
+    # La oferta caduca pronto: sin preferencias registradas se avisa por correo.
+    channels = [channel for channel, _ in NOTIFICATION_PREFERENCES.get("patient", patient_id)] or ["email"]
+    contact = recipient_contact(db, "patient", patient_id)
+    for channel in channels:
+        db.add(
+            NotificationOutbox(
+                channel=channel,
+                template="waitlist_offer",
+                payload={**payload, **recipient_fields(contact, channel)},
+                send_after=now,
+            )
+        )
+
+
+def offer_slot(db, provider_id, waitlist_id, start_at, end_at):
+    """Hold ``[start_at, end_at)`` for a waiting entry and queue the offer.
+
+    Runs under the provider's booking lock, so no booking can take the slot
+    between the check and the hold. The conditional update makes sure an
+    entry waiting for a specialty is offered only one slot even when two
+    providers free one at once. Returns the entry's ``(before, after)``
+    snapshots, or ``None`` if the slot or the entry is no longer available.
+    """
+    with provider_booking_lock(provider_id):
+        try:
+            lock_provider_row(db, provider_id)
+            entry = db.get(WaitlistEntry, waitlist_id)
+            if (
+                entry is None
+                or entry.status != "waiting"
+                or busy_ranges(db, provider_id, start_at, end_at)
+                or waitlist_hold(db, provider_id, start_at, end_at) is not None
+            ):
+                db.rollback()
+                return None
+            before = row_snapshot(entry)
+            now = datetime.utcnow()
+            offer = {
+                "status": "offered",
+                "offered_provider_id": provider_id,
+                "offered_start_at": start_at,
+                "offered_end_at": end_at,
+                "offer_expires_at": now + timedelta(minutes=WAITLIST_HOLD_MINUTES),
+                "updated_at": now,
+            }
+            claimed = db.execute(
+                update(WaitlistEntry)
+                .where(WaitlistEntry.waitlist_id == waitlist_id, WaitlistEntry.status == "waiting")
+                .values(**offer)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not claimed:
+                db.rollback()
+                return None
+            after = {**before, **offer}
+            enqueue_waitlist_offer(db, after, now)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return before, after
+
+
+def offer_released_range(provider_id, freed, exact):
+    """Offer each free slot of a released range to the oldest waiting entry that fits it."""
+    if provider_id is None or not len(WAITLIST_INDEX):
+        return []
+    offers = []
+    db = SessionLocal()
+    try:
+        provider = db.get(Provider, provider_id)
+        if provider is None:
+            return []
+        tz, _ = resolve_timezone(provider.timezone)
+        now_local = datetime.now(tz).replace(tzinfo=None)
+        for slot_start, slot_end in released_slots(db, provider_id, freed, exact, now_local):
+            for waitlist_id in WAITLIST_INDEX.candidates(provider_id, provider.specialty, slot_start, slot_end):
+                offer = offer_slot(db, provider_id, waitlist_id, slot_start, slot_end)
+                if offer is not None:
+                    offers.append(offer)
+                    break
+    finally:
+        db.close()
+    for before, after in offers:
+        publish_change(WaitlistEntry, before, after)
+    if offers:
+        WAITLIST_SWEEPER.ensure_started()
+    return offers
+
+
+def expire_waitlist_offers(now=None):
+    """Expire lapsed holds and offer each slot to the next waiting entry; returns the count."""
+    now = now or datetime.utcnow()
+    expired = []
+    db = SessionLocal()
+    try:
+        entries = db.execute(
+            select(WaitlistEntry)
+            .where(WaitlistEntry.status == "offered", WaitlistEntry.offer_expires_at <= now)
+            .limit(WAITLIST_SWEEP_BATCH)
+        ).scalars().all()
+        for entry in entries:
+            before = row_snapshot(entry)
+            claimed = db.execute(
+                update(WaitlistEntry)
+                .where(WaitlistEntry.waitlist_id == entry.waitlist_id, WaitlistEntry.status == "offered")
+                .values(status="expired", updated_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed:
+                expired.append(before)
+        db.commit()
+    finally:
+        db.close()
+    for before in expired:
+        publish_change(WaitlistEntry, before, {**before, "status": "expired", "updated_at": now})
+        offer_released_range(
+            before["offered_provider_id"], ExceptionRule(before["offered_start_at"], before["offered_end_at"]), True
+        )
+    return len(expired)
+
+
+class WaitlistSweeper:
+    """Daemon thread that runs :func:`expire_waitlist_offers` every ``interval`` seconds.
+
+    Started with the first offer made by this process.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="waitlist-sweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                expire_waitlist_offers()
+            except Exception:
+                logger.exception("No se pudieron expirar las ofertas de la lista de espera")
+
+
+WAITLIST_SWEEPER = WaitlistSweeper(WAITLIST_SWEEP_SECONDS)
+
+
+# ========= Altas masivas =========
+# Llaves únicas por las que un alta masiva puede actualizar en lugar de insertar.
+UPSERT_KEYS = {
+    Patient: ("email",),
+    Provider: ("email",),
+    NotificationPreference: ("user_type", "user_id", "channel"),
+}
+
+
+def parse_bulk_body(raw, mimetype):
+    """Decode a bulk request body: a JSON array, or NDJSON (one object per line)."""
+    if mimetype == NDJSON_MIMETYPE:
+        items = []
+        for number, line in enumerate(raw.splitlines(), start=1):
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    raise ValueError(f"Línea {number} no es JSON válido.") from None
+    else:
+        try:
+            items = json.loads(raw or b"null")
+        except ValueError:
+            raise ValueError("El cuerpo no es JSON válido.") from None
+        if not isinstance(items, list):
+            raise ValueError("Se esperaba un arreglo JSON o NDJSON.")
+    if len(items) > BULK_MAX_ITEMS:
+        raise ValueError(f"El lote excede el máximo de {BULK_MAX_ITEMS} elementos.")
+    return items
+
+
+def bulk_error(code, message, fields=None):
+    result = {"status": "error", "code": code, "error": message}
+    if fields:
+        result["fields"] = fields
+    return result
+
+
+def upsert_key(model, payload):
+    return tuple(payload.get(name) for name in UPSERT_KEYS[model])
+
+
+def load_existing_by_key(db, model, keys):
+    """Return ``{key: obj}`` for the rows of ``model`` matching any of ``keys`` (one query)."""
+    names = UPSERT_KEYS[model]
+    columns = [getattr(model, name) for name in names]
+    if len(columns) == 1:
+        condition = columns[0].in_([key[0] for key in keys])
+    else:
+        condition = tuple_(*columns).in_(list(keys))
+    return {
+        tuple(getattr(obj, name) for name in names): obj
+        for obj in db.execute(select(model).where(condition)).scalars()
+    }
+
+
+def check_batch_overlaps(db, entries):
+    """Mark the batch appointments that overlap each other, a stored appointment or a waitlist hold.
+
+    ``entries`` are ``(index, payload)`` pairs already locked by provider.
+    Stored blocking appointments and unexpired holds are read with one query
+    each per provider; the active batch items are then swept in start order
+    against the sorted, non-overlapping appointments, which grow as items are
+    accepted. As in :func:`book_appointment`, only the held patient may book
+    a held slot. Returns ``({index: error}, {index: [held WaitlistEntry]})``.
+    """
+    by_provider = {}
+    for index, payload in entries:
+        if payload.get("status", "booked") in ACTIVE_APPOINTMENT_STATUSES:
+            by_provider.setdefault(payload["provider_id"], []).append((index, payload))
+
+    rejected = {}
+    claimed = {}
+    for provider_id, items in by_provider.items():
+        items.sort(key=lambda item: item[1]["start_at"])
+        first_start = items[0][1]["start_at"]
+        last_end = max(payload["end_at"] for _, payload in items)
+        stored = db.execute(
+            select(Appointment.start_at, Appointment.end_at).where(
+                Appointment.provider_id == provider_id,
+                Appointment.status.in_(ACTIVE_APPOINTMENT_STATUSES),
+                Appointment.start_at < last_end,
+                Appointment.end_at > first_start,
+            )
+        ).all()
+        # Un horario solo se aparta si está libre: los apartados no se traslapan entre sí.
+        holds = db.execute(
+            select(WaitlistEntry).where(
+                WaitlistEntry.offered_provider_id == provider_id,
+                WaitlistEntry.status == "offered",
+                WaitlistEntry.offered_start_at < last_end,
+                WaitlistEntry.offered_end_at > first_start,
+                WaitlistEntry.offer_expires_at > datetime.utcnow(),
+            ).order_by(WaitlistEntry.offered_start_at)
+        ).scalars().all()
+        hold_starts = [hold.offered_start_at for hold in holds]
+        taken = merge_intervals((start_at, end_at) for start_at, end_at in stored)
+        starts = [start_at for start_at, _ in taken]
+        for index, payload in items:
+            start_at, end_at = payload["start_at"], payload["end_at"]
+            position = bisect_right(starts, start_at)
+            if (position and taken[position - 1][1] > start_at) or (
+                position < len(taken) and taken[position][0] < end_at
+            ):
+                rejected[index] = "El proveedor ya tiene una cita reservada en ese horario."
+                continue
+            held = []
+            hold_index = bisect_left(hold_starts, end_at) - 1
+            while hold_index >= 0 and holds[hold_index].offered_end_at > start_at:
+                held.append(holds[hold_index])
+                hold_index -= 1
+            if any(hold.patient_id != payload.get("patient_id") for hold in held):
+                rejected[index] = "El horario está apartado para un paciente de la lista de espera."
+                continue
+            if held:
+                claimed[index] = held
+            taken.insert(position, (start_at, end_at))
+            starts.insert(position, start_at)
+    return rejected, claimed
+
+
+def prepare_appointments(db, entries):
+    """Validate and lock the providers of a batch of appointments.
+
+    Returns ``({index: error result}, {provider_id: timezone}, {index: [held
+    WaitlistEntry]})``. Must run inside :func:`provider_booking_lock` for the
+    same providers.
+    """
+    errors = {}
+    timezones = {}
+    for index, payload in entries:
+        if payload["start_at"] >= payload["end_at"]:
+            errors[index] = bulk_error(400, "La hora de inicio debe ser anterior a la de fin.")
+    for provider_id in sorted({payload["provider_id"] for _, payload in entries}):
+        row = lock_provider_row(db, provider_id)
+        if row is not None:
+            timezones[provider_id] = row.timezone
+    for index, payload in entries:
+        if index not in errors and payload["provider_id"] not in timezones:
+            errors[index] = bulk_error(404, "El proveedor solicitado no existe.")
+    valid = [(index, payload) for index, payload in entries if index not in errors]
+    rejected, claimed = check_batch_overlaps(db, valid)
+    for index, message in rejected.items():
+        errors[index] = bulk_error(409, message)
+    return errors, timezones, claimed
+
+
+def write_chunk(db, model, entries, upsert):
+    """Insert (or upsert) one chunk in a single flush and commit.
+
+    Returns ``(results, changes)``: per-index results and the
+    ``(model, before, after)`` snapshots to publish once the commit succeeded.
+    """
+    pk_name = sa_inspect(model).primary_key[0].name
+    results = {}
+    keys = UPSERT_KEYS.get(model)
+    existing = {}
+    if keys:
+        seen = set()
+        for index, payload in entries:
+            key = upsert_key(model, payload)
+            if key in seen:
+                results[index] = bulk_error(409, "Registro duplicado dentro del lote.")
+            seen.add(key)
+        existing = load_existing_by_key(db, model, seen)
+
+    timezones = {}
+    claimed = {}
+    if model is Appointment:
+        errors, timezones, claimed = prepare_appointments(db, entries)
+        results.update(errors)
+
+    pending = []
+    for index, payload in entries:
+        if index in results:
+            continue
+        obj = existing.get(upsert_key(model, payload)) if keys else None
+        if obj is not None and not upsert:
+            results[index] = bulk_error(409, f"Ya existe un registro con {', '.join(keys)} {upsert_key(model, payload)}.")
+            continue
+        if obj is None:
+            obj = model(**payload)
+            db.add(obj)
+            pending.append((index, "created", None, obj))
+        else:
+            before = row_snapshot(obj)
+            for k, v in payload.items():
+                setattr(obj, k, v)
+            pending.append((index, "updated", before, obj))
+
+    changes = []
+    # Las citas del paciente apartado confirman su lugar en la lista de espera.
+    for index, _, _, _ in pending:
+        for hold in claimed.get(index, ()):
+            before = row_snapshot(hold)
+            hold.status = "booked"
+            changes.append((WaitlistEntry, before, row_snapshot(hold)))
+
+    # Un solo flush: los UPDATE con las mismas columnas salen como executemany.
+    db.flush()
+    now = datetime.utcnow()
+    for index, status, before, obj in pending:
+        if model is Appointment and status == "created" and obj.status in ACTIVE_APPOINTMENT_STATUSES:
+            tz, _ = resolve_timezone(timezones[obj.provider_id])
+            if obj.start_at.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None) > now:
+                enqueue_appointment_notifications(db, obj, "booked", timezones[obj.provider_id])
+        after = row_snapshot(obj)
+        results[index] = {"status": status, pk_name: after[pk_name]}
+        changes.append((model, before, after))
+    db.commit()
+    return results, changes
+
+
+def bulk_write(model, items, upsert=False, chunk_size=None):
+    """Validate ``items`` in one pass and write them in chunks of ``chunk_size``.
+
+    Each chunk is its own transaction: a database error fails only the items
+    of that chunk. Returns one result per item, in input order.
+    """
+    chunk_size = max(1, chunk_size or BULK_CHUNK_SIZE)
+    payloads, errors = schema_for(model).validate_many(items)
+    results = [None] * len(items)
+    for index, fields in errors.items():
+        results[index] = bulk_error(400, "Datos inválidos.", fields)
+
+    valid = [(index, payload) for index, payload in enumerate(payloads) if payload is not None]
+    for offset in range(0, len(valid), chunk_size):
+        chunk = valid[offset:offset + chunk_size]
+        db = SessionLocal()
+        try:
+            if model is Appointment:
+                with provider_booking_lock(*{payload["provider_id"] for _, payload in chunk}):
+                    chunk_results, changes = write_chunk(db, model, chunk, upsert)
+            else:
+                chunk_results, changes = write_chunk(db, model, chunk, upsert)
+        except IntegrityError as e:
+            db.rollback()
+            chunk_results = {index: bulk_error(400, str(e.orig)) for index, _ in chunk}
+            changes = []
+        except ValueError as e:
+            # Validaciones de los modelos al hacer flush (p. ej. la recurrencia de una excepción).
+            db.rollback()
+            chunk_results = {index: bulk_error(400, str(e)) for index, _ in chunk}
+            changes = []
+        finally:
+            db.close()
+        for index, result in chunk_results.items():
+            results[index] = result
+        for changed_model, before, after in changes:
+            publish_change(changed_model, before, after)
+
+    for index, result in enumerate(results):
+        result["index"] = index
+    return results
+
+
+# ========= Horario semanal (U5) =========
+WEEKLY_IMPORT_MAX_RULES = 500
+WEEKDAY_NAMES = ("lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo")
+
+
+def import_weekday(weekday, base):
+    """Stored 1-7 (Monday-Sunday, as the UI saves it) weekday for ``weekday`` counted from ``base``."""
+    if not base <= weekday <= base + 6:
+        raise ValueError(f"debe estar entre {base} y {base + 6}")
+    return weekday - base + 1
+
+
+def parse_weekly_rules(provider_id, items, base):
+    """Validate an import and return its rules sorted by ``(weekday, start_time, end_time)``.
+
+    Every rule goes through the ``ProviderAvailability`` schema; its weekday
+    is read in the explicit ``base`` (0 or 1) instead of guessing like
+    :func:`normalize_weekday`. All errors are reported together in a
+    :class:`PayloadError` keyed ``rules[i].field``.
+    """
+    schema = schema_for(ProviderAvailability)
+    rules, errors = [], {}
+    for index, item in enumerate(items):
+        prefix = f"rules[{index}]"
+        if not isinstance(item, dict):
+            errors[prefix] = "debe ser un objeto JSON"
+            continue
+        try:
+            payload = schema.validate({**item, "provider_id": provider_id})
+        except PayloadError as exc:
+            errors.update((f"{prefix}.{field}", message) for field, message in exc.errors.items())
+            continue
+        try:
+            payload["weekday"] = import_weekday(payload["weekday"], base)
+        except ValueError as exc:
+            errors[f"{prefix}.weekday"] = str(exc)
+            continue
+        if payload["start_time"] >= payload["end_time"]:
+            errors[f"{prefix}.end_time"] = "debe ser posterior a start_time"
+            continue
+        rules.append((index, payload))
+    if errors:
+        raise PayloadError(errors)
+    rules.sort(key=lambda rule: (rule[1]["weekday"], rule[1]["start_time"], rule[1]["end_time"]))
+    return rules
+
+
+def sweep_weekly_rules(rules):
+    """Reject overlaps and coalesce touching windows of ``rules`` sorted by weekday and start.
+
+    One pass per weekday keeps the window that reaches furthest; a rule that
+    starts before it ends overlaps it, and one that starts exactly at its end
+    with the same location is merged into it. Returns the coalesced payloads.
+    """
+    merged, errors = [], {}
+    current = None
+    for index, payload in rules:
+        if current is not None and current[1]["weekday"] == payload["weekday"]:
+            previous_index, previous = current
+            if payload["start_time"] < previous["end_time"]:
+                day = WEEKDAY_NAMES[payload["weekday"] - 1]
+                errors[f"rules[{index}]"] = (
+                    f"se traslapa con rules[{previous_index}] ({day} "
+                    f"{previous['start_time']:%H:%M}-{previous['end_time']:%H:%M})"
+                )
+                if payload["end_time"] > previous["end_time"]:
+                    current = (index, payload)
+                continue
+            if payload["start_time"] == previous["end_time"] and payload.get("location") == previous.get("location"):
+                previous["end_time"] = payload["end_time"]
+                continue
+        current = (index, dict(payload))
+        merged.append(current[1])
+    if errors:
+        raise PayloadError(errors)
+    return merged
+
+
+def replace_weekly_rules(db, provider_id, rules):
+    """Make the stored weekly rules of the provider equal to ``rules`` in one transaction.
+
+    Stored rows are matched by ``(weekday, start_time, end_time)`` (legacy 0-6
+    weekdays included): matches are kept, or updated when the location or the
+    stored weekday form differ; the rest are deleted and the unmatched rules
+    inserted. Returns ``(summary, changes, rows)`` with the ``(before, after)``
+    snapshots to publish once committed. Raises ``LookupError`` for an unknown
+    provider.
+    """
+    if lock_provider_row(db, provider_id) is None:
+        raise LookupError("El proveedor solicitado no existe.")
+    existing = {}
+    stale = []
+    for row in db.execute(
+        select(ProviderAvailability).where(ProviderAvailability.provider_id == provider_id)
+    ).scalars():
+        weekday = normalize_weekday(row.weekday)
+        key = (None if weekday is None else weekday + 1, row.start_time, row.end_time)
+        kept = existing.get(key)
+        # Entre duplicados se conserva la fila que ya está guardada en 1-7.
+        if kept is not None and (kept.weekday == key[0] or row.weekday != key[0]):
+            stale.append(row)
+            continue
+        if kept is not None:
+            stale.append(kept)
+        existing[key] = row
+
+    summary = {"created": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    pending, rows = [], []
+    for payload in rules:
+        row = existing.pop((payload["weekday"], payload["start_time"], payload["end_time"]), None)
+        if row is None:
+            row = ProviderAvailability(**payload)
+            db.add(row)
+            pending.append(("created", None, row))
+        elif row.weekday != payload["weekday"] or row.location != payload.get("location"):
+            before = row_snapshot(row)
+            row.weekday, row.location = payload["weekday"], payload.get("location")
+            pending.append(("updated", before, row))
+        else:
+            summary["unchanged"] += 1
+        rows.append(row)
+    for row in [*existing.values(), *stale]:
+        pending.append(("deleted", row_snapshot(row), None))
+        db.delete(row)
+
+    # Un solo flush: altas, cambios y bajas salen agrupados en la misma transacción.
+    db.flush()
+    changes = []
+    for status, before, row in pending:
+        summary[status] += 1
+        changes.append((before, row_snapshot(row) if row is not None else None))
+    db.commit()
+    return summary, changes, rows
+
+
+# ========= Agenda del día =========
+APPOINTMENT_STATUSES = tuple(Appointment.__table__.c.status.type.enums)
+AGENDA_TABLES = ("appointments", "patients", "providers")
+
+# Citas con los datos del paciente en la misma fila (sin cargar relaciones una por una).
+AGENDA_COLUMNS = (
+    *Appointment.__table__.columns,
+    (Patient.first_name + " " + Patient.last_name).label("patient_name"),
+    Patient.email.label("patient_email"),
+    Patient.phone.label("patient_phone"),
+)
+
+
+def parse_day_param(args, default):
+    raw = (args.get("date") or "").strip()
+    if not raw:
+        return default
+    try:
+        return date.fromisoformat(raw)
+    except ValueError:
+        raise ValueError("El parámetro date debe tener formato AAAA-MM-DD.") from None
+
+
+def day_bounds(day):
+    """``(start, end)`` of ``day`` in the naive provider-local wall time appointments use."""
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def count_statuses(rows):
+    """Zero-filled ``{status: n}`` from ``(status, n)`` rows."""
+    counts = dict.fromkeys(APPOINTMENT_STATUSES, 0)
+    for status, n in rows:
+        counts[status] += n
+    return counts
+
+
+def agenda_etag(*parts):
+    return make_etag(
+        TABLE_VERSIONS.epoch, *parts, *(TABLE_VERSIONS.get(table) for table in AGENDA_TABLES)
+    )
+
+
+def agenda_queries(provider_id, day):
+    """``(appointments, status counts)`` statements for one provider's ``day``.
+
+    Both are ranges on ``idx_provider_time``; the patient join is by primary key.
+    """
+    start, end = day_bounds(day)
+    in_day = (
+        Appointment.provider_id == provider_id,
+        Appointment.start_at >= start,
+        Appointment.start_at < end,
+    )
+    appointments = (
+        select(*AGENDA_COLUMNS)
+        .join(Patient, Patient.patient_id == Appointment.patient_id)
+        .where(*in_day)
+        .order_by(Appointment.start_at)
+    )
+    counts = select(Appointment.status, func.count()).where(*in_day).group_by(Appointment.status)
+    return appointments, counts
+
+
+def provider_agenda(db, provider, day):
+    """One provider's appointments for ``day`` with patient columns and status counts."""
+    appointments_stmt, counts_stmt = agenda_queries(provider.provider_id, day)
+    serialize = SERIALIZERS.for_columns(AGENDA_COLUMNS)
+    appointments = [serialize(row) for row in db.execute(appointments_stmt)]
+    counts = db.execute(counts_stmt).all()
+    _, timezone_name = resolve_timezone(provider.timezone)
+    return {
+        "provider": to_dict(provider),
+        "date": day.isoformat(),
+        "timezone": timezone_name,
+        "counts": count_statuses(counts),
+        "appointments": appointments,
+    }
+
+
+DAY_BOARD_COLUMNS = (
+    *AGENDA_COLUMNS,
+    Provider.display_name.label("provider_name"),
+    Provider.specialty.label("provider_specialty"),
+    Provider.timezone.label("provider_timezone"),
+)
+
+
+def local_days(db):
+    """``{day: [timezone, ...]}``: today's date in every provider timezone in use."""
+    days = {}
+    for (name,) in db.execute(select(Provider.timezone).distinct().order_by(Provider.timezone)):
+        tz, _ = resolve_timezone(name)
+        days.setdefault(datetime.now(tz).date(), []).append(name)
+    return days
+
+
+def day_board_queries(days):
+    """``(appointments, status counts)`` statements for :func:`day_board`.
+
+    ``days`` maps each date to the provider timezones it applies to, or to
+    ``None`` for every provider. Providers are the driving table and
+    appointments are reached through ``idx_provider_time``.
+    """
+    conditions = []
+    for day, timezones in days.items():
+        start, end = day_bounds(day)
+        condition = (
+            (Appointment.provider_id == Provider.provider_id)
+            & (Appointment.start_at >= start)
+            & (Appointment.start_at < end)
+        )
+        if timezones is not None:
+            in_zone = Provider.timezone.in_([name for name in timezones if name is not None])
+            if None in timezones:
+                in_zone = in_zone | Provider.timezone.is_(None)
+            condition = condition & in_zone
+        conditions.append(condition)
+    on_day = or_(*conditions)
+    stmt = (
+        select(*DAY_BOARD_COLUMNS)
+        .select_from(Provider)
+        .join(Appointment, on_day)
+        .join(Patient, Patient.patient_id == Appointment.patient_id)
+        .order_by(Provider.display_name, Provider.provider_id, Appointment.start_at)
+    )
+    counts = (
+        select(Provider.provider_id, Appointment.status, func.count())
+        .select_from(Provider)
+        .join(Appointment, on_day)
+        .group_by(Provider.provider_id, Appointment.status)
+    )
+    return stmt, counts
+
+
+def day_board(db, days):
+    """Appointments on ``days`` (see :func:`day_board_queries`), grouped by provider.
+
+    Each provider's times are its own local wall time, so a date is the same
+    calendar date in every timezone; :func:`local_days` gives each provider
+    its own today.
+    """
+    day = next(iter(days)) if None in days.values() else None
+    day_of = {name: local for local, names in days.items() for name in names or ()}
+    stmt, counts_stmt = day_board_queries(days)
+    serialize = SERIALIZERS.for_columns(DAY_BOARD_COLUMNS)
+    counts_by_provider = {}
+    for provider_id, status, n in db.execute(counts_stmt):
+        counts_by_provider.setdefault(provider_id, []).append((status, n))
+
+    providers = {}
+    for row in db.execute(stmt):
+        item = serialize(row)
+        entry = providers.get(row.provider_id)
+        if entry is None:
+            timezone_name = item.pop("provider_timezone")
+            entry = providers[row.provider_id] = {
+                "provider_id": row.provider_id,
+                "display_name": item.pop("provider_name"),
+                "specialty": item.pop("provider_specialty"),
+                "timezone": resolve_timezone(timezone_name)[1],
+                "date": (day or day_of[timezone_name]).isoformat(),
+                "counts": count_statuses(counts_by_provider.get(row.provider_id, ())),
+                "appointments": [],
+            }
+        else:
+            del item["provider_name"], item["provider_specialty"], item["provider_timezone"]
+        entry["appointments"].append(item)
+    return {
+        "date": day.isoformat() if day else None,
+        "counts": count_statuses(pair for rows in counts_by_provider.values() for pair in rows),
+        "providers": list(providers.values()),
+    }
+
+
+# ========= Calendario iCal (F19) =========
+ICAL_STATUS = {"canceled": "CANCELLED"}
+# Margen del token de sincronización: cubre escrituras que estaban por confirmarse.
+CALENDAR_SYNC_OVERLAP = timedelta(minutes=1)
+CALENDAR_TABLES = ("appointments", "patients", "providers")
+
+CALENDAR_COLUMNS = (
+    Appointment.appointment_id,
+    Appointment.start_at,
+    Appointment.end_at,
+    Appointment.status,
+    Appointment.updated_at,
+    (Patient.first_name + " " + Patient.last_name).label("patient_name"),
+)
+
+
+def calendar_key(provider_id):
+    """Per-provider key for calendar clients, which cannot send the session header."""
+    digest = hmac.new(CALENDAR_FEED_SECRET.encode(), b"calendar:%d" % provider_id, hashlib.sha256)
+    return digest.hexdigest()[:32]
+
+
+def ical_escape(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def ical_line(line):
+    """Encode a content line, folded at 75 octets without splitting UTF-8 characters."""
+    data = line.encode("utf-8")
+    chunks, limit = [], 75
+    while len(data) > limit:
+        cut = limit
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+        limit = 74
+    chunks.append(data)
+    return b"\r\n ".join(chunks) + b"\r\n"
+
+
+def ical_utc(value):
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def render_vevent(row, tz):
+    """VEVENT block for a :data:`CALENDAR_COLUMNS` row stored in ``tz`` wall time."""
+    start = row.start_at.replace(tzinfo=tz).astimezone(timezone.utc)
+    end = row.end_at.replace(tzinfo=tz).astimezone(timezone.utc)
+    stamp = ical_utc(row.updated_at) if row.updated_at else ical_utc(start)
+    lines = (
+        "BEGIN:VEVENT",
+        f"UID:appointment-{row.appointment_id}@omas",
+        f"DTSTAMP:{stamp}",
+        f"LAST-MODIFIED:{stamp}",
+        f"DTSTART:{ical_utc(start)}",
+        f"DTEND:{ical_utc(end)}",
+        f"SUMMARY:{ical_escape('Cita: ' + (row.patient_name or ''))}",
+        f"STATUS:{ICAL_STATUS.get(row.status, 'CONFIRMED')}",
+        f"X-OMAS-STATUS:{row.status}",
+        "END:VEVENT",
+    )
+    return b"".join(ical_line(line) for line in lines)
+
+
+class VEventCache:
+    """LRU of rendered VEVENT blocks keyed by ``(provider_id, appointment_id)``.
+
+    A block is reused only while the row and timezone it was rendered from
+    are unchanged, so polls re-render just the appointments that changed.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, provider_id, row, tz):
+        key = (provider_id, row.appointment_id)
+        fingerprint = (tuple(row), str(tz))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        block = render_vevent(row, tz)
+        with self._lock:
+            self._entries[key] = (fingerprint, block)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.misses += 1
+        return block
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+VEVENT_CACHE = VEventCache(CALENDAR_CACHE_SIZE)
+
+
+def calendar_window(today):
+    """Naive provider-local ``(start, end)`` of the exported range around ``today``."""
+    start = datetime.combine(today - timedelta(days=CALENDAR_PAST_DAYS), time.min)
+    return start, datetime.combine(today + timedelta(days=CALENDAR_FUTURE_DAYS + 1), time.min)
+
+
+def calendar_query(provider_id, today, since=None):
+    """Appointments in the export window, optionally only those updated since ``since``.
+
+    A range on ``idx_provider_time``; ``updated_at`` is a residual filter.
+    """
+    window_start, window_end = calendar_window(today)
+    stmt = (
+        select(*CALENDAR_COLUMNS)
+        .join(Patient, Patient.patient_id == Appointment.patient_id)
+        .where(
+            Appointment.provider_id == provider_id,
+            Appointment.start_at >= window_start,
+            Appointment.start_at < window_end,
+        )
+        .order_by(Appointment.start_at)
+    )
+    if since is not None:
+        stmt = stmt.where(Appointment.updated_at >= since)
+    return stmt
+
+
+def stream_calendar(db, provider, tz, stmt, sync_token):
+    """Yield the VCALENDAR in pieces, reading rows with a server-side cursor."""
+    header = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//OMAS//Agenda//ES",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{ical_escape('OMAS - ' + provider.display_name)}",
+        f"X-WR-TIMEZONE:{resolve_timezone(provider.timezone)[1]}",
+        f"X-OMAS-SYNC-TOKEN:{sync_token}",
+    ]
+    stmt = stmt.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+    try:
+        yield b"".join(ical_line(line) for line in header)
+        for batch in db.execute(stmt).partitions():
+            yield b"".join(VEVENT_CACHE.render(provider.provider_id, row, tz) for row in batch)
+        yield ical_line("END:VCALENDAR")
+    finally:
+        db.close()
+
+
+# ========= Instrumentación =========
+# Cubetas en segundos; 3 s es la meta de p95 del SRS.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 3.0, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+SLOW_REQUEST_MAX_QUERIES = 50
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram (not thread-safe; callers hold a lock)."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}"
+        yield f"{name}_sum{_labels(labels)} {self.total:.6f}"
+        yield f"{name}_count{_labels(labels)} {self.count}"
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def quantile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class EndpointStats:
+    __slots__ = ("latency", "queries", "recent", "sql_seconds", "responses")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.recent = deque(maxlen=METRICS_WINDOW)
+        self.sql_seconds = 0.0
+        self.responses = {}
+
+
+class Metrics:
+    """In-process registry for request, SQL and pool metrics.
+
+    Per endpoint it keeps a latency histogram, a window of the last
+    ``window`` latencies for the p50/p95/p99 summary, the SQL statements per
+    request and the time spent in them. Rendered as Prometheus text by
+    :meth:`render`; counters are per process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.pool_wait = Histogram(LATENCY_BUCKETS)
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+
+    def observe_request(self, endpoint, method, status, seconds, queries, sql_seconds):
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.latency.observe(seconds)
+            stats.queries.observe(queries)
+            stats.recent.append(seconds)
+            stats.sql_seconds += sql_seconds
+            key = (method, status)
+            stats.responses[key] = stats.responses.get(key, 0) + 1
+
+    def observe_query(self, seconds):
+        with self._lock:
+            self.sql_queries += 1
+            self.sql_seconds += seconds
+
+    def observe_pool_wait(self, seconds):
+        with self._lock:
+            self.pool_wait.observe(seconds)
+
+    def render(self, gauges=()):
+        """Return the Prometheus text exposition; ``gauges`` are extra ``(name, help, value)``."""
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            out = [
+                "# HELP omas_http_requests_total Peticiones atendidas por endpoint, método y estado.",
+                "# TYPE omas_http_requests_total counter",
+            ]
+            for endpoint, stats in endpoints:
+                for (method, status), count in sorted(stats.responses.items()):
+                    out.append(
+                        f"omas_http_requests_total{_labels({'endpoint': endpoint, 'method': method, 'status': status})} {count}"
+                    )
+            out += [
+                "# HELP omas_http_request_duration_seconds Latencia de las peticiones.",
+                "# TYPE omas_http_request_duration_seconds histogram",
+            ]
+            for endpoint, stats in endpoints:
+                out.extend(stats.latency.lines("omas_http_request_duration_seconds", {"endpoint": endpoint}))
+            out += [
+                f"# HELP omas_http_request_latency_seconds Cuantiles de las últimas {METRICS_WINDOW} peticiones.",
+                "# TYPE omas_http_request_latency_seconds summary",
+            ]
+            for endpoint, stats in endpoints:
+                recent = sorted(stats.recent)
+                for q in SUMMARY_QUANTILES:
+                    out.append(
+                        f"omas_http_request_latency_seconds{_labels({'endpoint': endpoint, 'quantile': q})} {quantile(recent, q):.6f}"
+                    )
+                out.append(f"omas_http_request_latency_seconds_sum{_labels({'endpoint': endpoint})} {sum(recent):.6f}")
+                out.append(f"omas_http_request_latency_seconds_count{_labels({'endpoint': endpoint})} {len(recent)}")
+            out += [
+                "# HELP omas_http_request_sql_queries Sentencias SQL ejecutadas por petición.",
+                "# TYPE omas_http_request_sql_queries histogram",
+            ]
+            for endpoint, stats in endpoints:
+                out.extend(stats.queries.lines("omas_http_request_sql_queries", {"endpoint": endpoint}))
+            out += [
+                "# HELP omas_http_request_sql_seconds_total Tiempo en SQL de las peticiones.",
+                "# TYPE omas_http_request_sql_seconds_total counter",
+            ]
+            for endpoint, stats in endpoints:
+                out.append(f"omas_http_request_sql_seconds_total{_labels({'endpoint': endpoint})} {stats.sql_seconds:.6f}")
+            out += [
+                "# HELP omas_sql_queries_total Sentencias SQL del proceso (incluye hilos de fondo).",
+                "# TYPE omas_sql_queries_total counter",
+                f"omas_sql_queries_total {self.sql_queries}",
+                "# HELP omas_sql_seconds_total Tiempo total en SQL del proceso.",
+                "# TYPE omas_sql_seconds_total counter",
+                f"omas_sql_seconds_total {self.sql_seconds:.6f}",
+                "# HELP omas_db_pool_checkout_seconds Espera para obtener una conexión del pool.",
+                "# TYPE omas_db_pool_checkout_seconds histogram",
+            ]
+            out.extend(self.pool_wait.lines("omas_db_pool_checkout_seconds", {}))
+        for name, help_text, value in gauges:
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(monotonic_clock.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = monotonic_clock.perf_counter() - started
+    METRICS.observe_query(elapsed)
+    if has_request_context():
+        trace = g.get("request_trace")
+        if trace is not None:
+            trace["sql_seconds"] += elapsed
+            trace["queries"].append((statement, elapsed))
+
+
+def instrument_pool(pool):
+    """Time every checkout of ``pool`` (waiting for a free connection or opening one)."""
+    connect = pool.connect
+
+    def timed_connect():
+        started = monotonic_clock.perf_counter()
+        try:
+            return connect()
+        finally:
+            METRICS.observe_pool_wait(monotonic_clock.perf_counter() - started)
+
+    pool.connect = timed_connect
+
+
+def pool_gauges():
+    pool = engine.pool
+    gauges = []
+    for name, attr, help_text in (
+        ("omas_db_pool_checked_out", "checkedout", "Conexiones prestadas del pool."),
+        ("omas_db_pool_size", "size", "Tamaño configurado del pool."),
+        ("omas_db_pool_overflow", "overflow", "Conexiones abiertas por encima del tamaño del pool."),
+    ):
+        if hasattr(pool, attr):
+            gauges.append((name, help_text, getattr(pool, attr)()))
+    return gauges
+
+
+def log_slow_request(trace, endpoint, status, seconds):
+    queries = trace["queries"]
+    lines = [
+        f"  {elapsed * 1000:8.1f} ms  {' '.join(statement.split())[:300]}"
+        for statement, elapsed in queries[:SLOW_REQUEST_MAX_QUERIES]
+    ]
+    if len(queries) > SLOW_REQUEST_MAX_QUERIES:
+        lines.append(f"  ... {len(queries) - SLOW_REQUEST_MAX_QUERIES} sentencias más")
+    logger.warning(
+        "Petición lenta %s %s (%s) -> %s en %.0f ms; %d sentencias SQL, %.0f ms en SQL\n%s",
+        request.method, request.path, endpoint, status, seconds * 1000,
+        len(queries), trace["sql_seconds"] * 1000, "\n".join(lines),
+    )
+
+
+if METRICS_ENABLED:
+    for instrumented in [engine] + [replica.engine for replica in REPLICAS.replicas]:
+        event.listen(instrumented, "before_cursor_execute", _before_cursor_execute)
+        event.listen(instrumented, "after_cursor_execute", _after_cursor_execute)
+    instrument_pool(engine.pool)
+
+
+# ========= Flask + CRUD genérico =========
+APP_DIR = Path(__file__).resolve().parent
+FRONTEND_ENTRY = "frontend.html"
+
+app = Flask(__name__)
+
+# Esperan a propósito (long-poll y SSE): su duración ensuciaría los percentiles.
+UNTIMED_ENDPOINTS = {"change_events"}
+
+
+@app.before_request
+def start_request_trace():
+    if METRICS_ENABLED and request.endpoint not in UNTIMED_ENDPOINTS:
+        g.request_trace = {"started": monotonic_clock.perf_counter(), "queries": [], "sql_seconds": 0.0}
+
+
+@app.after_request
+def record_response_status(response):
+    if METRICS_ENABLED:
+        g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(exc):
+    trace = g.pop("request_trace", None)
+    if trace is None:
+        return
+    seconds = monotonic_clock.perf_counter() - trace["started"]
+    endpoint = request.endpoint or "unmatched"
+    status = g.get("response_status", 500)
+    METRICS.observe_request(endpoint, request.method, status, seconds, len(trace["queries"]), trace["sql_seconds"])
+    if seconds * 1000 >= SLOW_REQUEST_MS:
+        log_slow_request(trace, endpoint, status, seconds)
+
+
+RESOURCES = [
+    ("/patients",                Patient,               "patient_id"),
+    ("/providers",               Provider,              "provider_id"),
+    ("/provider-availability",   ProviderAvailability,  "availability_id"),
+    ("/provider-exceptions",     ProviderException,     "exception_id"),
+    ("/appointments",            Appointment,           "appointment_id"),
+    ("/payments",                Payment,               "payment_id"),
+    ("/notification-preferences",NotificationPreference,"pref_id"),
+    ("/notifications-outbox",    NotificationOutbox,    "notif_id"),
+    ("/audit-logs",              AuditLog,              "audit_id"),
+]
+
+def register_crud(path: str, model, pk_column: str):
+    table = model.__tablename__
+
+    # ----- handlers -----
+    @require_auth()
+    @read_only
+    def list_items():
+        etag = table_etag(table, request.query_string, request.headers.get("Accept", ""))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        stream = wants_stream(request.args)
+        try:
+            stmt, limit = build_list_query(model, pk_column, request.args, stream=stream)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if stream:
+            return with_validators(stream_list_response(stmt), etag)
+
+        db = read_session()
+        try:
+            rows = db.execute(stmt).all()
+        finally:
+            db.close()
+
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit]
+        serialize = SERIALIZERS.for_columns(stmt.selected_columns)
+        response = json_response([serialize(row) for row in rows])
+        if has_more:
+            cursor = getattr(rows[-1], pk_column)
+            response.headers["X-Next-Cursor"] = str(cursor)
+            response.headers["Link"] = f'<{next_page_link(cursor)}>; rel="next"'
+        return with_validators(response, etag)
+
+    @require_auth()
+    def create_item():
+        data = request.get_json(force=True, silent=False)
+        db = SessionLocal()
+        try:
+            payload = coerce_payload(model, data)
             if model is Appointment:
-                provider_id = payload.get("provider_id", obj.provider_id)
-                start_at = payload.get("start_at", obj.start_at)
-                end_at = payload.get("end_at", obj.end_at)
-                if not start_at or not end_at:
-                    db.rollback()
-                    return jsonify({"error": "La cita debe incluir hora de inicio y fin."}), 400
-                if start_at >= end_at:
-                    db.rollback()
-                    return jsonify({"error": "La hora de inicio debe ser anterior a la de fin."}), 400
-                if appointment_overlaps(db, provider_id, start_at, end_at, exclude_id=pk):
-                    db.rollback()
-                    return jsonify({"error": "El proveedor ya tiene una cita reservada en ese horario."}), 409
+                obj = book_appointment(db, payload)
+            else:
+                obj = model(**payload)
+                db.add(obj)
+                db.commit()
+                db.refresh(obj)
+            publish_change(model, None, row_snapshot(obj))
+            return jsonify(to_dict(obj)), 201
+        except BookingConflict as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 409
+        except LookupError as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 404
+        except IntegrityError as e:
+            db.rollback()
+            return jsonify({"error": str(e.orig)}), 400
+        except ValueError as e:
+            db.rollback()
+            return jsonify(error_body(e)), 400
+        finally:
+            db.close()
 
-            for k, v in payload.items():
-                if hasattr(obj, k):
-                    setattr(obj, k, v)
-            db.commit()
-            db.refresh(obj)
+    @require_auth()
+    def bulk_items():
+        upsert = request.args.get("upsert", "").strip().lower() in {"1", "true", "yes"}
+        if upsert and model not in UPSERT_KEYS:
+            return jsonify({"error": f"{table} no admite upsert"}), 400
+        try:
+            items = parse_bulk_body(request.get_data(), request.mimetype)
+            chunk_size = parse_int_param(request.args, "chunk_size", BULK_CHUNK_SIZE, (1, BULK_MAX_ITEMS))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        results = bulk_write(model, items, upsert=upsert, chunk_size=chunk_size)
+        summary = {"created": 0, "updated": 0, "error": 0}
+        for result in results:
+            summary[result["status"]] += 1
+        return jsonify({**summary, "results": results}), 207 if summary["error"] else 201
+
+    @require_auth()
+    @read_only
+    def get_item(pk):
+        etag = table_etag(table, pk)
+        if request.if_none_match:
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
+        db = read_session()
+        try:
+            obj = db.get(model, pk)
+            if not obj:
+                return jsonify({"error": f"{table} not found"}), 404
+            last_modified = getattr(obj, "updated_at", None)
+            cached = not_modified(etag, last_modified)
+            if cached is not None:
+                return cached
+            return with_validators(jsonify(to_dict(obj)), etag, last_modified)
+        finally:
+            db.close()
+
+    @require_auth()
+    def update_item(pk):
+        data = request.get_json(force=True, silent=False)
+        db = SessionLocal()
+        try:
+            obj = db.get(model, pk)
+            if not obj:
+                return jsonify({"error": f"{table} not found"}), 404
+            payload = coerce_payload(model, data, partial=True)
+            before = row_snapshot(obj)
+
+            if model is Appointment:
+                book_appointment(db, payload, appointment=obj)
+            else:
+                for k, v in payload.items():
+                    if hasattr(obj, k):
+                        setattr(obj, k, v)
+                db.commit()
+                db.refresh(obj)
+            publish_change(model, before, row_snapshot(obj))
             return jsonify(to_dict(obj))
+        except BookingConflict as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 409
+        except LookupError as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 404
         except IntegrityError as e:
             db.rollback()
             return jsonify({"error": str(e.orig)}), 400
         except ValueError as e:
             db.rollback()
-            return jsonify({"error": str(e)}), 400
+            return jsonify(error_body(e)), 400
         finally:
             db.close()
 
     @require_auth()
     def delete_item(pk):
         db = SessionLocal()
+        removed = []
         try:
             obj = db.get(model, pk)
             if not obj:
@@ -453,17 +4183,23 @@ def register_crud(path: str, model, pk_column: str):
                         400,
                     )
 
-                (
-                    db.query(Appointment)
-                    .filter(
+                # Se borran fila por fila para publicar cada baja (versión, auditoría y feed).
+                canceled = db.execute(
+                    select(Appointment).where(
                         Appointment.patient_id == pk,
                         Appointment.status == "canceled",
                     )
-                    .delete(synchronize_session=False)
-                )
+                ).scalars().all()
+                for appointment in canceled:
+                    removed.append(row_snapshot(appointment))
+                    db.delete(appointment)
 
+            before = row_snapshot(obj)
             db.delete(obj)
             db.commit()
+            for snapshot in removed:
+                publish_change(Appointment, snapshot, None)
+            publish_change(model, before, None)
             return "", 204
         finally:
             db.close()
@@ -471,12 +4207,16 @@ def register_crud(path: str, model, pk_column: str):
     # ----- rutas -----
     app.add_url_rule(path,               endpoint=f"{table}_list",   view_func=list_items,  methods=["GET"])
     app.add_url_rule(path,               endpoint=f"{table}_create", view_func=create_item, methods=["POST"])
+    app.add_url_rule(f"{path}/bulk",     endpoint=f"{table}_bulk",   view_func=bulk_items,  methods=["POST"])
     app.add_url_rule(f"{path}/<int:pk>", endpoint=f"{table}_get",    view_func=get_item,    methods=["GET"])
     app.add_url_rule(f"{path}/<int:pk>", endpoint=f"{table}_update", view_func=update_item, methods=["PUT"])
     app.add_url_rule(f"{path}/<int:pk>", endpoint=f"{table}_delete", view_func=delete_item, methods=["DELETE"])
 
 for path, model, pk in RESOURCES:
     register_crud(path, model, pk)
+    schema_for(model)
+    SERIALIZERS.for_model(model)
+    SERIALIZERS.for_columns(model.__table__.columns)
 
 
 @app.post("/auth/login")
@@ -501,15 +4241,13 @@ def auth_login():
     model = Patient if user_type == "patient" else Provider
     db = SessionLocal()
     try:
-        user = (
-            db.query(model)
-            .filter(func.lower(model.email) == email)
-            .first()
-        )
+        # Los correos se guardan normalizados: igualdad exacta sobre el índice único.
+        user = db.execute(select(model).where(model.email == email)).scalars().first()
         if not user:
             return jsonify({"error": "El correo no está registrado."}), 404
 
         session = create_session(user_type, user)
+        audit("login", model.__tablename__, session["user_id"], actor=session)
         return jsonify({"token": session["token"], "user": _session_payload(session)})
     finally:
         db.close()
@@ -517,11 +4255,80 @@ def auth_login():
 
 @app.get("/auth/session")
 @require_auth()
+@read_only
 def auth_session():
     session = g.get("current_session") or get_session_from_request()
     return jsonify({"user": _session_payload(session)})
 
 
+DASHBOARD_TABLES = ("patients", "providers", "provider_availability", "appointments")
+# Columnas compartidas entre peticiones: SERIALIZERS compila una sola vez por tupla.
+DASHBOARD_APPOINTMENT_COLUMNS = (
+    *Appointment.__table__.columns,
+    (Patient.first_name + " " + Patient.last_name).label("patient_name"),
+    Provider.display_name.label("provider_name"),
+)
+
+
+def dashboard_queries(session):
+    """The four statements behind ``GET /dashboard``, scoped to the session's role.
+
+    Patients see their own record, every provider and their own appointments;
+    providers see themselves, their weekly rules, their appointments and the
+    patients on them. Appointments come joined with both display names.
+    The lists are not capped: the frontend treats them as the full dataset.
+    """
+    user_id = session["user_id"]
+    patients = select(*Patient.__table__.columns).order_by(Patient.patient_id)
+    providers = select(*Provider.__table__.columns).order_by(Provider.display_name)
+    rules = (
+        select(*ProviderAvailability.__table__.columns)
+        .order_by(ProviderAvailability.provider_id, ProviderAvailability.weekday, ProviderAvailability.start_time)
+    )
+    appointments = (
+        select(*DASHBOARD_APPOINTMENT_COLUMNS)
+        .join(Patient, Patient.patient_id == Appointment.patient_id)
+        .join(Provider, Provider.provider_id == Appointment.provider_id)
+        .order_by(Appointment.start_at.desc())
+    )
+    if session["user_type"] == "patient":
+        patients = patients.where(Patient.patient_id == user_id)
+        appointments = appointments.where(Appointment.patient_id == user_id)
+    else:
+        patients = patients.where(
+            Patient.patient_id.in_(select(Appointment.patient_id).where(Appointment.provider_id == user_id))
+        )
+        providers = providers.where(Provider.provider_id == user_id)
+        rules = rules.where(ProviderAvailability.provider_id == user_id)
+        appointments = appointments.where(Appointment.provider_id == user_id)
+    return {"patients": patients, "providers": providers, "availability": rules, "appointments": appointments}
+
+
+@app.get("/dashboard")
+@require_auth()
+@read_only
+def dashboard():
+    """Everything the signed-in view needs in one response."""
+    session = g.current_session
+    etag = make_etag(
+        TABLE_VERSIONS.epoch, "dashboard", session["user_type"], session["user_id"],
+        *(TABLE_VERSIONS.get(table) for table in DASHBOARD_TABLES),
+    )
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    payload = {"user": _session_payload(session)}
+    db = read_session()
+    try:
+        for key, stmt in dashboard_queries(session).items():
+            serialize = SERIALIZERS.for_columns(stmt.selected_columns)
+            payload[key] = [serialize(row) for row in db.execute(stmt)]
+    finally:
+        db.close()
+    return with_validators(json_response(payload), etag)
+
+
 @app.post("/auth/logout")
 def auth_logout():
     token = request.headers.get("X-Session-Token")
@@ -530,15 +4337,42 @@ def auth_logout():
         token = payload.get("token") if isinstance(payload, dict) else None
     if not token:
         return jsonify({"error": "Debes indicar el token de sesión a cerrar."}), 400
-    if token in SESSIONS:
-        SESSIONS.pop(token, None)
+    session = SESSIONS.pop(token)
+    if session:
+        entity_type = Patient.__tablename__ if session["user_type"] == "patient" else Provider.__tablename__
+        audit("logout", entity_type, session["user_id"], actor=session)
     return jsonify({"ok": True})
 
 
 @app.get("/providers/<int:provider_id>/availability")
 @require_auth()
+@read_only
 def provider_availability(provider_id):
-    db = SessionLocal()
+    try:
+        search_days = parse_int_param(request.args, "search_days", SEARCH_DAYS_DEFAULT, SEARCH_DAYS_RANGE)
+        slot_minutes = parse_int_param(request.args, "slot_minutes", SLOT_MINUTES_DEFAULT, SLOT_MINUTES_RANGE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Los horarios libres dependen de la hora actual: el ETag cambia cada minuto
+    # además de con cada cambio del proveedor.
+    generations = AVAILABILITY_CACHE.generations
+    etag = make_etag(
+        generations.epoch, "availability", provider_id, generations.get(provider_id),
+        search_days, slot_minutes, int(monotonic_clock.time() // 60),
+    )
+    not_changed = not_modified(etag)
+    if not_changed is not None:
+        return not_changed
+
+    cache_key = (provider_id, search_days, slot_minutes)
+    cached, generation = AVAILABILITY_CACHE.lookup(cache_key)
+    if cached is not None:
+        response = jsonify(cached)
+        response.headers["X-Cache"] = "HIT"
+        return with_validators(response, etag)
+
+    db = read_session()
     try:
         provider = db.get(Provider, provider_id)
         if not provider:
@@ -551,133 +4385,260 @@ def provider_availability(provider_id):
             .all()
         )
 
-        exceptions = (
-            db.query(ProviderException)
-            .filter(ProviderException.provider_id == provider_id)
-            .order_by(ProviderException.start_at)
-            .all()
-        )
-
-        provider_timezone = "UTC"
-        tz = timezone.utc
-        if provider.timezone:
-            try:
-                tz = ZoneInfo(provider.timezone)
-                provider_timezone = provider.timezone
-            except ZoneInfoNotFoundError:
-                pass
+        tz, provider_timezone = resolve_timezone(provider.timezone)
         now_local = datetime.now(tz)
         now_naive = now_local.replace(tzinfo=None)
 
-        search_days = 14
-        slot_minutes = 30
-        slot_delta = timedelta(minutes=slot_minutes)
-
         start_search_date = now_local.date()
         end_search_date = start_search_date + timedelta(days=search_days)
 
         start_window = datetime.combine(start_search_date, time.min)
         end_window = datetime.combine(end_search_date, time.max)
 
-        busy_appointments = (
-            db.query(Appointment)
-            .filter(
+        busy = db.execute(
+            select(Appointment.start_at, Appointment.end_at).where(
                 Appointment.provider_id == provider_id,
                 Appointment.status.in_(["booked", "rescheduled"]),
                 Appointment.start_at < end_window,
                 Appointment.end_at > start_window,
             )
-            .all()
+        ).all()
+        # Solo las excepciones que pueden caer en la ventana; las recurrentes
+        # se expanden a sus ocurrencias dentro de ella.
+        occurrences = list(
+            iter_exceptions(
+                db.execute(exceptions_query(provider_id, start_window, end_window)).scalars(),
+                start_window,
+                end_window,
+            )
+        )
+        busy.extend(
+            (start_at, end_at)
+            for start_at, end_at, exception in occurrences
+            if exception.is_blocking is not False
         )
 
-        def to_weekday_candidates(value):
-            """Return the Python weekday index (0=Monday) for the stored value."""
-            try:
-                weekday_value = int(value)
-            except (TypeError, ValueError):
-                return []
+        upcoming_slots = [
+            slot_payload(slot_start, slot_end, slot_minutes)
+            for slot_start, slot_end in free_slots(
+                weekly_windows(weekly),
+                busy,
+                start_search_date,
+                search_days,
+                slot_minutes,
+                now=now_naive,
+            )
+        ]
+
+        payload = {
+            "provider": to_dict(provider),
+            "weekly": [to_dict(item) for item in weekly],
+            "exceptions": [
+                {**to_dict(exception), "start_at": serialize_value(start_at), "end_at": serialize_value(end_at)}
+                for start_at, end_at, exception in occurrences
+            ],
+            "upcoming_slots": upcoming_slots,
+            "timezone": provider_timezone,
+        }
+    finally:
+        db.close()
 
-            # UI almacena 1-7 (lunes-domingo). Normalizamos a 0-6 para
-            # compararlo con datetime.weekday(). Si ya está en 0-6 lo usamos tal cual.
-            if 1 <= weekday_value <= 7:
-                weekday_value = (weekday_value - 1) % 7
+    AVAILABILITY_CACHE.store(cache_key, payload, generation)
+    response = jsonify(payload)
+    response.headers["X-Cache"] = "MISS"
+    return with_validators(response, etag)
 
-            if 0 <= weekday_value <= 6:
-                return [weekday_value]
 
-            return []
+@app.put("/providers/<int:provider_id>/weekly-availability")
+@require_auth(["provider"])
+def replace_weekly_availability(provider_id):
+    """Reemplaza de una vez todas las reglas semanales del proveedor (U5)."""
+    if g.current_session["user_id"] != provider_id:
+        return jsonify({"error": "Solo puedes modificar tu propio horario."}), 403
+    data = request.get_json(force=True, silent=True)
+    if isinstance(data, list):
+        data = {"rules": data}
+    if not isinstance(data, dict) or not isinstance(data.get("rules"), list):
+        return jsonify({"error": "Se esperaba un objeto con la lista rules."}), 400
+    if len(data["rules"]) > WEEKLY_IMPORT_MAX_RULES:
+        return jsonify({"error": f"El horario excede el máximo de {WEEKLY_IMPORT_MAX_RULES} reglas."}), 400
+    base = data.get("weekday_base", 1)
+    if base not in (0, 1) or isinstance(base, bool):
+        return jsonify({"error": "weekday_base debe ser 0 (0=lunes) o 1 (1=lunes)."}), 400
+    try:
+        rules = sweep_weekly_rules(parse_weekly_rules(provider_id, data["rules"], base))
+    except PayloadError as e:
+        return jsonify(error_body(e)), 400
 
-        def overlaps(start_a, end_a, start_b, end_b):
-            return start_a < end_b and end_a > start_b
+    db = SessionLocal()
+    try:
+        with provider_booking_lock(provider_id):
+            summary, changes, rows = replace_weekly_rules(db, provider_id, rules)
+        body = {**summary, "provider_id": provider_id, "rules": [to_dict(row) for row in rows]}
+    except LookupError as e:
+        db.rollback()
+        return jsonify({"error": str(e)}), 404
+    except IntegrityError as e:
+        db.rollback()
+        return jsonify({"error": str(e.orig)}), 400
+    finally:
+        db.close()
+    for before, after in changes:
+        publish_change(ProviderAvailability, before, after)
+    return jsonify(body)
 
-        blocking_exceptions = [exc for exc in exceptions if exc.is_blocking is not False]
 
-        busy_ranges = []
-        for appointment in busy_appointments:
-            busy_ranges.append((appointment.start_at, appointment.end_at))
-        for exception in blocking_exceptions:
-            busy_ranges.append((exception.start_at, exception.end_at))
+@app.get("/providers/<int:provider_id>/agenda")
+@require_auth(["provider"])
+@read_only
+def provider_agenda_endpoint(provider_id):
+    """Agenda del día de un proveedor (F12), en su zona horaria."""
+    if g.current_session["user_id"] != provider_id:
+        return jsonify({"error": "Solo puedes consultar tu propia agenda."}), 403
+    db = read_session()
+    try:
+        provider = db.get(Provider, provider_id)
+        if not provider:
+            return jsonify({"error": "El proveedor solicitado no existe."}), 404
+        tz, _ = resolve_timezone(provider.timezone)
+        try:
+            day = parse_day_param(request.args, datetime.now(tz).date())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        etag = agenda_etag("agenda", provider_id, day)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        return with_validators(json_response(provider_agenda(db, provider, day)), etag)
+    finally:
+        db.close()
 
-        upcoming_slots = []
 
-        weekly_rules = list(weekly)
+@app.get("/admin/day")
+@require_auth(["provider"])
+@read_only
+def admin_day_board():
+    """Citas del día de todos los proveedores con conteos por estado (F9)."""
+    if g.current_session["user_id"] not in ADMIN_PROVIDER_IDS:
+        return jsonify({"error": "Solo los administradores pueden consultar el tablero del día."}), 403
+    try:
+        day = parse_day_param(request.args, None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    db = read_session()
+    try:
+        # Sin fecha, cada proveedor usa la de su zona: el ETag cambia cuando alguna cruza la medianoche.
+        days = {day: None} if day else local_days(db)
+        etag = agenda_etag("day", sorted(days.items(), key=lambda item: item[0]))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        return with_validators(json_response(day_board(db, days)), etag)
+    finally:
+        db.close()
 
-        for day_offset in range(search_days + 1):
-            current_date = start_search_date + timedelta(days=day_offset)
-            current_weekday = current_date.weekday()
 
-            matching_rules = [
-                rule
-                for rule in weekly_rules
-                if current_weekday in to_weekday_candidates(rule.weekday)
-            ]
+@app.get("/providers/<int:provider_id>/calendar-link")
+@require_auth(["provider"])
+def provider_calendar_link(provider_id):
+    """URL de suscripción al calendario del proveedor para apps de calendario."""
+    if g.current_session["user_id"] != provider_id:
+        return jsonify({"error": "Solo puedes suscribirte a tu propia agenda."}), 403
+    url = f"{request.host_url}providers/{provider_id}/calendar.ics?{urlencode({'key': calendar_key(provider_id)})}"
+    return jsonify({"url": url})
 
-            if not matching_rules:
-                continue
 
-            for rule in matching_rules:
-                if not isinstance(rule.start_time, time) or not isinstance(rule.end_time, time):
-                    continue
+@app.get("/providers/<int:provider_id>/calendar.ics")
+@read_only
+def provider_calendar(provider_id):
+    """Agenda del proveedor en iCalendar; con ``since`` solo las citas modificadas."""
+    key = request.args.get("key")
+    if key:
+        if not hmac.compare_digest(key, calendar_key(provider_id)):
+            return jsonify({"error": "La llave del calendario no es válida."}), 403
+    else:
+        session = get_session_from_request()
+        if not session:
+            return jsonify({"error": "Autenticación requerida. Inicia sesión para continuar."}), 401
+        if session["user_type"] != "provider" or session["user_id"] != provider_id:
+            return jsonify({"error": "Solo puedes consultar tu propia agenda."}), 403
+    try:
+        since = normalize_datetime(request.args.get("since"))
+    except ValueError:
+        return jsonify({"error": "El parámetro since debe ser una fecha y hora ISO 8601."}), 400
+
+    db = read_session()
+    body = None
+    try:
+        provider = db.get(Provider, provider_id)
+        if not provider:
+            return jsonify({"error": "El proveedor solicitado no existe."}), 404
+        tz, _ = resolve_timezone(provider.timezone)
+        today = datetime.now(tz).date()
+        etag = make_etag(
+            TABLE_VERSIONS.epoch, "calendar", provider_id, today, since,
+            *(TABLE_VERSIONS.get(table) for table in CALENDAR_TABLES),
+        )
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        sync_token = (datetime.utcnow() - CALENDAR_SYNC_OVERLAP).isoformat(timespec="seconds")
+        # El generador cierra la sesión al terminar de enviar.
+        body = stream_calendar(db, provider, tz, calendar_query(provider_id, today, since), sync_token)
+    finally:
+        if body is None:
+            db.close()
+    response = Response(body, mimetype="text/calendar")
+    response.headers["Content-Disposition"] = f'inline; filename="omas-{provider_id}.ics"'
+    response.headers["X-Sync-Token"] = sync_token
+    return with_validators(response, etag)
 
-                rule_start = datetime.combine(current_date, rule.start_time)
-                rule_end = datetime.combine(current_date, rule.end_time)
 
-                current_slot_start = rule_start
-                while current_slot_start + slot_delta <= rule_end:
-                    current_slot_end = current_slot_start + slot_delta
+@app.get("/slots/search")
+@require_auth()
+def search_slots():
+    try:
+        limit = parse_int_param(request.args, "limit", SLOT_SEARCH_DEFAULT_LIMIT, SLOT_SEARCH_LIMIT_RANGE)
+        slot_minutes = parse_int_param(request.args, "slot_minutes", SLOT_MINUTES_DEFAULT, SLOT_MINUTES_RANGE)
+        window_from = normalize_datetime(request.args.get("from"))
+        window_to = normalize_datetime(request.args.get("to"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if window_from and window_to:
+        if window_from >= window_to:
+            return jsonify({"error": "El parámetro from debe ser anterior a to."}), 400
+        if (window_to - window_from).days > SEARCH_DAYS_RANGE[1]:
+            return jsonify({"error": f"El rango de búsqueda no puede exceder {SEARCH_DAYS_RANGE[1]} días."}), 400
 
-                    if current_slot_end <= now_naive:
-                        current_slot_start += slot_delta
-                        continue
+    specialty = (request.args.get("specialty") or "").strip()
+    slots = AVAILABILITY_INDEX.search(specialty, window_from, window_to, slot_minutes, limit)
+    return jsonify({"specialty": specialty or None, "slots": slots})
 
-                    is_busy = any(
-                        overlaps(current_slot_start, current_slot_end, busy_start, busy_end)
-                        for busy_start, busy_end in busy_ranges
-                    )
-                    if not is_busy:
-                        upcoming_slots.append(
-                            {
-                                "start_at": serialize_value(current_slot_start),
-                                "end_at": serialize_value(current_slot_end),
-                                "date": serialize_value(current_date),
-                                "weekday": current_weekday,
-                                "slot_minutes": slot_minutes,
-                            }
-                        )
-
-                    current_slot_start += slot_delta
-
-        upcoming_slots.sort(key=lambda slot: slot["start_at"])
-
-        return jsonify(
-            {
-                "provider": to_dict(provider),
-                "weekly": [to_dict(item) for item in weekly],
-                "exceptions": [to_dict(item) for item in exceptions],
-                "upcoming_slots": upcoming_slots,
-                "timezone": provider_timezone,
-            }
-        )
+
+@app.post("/appointments/book")
+@require_auth()
+def book_appointment_endpoint():
+    """Reserva una cita verificando y guardando en una sola transacción."""
+    data = request.get_json(force=True, silent=False)
+    db = SessionLocal()
+    try:
+        payload = coerce_payload(Appointment, data)
+        appointment = book_appointment(db, payload)
+        publish_change(Appointment, None, row_snapshot(appointment))
+        return jsonify(to_dict(appointment)), 201
+    except BookingConflict as e:
+        db.rollback()
+        return jsonify({"error": str(e)}), 409
+    except LookupError as e:
+        db.rollback()
+        return jsonify({"error": str(e)}), 404
+    except IntegrityError as e:
+        db.rollback()
+        # uq_provider_slot: otra reserva ganó el mismo inicio en otro proceso.
+        return jsonify({"error": str(e.orig)}), 409
+    except ValueError as e:
+        db.rollback()
+        return jsonify(error_body(e)), 400
     finally:
         db.close()
 
@@ -694,24 +4655,241 @@ def cancel_appointment(pk):
         if appointment.status == "canceled":
             db.rollback()
             return jsonify(to_dict(appointment))
+        before = row_snapshot(appointment)
         appointment.status = "canceled"
+        enqueue_appointment_notifications(db, appointment, "canceled")
         db.commit()
         db.refresh(appointment)
+        publish_change(Appointment, before, row_snapshot(appointment))
         return jsonify(to_dict(appointment))
     finally:
         db.close()
 
 
+WAITLIST_INPUT_FIELDS = {"patient_id", "provider_id", "specialty", "window_start", "window_end"}
+
+
+def own_waitlist_entry(db, pk):
+    """Load a waitlist entry of the signed-in patient; returns ``(entry, error response)``."""
+    entry = db.get(WaitlistEntry, pk)
+    if not entry:
+        return None, (jsonify({"error": "La solicitud de lista de espera no existe."}), 404)
+    session = g.current_session
+    if session["user_type"] != "patient" or session["user_id"] != entry.patient_id:
+        return None, (jsonify({"error": "Solo el paciente puede gestionar su lista de espera."}), 403)
+    return entry, None
+
+
+@app.post("/waitlist")
+@require_auth()
+def create_waitlist_entry():
+    """Registra a un paciente en la lista de espera de un proveedor o especialidad."""
+    data = request.get_json(force=True, silent=False)
+    db = SessionLocal()
+    try:
+        if not isinstance(data, dict):
+            raise PayloadError({"_": "el cuerpo debe ser un objeto JSON"})
+        unknown = set(data) - WAITLIST_INPUT_FIELDS
+        if unknown:
+            raise PayloadError({name: "campo no permitido" for name in sorted(unknown)})
+        if g.current_session["user_type"] == "patient":
+            data = {**data, "patient_id": g.current_session["user_id"]}
+        payload = coerce_payload(WaitlistEntry, data)
+        errors = {}
+        if payload.get("provider_id") is None and not (payload.get("specialty") or "").strip():
+            errors["provider_id"] = "indica un proveedor o una especialidad"
+        if payload["window_start"] >= payload["window_end"]:
+            errors["window_end"] = "debe ser posterior a window_start"
+        if errors:
+            raise PayloadError(errors)
+        entry = WaitlistEntry(**payload)
+        db.add(entry)
+        db.commit()
+        db.refresh(entry)
+        publish_change(WaitlistEntry, None, row_snapshot(entry))
+        return jsonify(to_dict(entry)), 201
+    except IntegrityError as e:
+        db.rollback()
+        return jsonify({"error": str(e.orig)}), 400
+    except ValueError as e:
+        db.rollback()
+        return jsonify(error_body(e)), 400
+    finally:
+        db.close()
+
+
+@app.get("/waitlist")
+@require_auth()
+@read_only
+def list_waitlist():
+    """Solicitudes del paciente, o las que esperan o tienen apartado al proveedor."""
+    session = g.current_session
+    stmt = select(*WaitlistEntry.__table__.columns).order_by(WaitlistEntry.waitlist_id.desc()).limit(LIST_DEFAULT_LIMIT)
+    if session["user_type"] == "patient":
+        stmt = stmt.where(WaitlistEntry.patient_id == session["user_id"])
+    else:
+        stmt = stmt.where(
+            (WaitlistEntry.provider_id == session["user_id"])
+            | (WaitlistEntry.offered_provider_id == session["user_id"])
+        )
+    db = read_session()
+    try:
+        serialize = SERIALIZERS.for_columns(stmt.selected_columns)
+        return json_response([serialize(row) for row in db.execute(stmt)])
+    finally:
+        db.close()
+
+
+@app.post("/waitlist/<int:pk>/accept")
+@require_auth(["patient"])
+def accept_waitlist_offer(pk):
+    """Reserva el horario ofrecido mientras el apartado siga vigente."""
+    db = SessionLocal()
+    try:
+        entry, error = own_waitlist_entry(db, pk)
+        if error:
+            return error
+        if entry.status != "offered" or entry.offer_expires_at <= datetime.utcnow():
+            return jsonify({"error": "La oferta ya no está vigente."}), 409
+        payload = {
+            "patient_id": entry.patient_id,
+            "provider_id": entry.offered_provider_id,
+            "start_at": entry.offered_start_at,
+            "end_at": entry.offered_end_at,
+        }
+        appointment = book_appointment(db, payload)
+        publish_change(Appointment, None, row_snapshot(appointment))
+        return jsonify(to_dict(appointment)), 201
+    except BookingConflict as e:
+        db.rollback()
+        return jsonify({"error": str(e)}), 409
+    except LookupError as e:
+        db.rollback()
+        return jsonify({"error": str(e)}), 404
+    except IntegrityError as e:
+        db.rollback()
+        # uq_provider_slot: otra reserva ganó el mismo inicio en otro proceso.
+        return jsonify({"error": str(e.orig)}), 409
+    except ValueError as e:
+        db.rollback()
+        return jsonify(error_body(e)), 400
+    finally:
+        db.close()
+
+
+@app.delete("/waitlist/<int:pk>")
+@require_auth(["patient"])
+def cancel_waitlist_entry(pk):
+    """Sale de la lista de espera; un horario apartado pasa al siguiente paciente."""
+    db = SessionLocal()
+    try:
+        entry, error = own_waitlist_entry(db, pk)
+        if error:
+            return error
+        if entry.status not in ("waiting", "offered"):
+            return jsonify(to_dict(entry))
+        before = row_snapshot(entry)
+        entry.status = "canceled"
+        db.commit()
+        db.refresh(entry)
+        publish_change(WaitlistEntry, before, row_snapshot(entry))
+    finally:
+        db.close()
+    if before["status"] == "offered":
+        offer_released_range(
+            before["offered_provider_id"], ExceptionRule(before["offered_start_at"], before["offered_end_at"]), True
+        )
+    return jsonify(to_dict(entry))
+
+
+@app.get("/events")
+@require_auth()
+def change_events():
+    """Cambios de citas y disponibilidad por SSE, o por long-poll en JSON."""
+    id_bounds = (0, 2**63 - 1)
+    try:
+        since = parse_int_param(request.args, "since", None, id_bounds)
+        if since is None and request.headers.get("Last-Event-ID"):
+            since = parse_int_param(request.headers, "Last-Event-ID", None, id_bounds)
+        provider_id = parse_int_param(request.args, "provider_id", None, id_bounds)
+        patient_id = parse_int_param(request.args, "patient_id", None, id_bounds)
+        timeout = parse_int_param(
+            request.args, "timeout", int(EVENTS_LONG_POLL_SECONDS), (0, int(EVENTS_LONG_POLL_SECONDS))
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    tables = None
+    if request.args.get("tables"):
+        tables = {name.strip() for name in request.args["tables"].split(",") if name.strip()}
+        unknown = tables - CHANGE_FEED_TABLES
+        if unknown:
+            return jsonify({"error": f"Tablas sin feed de cambios: {', '.join(sorted(unknown))}"}), 400
+    session = g.current_session
+    own_filter = provider_id if session["user_type"] == "provider" else patient_id
+    if own_filter not in (None, session["user_id"]):
+        return jsonify({"error": "Solo puedes seguir tus propios cambios."}), 403
+    if since is None:
+        since = CHANGE_FEED.version
+    wanted = event_filter(session, tables, provider_id, patient_id)
+
+    sse = "text/event-stream" in request.headers.get("Accept", "") or request.args.get("stream") == "sse"
+    if (sse or timeout) and not EVENT_WAITERS.acquire(blocking=False):
+        # Sin hilos para otra espera: SSE se rechaza y el long-poll responde sin esperar.
+        if sse:
+            response = jsonify({"error": "Demasiadas conexiones de cambios abiertas; intenta más tarde."})
+            response.status_code = 503
+        else:
+            response = json_response(poll_events(since, wanted, 0))
+        response.headers["Retry-After"] = str(EVENTS_BUSY_RETRY_SECONDS)
+        return response
+    if sse:
+        response = Response(stream_events(since, wanted), mimetype="text/event-stream")
+        response.call_on_close(EVENT_WAITERS.release)
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+    if not timeout:
+        return json_response(poll_events(since, wanted, 0))
+    try:
+        return json_response(poll_events(since, wanted, timeout))
+    finally:
+        EVENT_WAITERS.release()
+
+
 @app.get("/")
 def serve_frontend():
     """Devuelve el frontend estático para que Waitress lo sirva junto al API."""
-    return send_from_directory(APP_DIR, FRONTEND_ENTRY)
+    return static_file(FRONTEND_ENTRY)
 
 
 @app.get("/frontend.js")
 def serve_frontend_bundle():
     """Expone el bundle JS principal que consume la API desde el mismo host."""
-    return send_from_directory(APP_DIR, "frontend.js")
+    return static_file("frontend.js")
+
+
+@app.get("/metrics")
+def metrics():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Métricas deshabilitadas."}), 404
+    gauges = [("omas_active_sessions", "Sesiones activas.", len(SESSIONS))]
+    gauges += pool_gauges()
+    if REPLICAS:
+        replicas = REPLICAS.stats()
+        gauges += [
+            ("omas_db_replicas", "Réplicas de lectura configuradas.", len(replicas)),
+            ("omas_db_replicas_healthy", "Réplicas de lectura en rotación.", sum(r["healthy"] for r in replicas)),
+        ]
+    gauges += [
+        (f"omas_availability_cache_{name}", f"Caché de disponibilidad: {name}.", value)
+        for name, value in AVAILABILITY_CACHE.stats().items()
+    ]
+    gauges += [
+        (f"omas_calendar_cache_{name}", f"Caché de eventos iCal: {name}.", value)
+        for name, value in VEVENT_CACHE.stats().items()
+    ]
+    return Response(METRICS.render(gauges), mimetype="text/plain; version=0.0.4")
 
 
 @app.get("/api")
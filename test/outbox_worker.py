@@ -0,0 +1,383 @@
+"""Despachador de la bandeja de salida de notificaciones (F15).
+
+Reclama en lotes las filas ``queued`` de ``notifications_outbox`` cuyo
+``send_after`` ya venció (índice ``idx_outbox_status_time``), las marca como
+``sending`` en la misma transacción para que varios workers nunca envíen dos
+veces la misma notificación, las despacha en paralelo a los adaptadores de
+cada canal y escribe ``sent``/``failed`` con ``last_error`` y reintentos con
+espera exponencial.
+
+    python test/outbox_worker.py --batch-size 100 --concurrency 8
+
+Usa el mismo ``DATABASE_URL`` que la API. Sin configuración adicional todos
+los canales usan el adaptador local ``StubAdapter``; define ``SMTP_HOST`` y
+``SMS_WEBHOOK_URL``/``PUSH_WEBHOOK_URL`` para enviar de verdad.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import smtplib
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import select, text, update
+
+from main import NotificationOutbox, SessionLocal
+
+logger = logging.getLogger("outbox_worker")
+
+Notification = namedtuple(
+    "Notification", "notif_id appointment_id channel template payload send_after created_at"
+)
+
+
+# ========= Adaptadores de canal =========
+class ChannelAdapter(ABC):
+    """Delivers one notification; raising an exception marks the attempt as failed."""
+
+    @abstractmethod
+    def send(self, notification):
+        """Deliver ``notification`` through the channel."""
+
+
+class StubAdapter(ChannelAdapter):
+    """Keeps delivered notifications in memory instead of sending them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = []
+
+    def send(self, notification):
+        with self._lock:
+            self.sent.append(notification)
+        logger.debug("stub %s -> %s", notification.channel, notification.notif_id)
+
+
+class SMTPEmailAdapter(ChannelAdapter):
+    def __init__(self, host, port, sender):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def send(self, notification):
+        payload = notification.payload or {}
+        recipient = payload.get("to") or payload.get("email")
+        if not recipient:
+            raise ValueError("La notificación no indica destinatario.")
+        message = EmailMessage()
+        message["Subject"] = payload.get("subject") or notification.template
+        message["From"] = self.sender
+        message["To"] = recipient
+        message.set_content(payload.get("body") or json.dumps(payload, ensure_ascii=False, default=str))
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+class WebhookAdapter(ChannelAdapter):
+    """POSTs the notification as JSON to an SMS or push gateway."""
+
+    def __init__(self, url):
+        self.url = url
+
+    def send(self, notification):
+        body = json.dumps(
+            {
+                "notif_id": notification.notif_id,
+                "channel": notification.channel,
+                "template": notification.template,
+                "payload": notification.payload,
+            },
+            default=str,
+        ).encode("utf-8")
+        request = urllib.request.Request(
+            self.url, data=body, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"El gateway respondió {response.status}")
+
+
+def adapters_from_env():
+    stub = StubAdapter()
+    adapters = {"email": stub, "sms": stub, "push": stub}
+    if os.getenv("SMTP_HOST"):
+        adapters["email"] = SMTPEmailAdapter(
+            os.getenv("SMTP_HOST"),
+            int(os.getenv("SMTP_PORT", "25")),
+            os.getenv("SMTP_SENDER", "no-reply@omas.local"),
+        )
+    if os.getenv("SMS_WEBHOOK_URL"):
+        adapters["sms"] = WebhookAdapter(os.getenv("SMS_WEBHOOK_URL"))
+    if os.getenv("PUSH_WEBHOOK_URL"):
+        adapters["push"] = WebhookAdapter(os.getenv("PUSH_WEBHOOK_URL"))
+    return adapters
+
+
+# ========= Métricas =========
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class DispatchMetrics:
+    """Counters plus a window of recent lag samples (send_after -> sent), in ms."""
+
+    def __init__(self, window=2000):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.claimed = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.lag_ms = deque(maxlen=window)
+        self.queue_ms = deque(maxlen=window)
+
+    def record_claimed(self, count):
+        with self._lock:
+            self.claimed += count
+
+    def record_sent(self, notification, sent_at):
+        with self._lock:
+            self.sent += 1
+            self.lag_ms.append(max((sent_at - notification.send_after).total_seconds() * 1000, 0))
+            if notification.created_at:
+                self.queue_ms.append((sent_at - notification.created_at).total_seconds() * 1000)
+
+    def record_failure(self, final):
+        with self._lock:
+            if final:
+                self.failed += 1
+            else:
+                self.retried += 1
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            lag = list(self.lag_ms)
+            return {
+                "claimed": self.claimed,
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "throughput_per_s": round(self.sent / elapsed, 2),
+                "lag_ms_p50": percentile(lag, 0.50),
+                "lag_ms_p95": percentile(lag, 0.95),
+                "lag_ms_max": max(lag) if lag else None,
+                "queue_to_sent_ms_p95": percentile(list(self.queue_ms), 0.95),
+            }
+
+
+# ========= Despachador =========
+class OutboxDispatcher:
+    def __init__(
+        self,
+        adapters,
+        batch_size=100,
+        concurrency=8,
+        max_attempts=5,
+        retry_base_seconds=30,
+        retry_max_seconds=3600,
+        lease_seconds=300,
+        session_factory=SessionLocal,
+    ):
+        self.adapters = adapters
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.lease = timedelta(seconds=lease_seconds)
+        self.session_factory = session_factory
+        self.metrics = DispatchMetrics()
+
+    def claim_batch(self):
+        """Atomically move up to ``batch_size`` due rows from ``queued`` to ``sending``."""
+        now = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            if db.get_bind().dialect.name == "sqlite":
+                # Sin SKIP LOCKED: tomamos el candado de escritura antes de leer.
+                db.execute(text("UPDATE notifications_outbox SET status = status WHERE 1 = 0"))
+            rows = db.execute(
+                select(
+                    NotificationOutbox.notif_id,
+                    NotificationOutbox.appointment_id,
+                    NotificationOutbox.channel,
+                    NotificationOutbox.template,
+                    NotificationOutbox.payload,
+                    NotificationOutbox.send_after,
+                    NotificationOutbox.created_at,
+                )
+                .where(NotificationOutbox.status == "queued", NotificationOutbox.send_after <= now)
+                .order_by(NotificationOutbox.send_after)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if rows:
+                db.execute(
+                    update(NotificationOutbox)
+                    .where(NotificationOutbox.notif_id.in_([row.notif_id for row in rows]))
+                    .values(status="sending", updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.metrics.record_claimed(len(rows))
+        return [Notification(*row) for row in rows]
+
+    def requeue_expired_leases(self):
+        """Return to ``queued`` the rows left in ``sending`` by a worker that died."""
+        cutoff = datetime.utcnow() - self.lease
+        db = self.session_factory()
+        try:
+            result = db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.status == "sending", NotificationOutbox.updated_at < cutoff)
+                .values(status="queued")
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            if result.rowcount:
+                logger.warning("Se reencolaron %s notificaciones abandonadas", result.rowcount)
+            return result.rowcount
+        finally:
+            db.close()
+
+    def _deliver(self, notification):
+        adapter = self.adapters.get(notification.channel)
+        try:
+            if adapter is None:
+                raise LookupError(f"No hay adaptador para el canal {notification.channel}")
+            adapter.send(notification)
+        except Exception as exc:  # el error queda en last_error
+            return notification, exc
+        return notification, None
+
+    def record_results(self, results):
+        now = datetime.utcnow()
+        sent_ids = [notification.notif_id for notification, error in results if error is None]
+        db = self.session_factory()
+        try:
+            if sent_ids:
+                db.execute(
+                    update(NotificationOutbox)
+                    .where(NotificationOutbox.notif_id.in_(sent_ids))
+                    .values(status="sent", last_error=None, updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+            for notification, error in results:
+                if error is None:
+                    self.metrics.record_sent(notification, now)
+                    continue
+                payload = dict(notification.payload or {})
+                delivery = dict(payload.get("_delivery") or {})
+                attempts = delivery.get("attempts", 0) + 1
+                payload["_delivery"] = {**delivery, "attempts": attempts}
+                final = attempts >= self.max_attempts
+                values = {
+                    "payload": payload,
+                    "last_error": f"{type(error).__name__}: {error}"[:2000],
+                    "status": "failed" if final else "queued",
+                    "updated_at": now,
+                }
+                if not final:
+                    delay = min(self.retry_base_seconds * 2 ** (attempts - 1), self.retry_max_seconds)
+                    values["send_after"] = now + timedelta(seconds=delay)
+                db.execute(
+                    update(NotificationOutbox)
+                    .where(NotificationOutbox.notif_id == notification.notif_id)
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+                self.metrics.record_failure(final)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def run_once(self, pool=None):
+        """Claim, dispatch and record one batch; returns the number of rows claimed."""
+        notifications = self.claim_batch()
+        if not notifications:
+            return 0
+        if pool is None:
+            results = [self._deliver(notification) for notification in notifications]
+        else:
+            results = list(pool.map(self._deliver, notifications))
+        self.record_results(results)
+        return len(notifications)
+
+    def run_forever(self, poll_interval=1.0, report_every=30.0, stop=None):
+        stop = stop or threading.Event()
+        next_report = time.monotonic() + report_every
+        next_lease_check = 0.0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while not stop.is_set():
+                now = time.monotonic()
+                if now >= next_lease_check:
+                    self.requeue_expired_leases()
+                    next_lease_check = now + self.lease.total_seconds() / 2
+                try:
+                    claimed = self.run_once(pool)
+                except Exception:
+                    logger.exception("Error procesando la bandeja de salida")
+                    claimed = 0
+                if time.monotonic() >= next_report:
+                    logger.info("outbox %s", json.dumps(self.metrics.snapshot()))
+                    next_report = time.monotonic() + report_every
+                if claimed < self.batch_size:
+                    stop.wait(poll_interval)
+        logger.info("outbox %s", json.dumps(self.metrics.snapshot()))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Despachador de notificaciones de OMAS")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("OUTBOX_BATCH_SIZE", "100")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("OUTBOX_CONCURRENCY", "8")))
+    parser.add_argument("--max-attempts", type=int, default=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5")))
+    parser.add_argument("--retry-base-seconds", type=int, default=int(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "30")))
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--report-every", type=float, default=30.0)
+    parser.add_argument("--once", action="store_true", help="procesa un solo lote y termina")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args()
+    dispatcher = OutboxDispatcher(
+        adapters_from_env(),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        max_attempts=args.max_attempts,
+        retry_base_seconds=args.retry_base_seconds,
+    )
+    if args.once:
+        dispatcher.run_once()
+        print(json.dumps(dispatcher.metrics.snapshot()))
+        return
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    dispatcher.run_forever(args.poll_interval, args.report_every, stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Prueba de estrés de reservas concurrentes contra un servidor en ejecución.
+
+Lanza muchas reservas simultáneas (con horarios que se traslapan a propósito)
+sobre pocos proveedores y después verifica que ninguna cita activa se
+traslape y que cada respuesta 201 corresponda a una cita guardada.
+
+    python test/stress_booking.py --base-url http://127.0.0.1:5000 \
+        --email juan.perez@example.com --providers 1 --requests 500 --workers 50
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--email", default="juan.perez@example.com", help="correo de un paciente registrado")
+    parser.add_argument("--pin", default=os.getenv("DEMO_LOGIN_PIN", "4321"))
+    parser.add_argument("--providers", default="1", help="ids de proveedor separados por coma")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--days-ahead", type=int, default=60, help="día en que se concentran las reservas")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    login = requests.post(
+        f"{args.base_url}/auth/login",
+        json={"user_type": "patient", "email": args.email, "pin": args.pin},
+    )
+    login.raise_for_status()
+    token = login.json()["token"]
+    patient_id = login.json()["user"]["user_id"]
+    headers = {"X-Session-Token": token}
+    provider_ids = [int(p) for p in args.providers.split(",") if p.strip()]
+
+    day = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=args.days_ahead)
+
+    def book(i):
+        # Inicios cada 10 minutos con citas de 30: cada reserva choca con sus vecinas.
+        start_at = day + timedelta(minutes=10 * (i % 48))
+        payload = {
+            "patient_id": patient_id,
+            "provider_id": provider_ids[i % len(provider_ids)],
+            "start_at": start_at.isoformat(sep=" "),
+            "end_at": (start_at + timedelta(minutes=30)).isoformat(sep=" "),
+        }
+        response = requests.post(f"{args.base_url}/appointments/book", json=payload, headers=headers)
+        body = response.json() if response.status_code == 201 else None
+        return response.status_code, body
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(book, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    codes = Counter(code for code, _ in results)
+    created = {body["appointment_id"] for code, body in results if code == 201}
+    print(f"{args.requests} reservas en {elapsed:.2f}s ({args.requests / elapsed * 60:.0f}/min): {dict(codes)}")
+
+    window_start = day.isoformat(sep=" ")
+    window_end = (day + timedelta(days=1)).isoformat(sep=" ")
+    failures = 0
+    for provider_id in provider_ids:
+        response = requests.get(
+            f"{args.base_url}/appointments",
+            params={
+                "provider_id": provider_id,
+                "status__in": "booked,rescheduled",
+                "start_at__gte": window_start,
+                "start_at__lt": window_end,
+                "stream": "1",
+            },
+            headers=headers,
+        )
+        response.raise_for_status()
+        rows = sorted(response.json(), key=lambda row: row["start_at"])
+        overlaps = [
+            (a["appointment_id"], b["appointment_id"])
+            for a, b in zip(rows, rows[1:])
+            if b["start_at"] < a["end_at"]
+        ]
+        stored = {row["appointment_id"] for row in rows}
+        print(f"proveedor {provider_id}: {len(rows)} citas activas, {len(overlaps)} traslapes")
+        failures += len(overlaps)
+        created -= stored
+
+    if created:
+        print(f"{len(created)} reservas confirmadas no aparecen en la base: {sorted(created)[:10]}")
+    if failures or created:
+        sys.exit(1)
+    print("OK: sin traslapes ni reservas perdidas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Simula réplicas de lectura locales copiando una base SQLite a otros archivos.
+
+Usa la API de respaldo de sqlite3 (copia consistente aunque la app esté
+escribiendo) cada ``--interval`` segundos, lo que reproduce el retraso de una
+réplica asíncrona. Con ``--once`` copia una sola vez:
+
+    python sync_sqlite_replicas.py omas.db replica1.db replica2.db --interval 2
+    DATABASE_URL=sqlite:///omas.db \
+    DATABASE_REPLICA_URLS=sqlite:///replica1.db,sqlite:///replica2.db python main.py
+"""
+import argparse
+import sqlite3
+import time
+
+
+def copy_database(source_path, target_path):
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("primary")
+    parser.add_argument("replicas", nargs="+")
+    parser.add_argument("--interval", type=float, default=2.0, help="segundos entre copias (retraso simulado)")
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    while True:
+        started = time.perf_counter()
+        for replica in args.replicas:
+            copy_database(args.primary, replica)
+        print(f"{len(args.replicas)} réplicas sincronizadas en {(time.perf_counter() - started) * 1000:.0f} ms", flush=True)
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Shared fixtures: the app runs against a throwaway SQLite database.
+
+``main`` reads its configuration at import time, so the environment is set
+before it is imported. Run from the repository root with ``pytest test/tests``.
+"""
+import os
+import sys
+import tempfile
+from datetime import time
+
+import pytest
+
+TMP_DIR = tempfile.mkdtemp(prefix="omas-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(TMP_DIR, 'omas.db')}")
+os.environ.setdefault("AUDIT_MODE", "off")
+os.environ.setdefault("WAITLIST_SWEEP_SECONDS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """Fresh schema and in-process indexes; yields an open session."""
+    main.Base.metadata.drop_all(main.engine)
+    main.Base.metadata.create_all(main.engine)
+    for index in (main.AVAILABILITY_INDEX, main.NOTIFICATION_PREFERENCES, main.WAITLIST_INDEX):
+        index.invalidate()
+    session = main.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def patient(db):
+    row = main.Patient(first_name="Juan", last_name="Pérez", email="juan@example.com", phone="+525511112222")
+    db.add(row)
+    db.commit()
+    return row
+
+
+@pytest.fixture
+def provider(db):
+    """Provider in Mexico City available 09:00-13:00 every day."""
+    row = main.Provider(
+        display_name="Dra. López",
+        specialty="Cardiología",
+        email="lopez@clinic.mx",
+        phone="+525533334444",
+        timezone="America/Mexico_City",
+    )
+    db.add(row)
+    db.commit()
+    for weekday in range(1, 8):
+        db.add(main.ProviderAvailability(
+            provider_id=row.provider_id, weekday=weekday, start_time=time(9), end_time=time(13)
+        ))
+    db.commit()
+    main.AVAILABILITY_CACHE.invalidate_provider(row.provider_id)
+    return row
@@ -0,0 +1,204 @@
+"""The interval sweep slot engine returns exactly the slots of the original per-slot scan."""
+import random
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import main
+
+Rule = namedtuple("Rule", "weekday start_time end_time")
+
+
+# ========= Algoritmo de referencia =========
+def legacy_weekday_candidates(value):
+    """Return the Python weekday index (0=Monday) for the stored value."""
+    try:
+        weekday_value = int(value)
+    except (TypeError, ValueError):
+        return []
+    if 1 <= weekday_value <= 7:
+        weekday_value = (weekday_value - 1) % 7
+    if 0 <= weekday_value <= 6:
+        return [weekday_value]
+    return []
+
+
+def legacy_slots(weekly_rules, busy_ranges, start_search_date, search_days, slot_minutes, now_naive):
+    """The slot loop ``provider_availability`` ran before the sweep engine.
+
+    Every candidate slot of every rule is checked against every busy range.
+    Overlapping rules used to emit the same slot twice; the engine emits it
+    once, so the result is deduplicated.
+    """
+    slot_delta = timedelta(minutes=slot_minutes)
+
+    def overlaps(start_a, end_a, start_b, end_b):
+        return start_a < end_b and end_a > start_b
+
+    upcoming_slots = []
+    for day_offset in range(search_days + 1):
+        current_date = start_search_date + timedelta(days=day_offset)
+        current_weekday = current_date.weekday()
+        matching_rules = [
+            rule for rule in weekly_rules if current_weekday in legacy_weekday_candidates(rule.weekday)
+        ]
+        for rule in matching_rules:
+            if not isinstance(rule.start_time, time) or not isinstance(rule.end_time, time):
+                continue
+            rule_start = datetime.combine(current_date, rule.start_time)
+            rule_end = datetime.combine(current_date, rule.end_time)
+            current_slot_start = rule_start
+            while current_slot_start + slot_delta <= rule_end:
+                current_slot_end = current_slot_start + slot_delta
+                if current_slot_end <= now_naive:
+                    current_slot_start += slot_delta
+                    continue
+                is_busy = any(
+                    overlaps(current_slot_start, current_slot_end, busy_start, busy_end)
+                    for busy_start, busy_end in busy_ranges
+                )
+                if not is_busy:
+                    upcoming_slots.append((current_slot_start, current_slot_end))
+                current_slot_start += slot_delta
+    return sorted(set(upcoming_slots))
+
+
+def legacy_weekly_occurrences(start_at, end_at, interval, window_end, count=None):
+    """Occurrences of a weekly exception, stepping from the first one."""
+    step = timedelta(weeks=interval)
+    occurrences = []
+    while start_at < window_end and (count is None or len(occurrences) < count):
+        occurrences.append((start_at, end_at))
+        start_at, end_at = start_at + step, end_at + step
+    return occurrences
+
+
+def assert_same_slots(rules, busy, start_date, search_days, slot_minutes, now):
+    expected = legacy_slots(rules, busy, start_date, search_days, slot_minutes, now)
+    actual = main.free_slots(main.weekly_windows(rules), busy, start_date, search_days, slot_minutes, now=now)
+    assert actual == expected
+
+
+def at(day, hour, minute=0):
+    return datetime.combine(day, time(hour, minute))
+
+
+# ========= Casos =========
+@pytest.mark.parametrize(
+    "zone, transition",
+    [
+        ("America/New_York", date(2026, 3, 8)),   # se adelanta: 02:00-03:00 no existe
+        ("America/New_York", date(2026, 11, 1)),  # se atrasa: 01:00-02:00 ocurre dos veces
+        ("Europe/Madrid", date(2026, 3, 29)),
+        ("Europe/Madrid", date(2026, 10, 25)),
+    ],
+)
+def test_dst_transition_days(zone, transition):
+    rules = [Rule(weekday, time(0), time(6)) for weekday in range(1, 8)]
+    rules += [Rule(weekday, time(22), time(23, 59)) for weekday in range(1, 8)]
+    busy = [
+        (at(transition, 1, 30), at(transition, 2, 30)),
+        (at(transition, 3), at(transition, 3, 20)),
+        (at(transition - timedelta(days=1), 23), at(transition, 0, 45)),
+    ]
+    # Hora local del proveedor justo después del cambio, como la calcula provider_availability.
+    for utc_hour in (0, 2, 7):
+        moment = datetime.combine(transition, time(utc_hour), tzinfo=timezone.utc)
+        now = moment.astimezone(ZoneInfo(zone)).replace(tzinfo=None)
+        for slot_minutes in (15, 30, 45):
+            assert_same_slots(rules, busy, now.date(), 3, slot_minutes, now)
+
+
+def test_exceptions_overlapping_rule_edges():
+    day = date(2026, 6, 1)
+    rules = [Rule(1, time(9), time(13)), Rule(1, time(15), time(18)), Rule(1, time(12), time(16))]
+    busy = [
+        (at(day, 8), at(day, 9, 10)),          # empieza antes de la regla
+        (at(day, 12, 50), at(day, 15, 5)),      # cruza el final de una regla y el inicio de otra
+        (at(day, 17, 59), at(day, 19)),         # termina después de la regla
+        (at(day, 8), at(day, 9)),               # toca el inicio sin traslapar
+        (at(day, 18), at(day, 18, 30)),         # toca el final sin traslapar
+    ]
+    start = at(day, 9, 45)
+    busy += legacy_weekly_occurrences(start, start + timedelta(minutes=20), 1, at(day, 0) + timedelta(days=29))
+    now = at(day, 0)
+    for slot_minutes in (10, 30, 60):
+        assert_same_slots(rules, busy, day, 28, slot_minutes, now)
+
+
+def test_back_to_back_appointments():
+    day = date(2026, 6, 2)
+    rules = [Rule(2, time(9), time(13))]
+    busy = [
+        (at(day, 9), at(day, 9, 30)),
+        (at(day, 9, 30), at(day, 10)),
+        (at(day, 10), at(day, 10, 30)),
+        (at(day, 10, 45), at(day, 11, 15)),     # fuera de la rejilla
+        (at(day, 11, 15), at(day, 11, 45)),
+    ]
+    now = at(day, 9, 40)
+    for slot_minutes in (15, 30):
+        assert_same_slots(rules, busy, day, 7, slot_minutes, now)
+
+
+def test_randomized_calendars():
+    rng = random.Random(20261017)
+    for _ in range(200):
+        first_day = date(2026, 1, 1) + timedelta(days=rng.randrange(365))
+        rules = []
+        for _ in range(rng.randint(1, 6)):
+            start_minute = rng.randrange(0, 20 * 60, 5)
+            end_minute = min(start_minute + rng.randrange(15, 8 * 60, 5), 23 * 60 + 59)
+            rules.append(Rule(rng.randint(0, 8), time(*divmod(start_minute, 60)), time(*divmod(end_minute, 60))))
+        busy = []
+        for _ in range(rng.randint(0, 40)):
+            start = at(first_day, 0) + timedelta(minutes=rng.randrange(0, 15 * 24 * 60, 5))
+            busy.append((start, start + timedelta(minutes=rng.randrange(5, 6 * 60, 5))))
+        now = at(first_day, 0) + timedelta(minutes=rng.randrange(0, 24 * 60))
+        assert_same_slots(rules, busy, first_day, 14, rng.choice((10, 15, 20, 30, 45, 60)), now)
+
+
+def test_endpoint_matches_reference(db, patient, provider):
+    tz = ZoneInfo(provider.timezone)
+    today = datetime.now(tz).date()
+    tomorrow = today + timedelta(days=1)
+    for hour, minute in ((9, 0), (9, 30), (10, 0), (11, 10)):
+        start = at(tomorrow, hour, minute)
+        db.add(main.Appointment(
+            patient_id=patient.patient_id, provider_id=provider.provider_id,
+            start_at=start, end_at=start + timedelta(minutes=30),
+        ))
+    db.add_all([
+        main.ProviderException(
+            provider_id=provider.provider_id, start_at=at(tomorrow, 12, 40), end_at=at(tomorrow, 14), reason="Comida",
+        ),
+        main.ProviderException(
+            provider_id=provider.provider_id, start_at=at(today, 8), end_at=at(today, 9, 15),
+            reason="Junta semanal", recurrence="weekly", recurrence_count=3,
+        ),
+        main.ProviderException(
+            provider_id=provider.provider_id, start_at=at(tomorrow, 9), end_at=at(tomorrow, 13),
+            reason="Aviso", is_blocking=False,
+        ),
+    ])
+    db.commit()
+    client = main.app.test_client()
+    login = client.post("/auth/login", json={"user_type": "patient", "email": patient.email, "pin": main.DEMO_LOGIN_PIN})
+    client.environ_base["HTTP_X_SESSION_TOKEN"] = login.get_json()["token"]
+
+    response = client.get(f"/providers/{provider.provider_id}/availability")
+    now = datetime.now(tz).replace(tzinfo=None)
+
+    assert response.status_code == 200
+    actual = [
+        (datetime.fromisoformat(slot["start_at"]), datetime.fromisoformat(slot["end_at"]))
+        for slot in response.get_json()["upcoming_slots"]
+    ]
+    window_end = datetime.combine(today + timedelta(days=main.SEARCH_DAYS_DEFAULT), time.max)
+    busy = [(row.start_at, row.end_at) for row in db.query(main.Appointment)]
+    busy.append((at(tomorrow, 12, 40), at(tomorrow, 14)))
+    busy += legacy_weekly_occurrences(at(today, 8), at(today, 9, 15), 1, window_end, count=3)
+    rules = db.query(main.ProviderAvailability).filter_by(provider_id=provider.provider_id).all()
+    assert actual == legacy_slots(rules, busy, today, main.SEARCH_DAYS_DEFAULT, main.SLOT_MINUTES_DEFAULT, now)
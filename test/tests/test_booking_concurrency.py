@@ -0,0 +1,136 @@
+"""Concurrent bookings of one slot yield a single appointment; bulk writes respect waitlist holds."""
+import threading
+from datetime import date, datetime, time, timedelta
+
+import main
+
+THREADS = 8
+
+
+def book_concurrently(requests):
+    """Run every ``request()`` at once and return the results in order."""
+    barrier = threading.Barrier(len(requests))
+    results = [None] * len(requests)
+
+    def run(position, request):
+        barrier.wait()
+        results[position] = request()
+
+    threads = [threading.Thread(target=run, args=item) for item in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    return results
+
+
+def test_concurrent_book_appointment_calls(db, patient, provider):
+    patient_id, provider_id = patient.patient_id, provider.provider_id
+    start_at = datetime.combine(date.today() + timedelta(days=1), time(10))
+
+    def attempt(offset):
+        def request():
+            session = main.SessionLocal()
+            try:
+                main.book_appointment(session, {
+                    "patient_id": patient_id,
+                    "provider_id": provider_id,
+                    "start_at": start_at + offset,
+                    "end_at": start_at + offset + timedelta(minutes=30),
+                })
+                return "booked"
+            except main.BookingConflict:
+                session.rollback()
+                return "conflict"
+            finally:
+                session.close()
+        return request
+
+    # La mitad pide el mismo inicio y la otra mitad uno que se traslapa.
+    results = book_concurrently([attempt(timedelta(minutes=15 * (n % 2))) for n in range(THREADS)])
+
+    assert sorted(results) == ["booked"] + ["conflict"] * (THREADS - 1)
+    assert db.query(main.Appointment).count() == 1
+
+
+def test_concurrent_booking_requests_get_409(db, patient, provider):
+    start_at = datetime.combine(date.today() + timedelta(days=1), time(11))
+    body = {
+        "patient_id": patient.patient_id,
+        "provider_id": provider.provider_id,
+        "start_at": start_at.isoformat(),
+        "end_at": (start_at + timedelta(minutes=30)).isoformat(),
+    }
+    clients = []
+    for _ in range(THREADS):
+        client = main.app.test_client()
+        login = client.post(
+            "/auth/login", json={"user_type": "patient", "email": patient.email, "pin": main.DEMO_LOGIN_PIN}
+        )
+        client.environ_base["HTTP_X_SESSION_TOKEN"] = login.get_json()["token"]
+        clients.append(client)
+
+    statuses = book_concurrently(
+        [lambda client=client: client.post("/appointments/book", json=body).status_code for client in clients]
+    )
+
+    assert sorted(statuses) == [201] + [409] * (THREADS - 1)
+
+
+def hold_slot(db, patient, provider, start_at):
+    entry = main.WaitlistEntry(
+        patient_id=patient.patient_id,
+        provider_id=provider.provider_id,
+        window_start=start_at - timedelta(days=1),
+        window_end=start_at + timedelta(days=1),
+        status="offered",
+        offered_provider_id=provider.provider_id,
+        offered_start_at=start_at,
+        offered_end_at=start_at + timedelta(minutes=30),
+        offer_expires_at=datetime.utcnow() + timedelta(minutes=15),
+    )
+    db.add(entry)
+    db.commit()
+    return entry
+
+
+def test_bulk_appointments_respect_waitlist_holds(db, patient, provider):
+    other = main.Patient(first_name="Ana", last_name="Díaz", email="ana@example.com")
+    db.add(other)
+    db.commit()
+    start_at = datetime.combine(date.today() + timedelta(days=2), time(9))
+    entry = hold_slot(db, patient, provider, start_at)
+
+    def item(owner, offset):
+        return {
+            "patient_id": owner.patient_id,
+            "provider_id": provider.provider_id,
+            "start_at": (start_at + offset).isoformat(),
+            "end_at": (start_at + offset + timedelta(minutes=30)).isoformat(),
+        }
+
+    rejected = main.bulk_write(main.Appointment, [item(other, timedelta()), item(other, timedelta(minutes=15))])
+    assert [result["code"] for result in rejected] == [409, 409]
+
+    [accepted] = main.bulk_write(main.Appointment, [item(patient, timedelta())])
+    assert accepted["status"] == "created"
+    db.expire_all()
+    assert db.get(main.WaitlistEntry, entry.waitlist_id).status == "booked"
+
+
+def test_accepting_an_offer_lost_to_another_process_gets_409(db, patient, provider, monkeypatch):
+    start_at = datetime.combine(date.today() + timedelta(days=2), time(10))
+    entry = hold_slot(db, patient, provider, start_at)
+
+    def lost_race(session, payload):
+        # El chequeo pasó, pero otro proceso insertó el mismo inicio antes del commit.
+        raise main.IntegrityError("INSERT INTO appointments", {}, Exception("uq_provider_slot"))
+
+    monkeypatch.setattr(main, "book_appointment", lost_race)
+    client = main.app.test_client()
+    login = client.post("/auth/login", json={"user_type": "patient", "email": patient.email, "pin": main.DEMO_LOGIN_PIN})
+    client.environ_base["HTTP_X_SESSION_TOKEN"] = login.get_json()["token"]
+
+    response = client.post(f"/waitlist/{entry.waitlist_id}/accept")
+
+    assert response.status_code == 409
@@ -0,0 +1,19 @@
+"""GET /dashboard returns complete lists, since the frontend never pages through them."""
+import main
+
+
+def test_dashboard_lists_are_not_capped(db, patient, monkeypatch):
+    monkeypatch.setattr(main, "LIST_DEFAULT_LIMIT", 2)
+    db.add_all([
+        main.Provider(display_name=f"Dr. {n}", specialty="Pediatría", email=f"dr{n}@clinic.mx")
+        for n in range(5)
+    ])
+    db.commit()
+    client = main.app.test_client()
+    login = client.post("/auth/login", json={"user_type": "patient", "email": patient.email, "pin": main.DEMO_LOGIN_PIN})
+    client.environ_base["HTTP_X_SESSION_TOKEN"] = login.get_json()["token"]
+
+    response = client.get("/dashboard")
+
+    assert response.status_code == 200
+    assert len(response.get_json()["providers"]) == 5
@@ -0,0 +1,68 @@
+"""/admin/day is limited to the configured admins and defaults to each provider's today."""
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import main
+
+
+def login(provider):
+    client = main.app.test_client()
+    response = client.post(
+        "/auth/login", json={"user_type": "provider", "email": provider.email, "pin": main.DEMO_LOGIN_PIN}
+    )
+    client.environ_base["HTTP_X_SESSION_TOKEN"] = response.get_json()["token"]
+    return client
+
+
+@pytest.fixture
+def far_apart(db, patient):
+    """Two providers 25 hours apart, so their local dates always differ, each with a visit today."""
+    providers = []
+    for name, zone in (("Dr. Este", "Pacific/Kiritimati"), ("Dra. Oeste", "Pacific/Pago_Pago")):
+        provider = main.Provider(display_name=name, specialty="Pediatría", email=f"{zone.split('/')[1].lower()}@clinic.mx", timezone=zone)
+        db.add(provider)
+        db.commit()
+        today = datetime.now(ZoneInfo(zone)).date()
+        for day in (today - timedelta(days=1), today, today + timedelta(days=1)):
+            start = datetime.combine(day, time(10))
+            db.add(main.Appointment(
+                patient_id=patient.patient_id, provider_id=provider.provider_id,
+                start_at=start, end_at=start + timedelta(minutes=30),
+            ))
+        db.commit()
+        providers.append(provider)
+    return providers
+
+
+def test_only_admins_see_the_board(far_apart, monkeypatch):
+    admin, other = far_apart
+    monkeypatch.setattr(main, "ADMIN_PROVIDER_IDS", {admin.provider_id})
+
+    assert login(other).get("/admin/day").status_code == 403
+    assert login(admin).get("/admin/day").status_code == 200
+
+
+def test_default_day_is_each_providers_today(far_apart, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_PROVIDER_IDS", {far_apart[0].provider_id})
+
+    body = login(far_apart[0]).get("/admin/day").get_json()
+
+    assert body["date"] is None
+    assert body["counts"]["booked"] == 2
+    for provider, entry in zip(sorted(far_apart, key=lambda p: p.display_name), body["providers"]):
+        today = datetime.now(ZoneInfo(provider.timezone)).date()
+        assert entry["date"] == today.isoformat()
+        assert [item["start_at"] for item in entry["appointments"]] == [str(datetime.combine(today, time(10)))]
+
+
+def test_explicit_date_applies_to_every_provider(far_apart, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_PROVIDER_IDS", {far_apart[0].provider_id})
+    day = datetime.now(ZoneInfo("Pacific/Kiritimati")).date()
+
+    body = login(far_apart[0]).get(f"/admin/day?date={day.isoformat()}").get_json()
+
+    assert body["date"] == day.isoformat()
+    assert body["counts"]["booked"] == 2
+    assert {entry["date"] for entry in body["providers"]} == {day.isoformat()}
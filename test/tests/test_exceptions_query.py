@@ -0,0 +1,42 @@
+"""exceptions_query skips the exceptions that ended before the window."""
+from datetime import datetime, timedelta
+
+import main
+
+
+def test_candidates_in_window(db, provider):
+    window_start = datetime(2030, 1, 7)
+    window_end = window_start + timedelta(days=14)
+
+    def exception(reason, start_at, hours=2, **recurrence):
+        row = main.ProviderException(
+            provider_id=provider.provider_id, start_at=start_at, end_at=start_at + timedelta(hours=hours),
+            reason=reason, **recurrence,
+        )
+        db.add(row)
+        return row
+
+    exception("pasada", window_start - timedelta(days=30))
+    exception("cruza el inicio", window_start - timedelta(hours=1))
+    exception("dentro", window_start + timedelta(days=3))
+    exception("después", window_end + timedelta(days=1))
+    exception("serie terminada", window_start - timedelta(weeks=10), recurrence="weekly", recurrence_count=4)
+    exception("serie vigente", window_start - timedelta(weeks=10), recurrence="weekly", recurrence_count=12)
+    exception("serie sin fin", window_start - timedelta(weeks=10), recurrence="weekly", recurrence_interval=2)
+    exception("no bloquea", window_start + timedelta(days=1)).is_blocking = False
+    db.commit()
+
+    def read(**kwargs):
+        stmt = main.exceptions_query(provider.provider_id, window_start, window_end, **kwargs)
+        rows = db.execute(stmt).scalars().all()
+        in_window = {exception.reason for _, _, exception in main.iter_exceptions(rows, window_start, window_end)}
+        return {row.reason for row in rows}, in_window
+
+    expected = {"cruza el inicio", "dentro", "serie sin fin", "serie vigente"}
+    rows, in_window = read()
+    # Lo que ya terminó ni se lee; lo posterior a la ventana se lee pero no tiene ocurrencias.
+    assert rows == expected | {"no bloquea", "después"}
+    assert in_window == expected | {"no bloquea"}
+    rows, in_window = read(blocking_only=True)
+    assert rows == expected | {"después"}
+    assert in_window == expected
@@ -0,0 +1,14 @@
+"""Every hot query uses the index it was designed for."""
+import pytest
+
+import main
+from explain_queries import explain, hot_queries
+
+QUERIES = hot_queries()
+
+
+@pytest.mark.parametrize("name, site, statement, expected", QUERIES, ids=[query[0] for query in QUERIES])
+def test_hot_query_plan(db, name, site, statement, expected):
+    with main.engine.connect() as conn:
+        plan, problems = explain(conn, statement, expected)
+    assert not problems, plan
@@ -0,0 +1,44 @@
+"""CRUD lists only paginate when the client asks for it."""
+import main
+
+
+def login(patient):
+    client = main.app.test_client()
+    response = client.post(
+        "/auth/login", json={"user_type": "patient", "email": patient.email, "pin": main.DEMO_LOGIN_PIN}
+    )
+    client.environ_base["HTTP_X_SESSION_TOKEN"] = response.get_json()["token"]
+    return client
+
+
+def add_patients(db, count):
+    db.add_all([
+        main.Patient(first_name=f"Paciente {n}", last_name="Prueba", email=f"p{n}@example.com")
+        for n in range(count)
+    ])
+    db.commit()
+
+
+def test_list_without_limit_returns_every_row(db, patient, monkeypatch):
+    monkeypatch.setattr(main, "LIST_DEFAULT_LIMIT", 3)
+    add_patients(db, 7)
+
+    response = login(patient).get("/patients")
+
+    assert response.status_code == 200
+    assert len(response.get_json()) == 8
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_limit_and_after_page_through_the_list(db, patient, monkeypatch):
+    monkeypatch.setattr(main, "LIST_DEFAULT_LIMIT", 3)
+    add_patients(db, 7)
+    client = login(patient)
+
+    first = client.get("/patients?limit=5")
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get(f"/patients?after={cursor}")
+
+    assert [row["patient_id"] for row in first.get_json()] == [1, 2, 3, 4, 5]
+    assert [row["patient_id"] for row in second.get_json()] == [6, 7, 8]
+    assert "X-Next-Cursor" not in second.headers
@@ -0,0 +1,128 @@
+"""Queued notifications carry their recipient and go out through a real adapter."""
+import socketserver
+import threading
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+import main
+from outbox_worker import OutboxDispatcher, SMTPEmailAdapter, StubAdapter
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for :mod:`smtplib`: records envelope recipients and data."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 localhost")
+        message = {"rcpt": [], "data": ""}
+        while True:
+            line = self.rfile.readline().decode().rstrip("\r\n")
+            command = line[:4].upper()
+            if not line or command == "QUIT":
+                self.reply("221 bye")
+                return
+            if command == "EHLO":
+                self.reply("250 localhost")
+            elif command == "RCPT":
+                message["rcpt"].append(line.split(":", 1)[1].strip().strip("<>"))
+                self.reply("250 ok")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                lines = []
+                for raw in iter(self.rfile.readline, b".\r\n"):
+                    lines.append(raw.decode())
+                message["data"] = "".join(lines)
+                self.server.messages.append(message)
+                message = {"rcpt": [], "data": ""}
+                self.reply("250 queued")
+            else:
+                self.reply("250 ok")
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPHandler)
+    server.daemon_threads = True
+    server.messages = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def dispatch(server):
+    stub = StubAdapter()
+    adapters = {
+        "email": SMTPEmailAdapter(*server.server_address, "no-reply@omas.local"),
+        "sms": stub,
+        "push": stub,
+    }
+    dispatcher = OutboxDispatcher(adapters, max_attempts=1)
+    dispatcher.run_once()
+    return stub
+
+
+def outbox_rows(db):
+    db.expire_all()
+    return db.query(main.NotificationOutbox).order_by(main.NotificationOutbox.notif_id).all()
+
+
+def test_booking_notifications_reach_the_recipients(db, patient, provider, smtp_server):
+    db.add_all([
+        main.NotificationPreference(user_type="patient", user_id=patient.patient_id, channel="email", lead_minutes=0),
+        main.NotificationPreference(user_type="patient", user_id=patient.patient_id, channel="sms", lead_minutes=0),
+        main.NotificationPreference(user_type="provider", user_id=provider.provider_id, channel="email", lead_minutes=0),
+    ])
+    db.commit()
+    # Una cita ya pasada: los recordatorios vencen de inmediato.
+    start_at = datetime.combine(date.today() - timedelta(days=1), time(10))
+    main.book_appointment(db, {
+        "patient_id": patient.patient_id,
+        "provider_id": provider.provider_id,
+        "start_at": start_at,
+        "end_at": start_at + timedelta(minutes=30),
+    })
+
+    payloads = {(row.payload["user_type"], row.channel): row.payload for row in outbox_rows(db)}
+    assert payloads[("patient", "email")]["to"] == "juan@example.com"
+    assert payloads[("patient", "sms")]["to"] == "+525511112222"
+    assert payloads[("provider", "email")]["to"] == "lopez@clinic.mx"
+
+    stub = dispatch(smtp_server)
+
+    rows = outbox_rows(db)
+    assert [row.status for row in rows] == ["sent"] * 3, [row.last_error for row in rows]
+    recipients = sorted(rcpt for message in smtp_server.messages for rcpt in message["rcpt"])
+    assert recipients == ["juan@example.com", "lopez@clinic.mx"]
+    assert [n.payload["to"] for n in stub.sent] == ["+525511112222"]
+
+
+def test_waitlist_offer_reaches_the_patient(db, patient, provider, smtp_server):
+    now = datetime.utcnow()
+    entry = main.WaitlistEntry(
+        patient_id=patient.patient_id,
+        provider_id=provider.provider_id,
+        window_start=now,
+        window_end=now + timedelta(days=7),
+        status="offered",
+        offered_provider_id=provider.provider_id,
+        offered_start_at=now + timedelta(days=1),
+        offered_end_at=now + timedelta(days=1, minutes=30),
+        offer_expires_at=now + timedelta(minutes=15),
+    )
+    db.add(entry)
+    db.commit()
+    main.enqueue_waitlist_offer(db, main.row_snapshot(entry), now)
+    db.commit()
+
+    dispatch(smtp_server)
+
+    [row] = outbox_rows(db)
+    assert row.template == "waitlist_offer"
+    assert row.status == "sent", row.last_error
+    [message] = smtp_server.messages
+    assert message["rcpt"] == ["juan@example.com"]
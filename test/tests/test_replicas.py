@@ -0,0 +1,36 @@
+"""A replica failing under a read-only handler is ejected and the request retried on the primary."""
+import os
+
+import pytest
+
+import main
+from conftest import TMP_DIR
+
+
+@pytest.fixture
+def broken_replica(monkeypatch):
+    """A replica pool whose only member cannot be opened."""
+    pool = main.ReplicaPool([f"sqlite:///{os.path.join(TMP_DIR, 'missing', 'replica.db')}"], 60)
+    monkeypatch.setattr(main, "REPLICAS", pool)
+    yield pool.replicas[0]
+    pool.replicas[0].engine.dispose()
+
+
+@pytest.mark.parametrize("query", ["stream=1", "stream=ndjson"])
+def test_streamed_list_falls_back_to_the_primary(db, patient, broken_replica, query):
+    db.add_all([
+        main.Patient(first_name=f"Paciente {n}", last_name="Prueba", email=f"p{n}@example.com")
+        for n in range(3)
+    ])
+    db.commit()
+    client = main.app.test_client()
+    login = client.post("/auth/login", json={"user_type": "patient", "email": patient.email, "pin": main.DEMO_LOGIN_PIN})
+    client.environ_base["HTTP_X_SESSION_TOKEN"] = login.get_json()["token"]
+
+    response = client.get(f"/patients?{query}")
+
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    rows = [line for line in body.splitlines() if line] if query.endswith("ndjson") else response.get_json()
+    assert len(rows) == 4
+    assert not broken_replica.healthy
@@ -0,0 +1,54 @@
+"""/slots/search merges providers from different timezones in real (UTC) time order."""
+from datetime import datetime, time, timedelta
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clinic(db, patient):
+    """Same specialty at both ends of the date line, open 09:00-12:00 local every day."""
+    for name, zone in (("Dr. Este", "Pacific/Kiritimati"), ("Dra. Oeste", "Pacific/Pago_Pago"), ("Dr. Centro", "UTC")):
+        provider = main.Provider(display_name=name, specialty="Pediatría", email=f"{zone.lower()}@clinic.mx", timezone=zone)
+        db.add(provider)
+        db.commit()
+        for weekday in range(1, 8):
+            db.add(main.ProviderAvailability(
+                provider_id=provider.provider_id, weekday=weekday, start_time=time(9), end_time=time(12)
+            ))
+        db.commit()
+    client = main.app.test_client()
+    login = client.post("/auth/login", json={"user_type": "patient", "email": patient.email, "pin": main.DEMO_LOGIN_PIN})
+    client.environ_base["HTTP_X_SESSION_TOKEN"] = login.get_json()["token"]
+    return client
+
+
+def parse(value):
+    return datetime.fromisoformat(value)
+
+
+def test_slots_are_ordered_by_utc(clinic):
+    slots = clinic.get("/slots/search?specialty=Pediatría&limit=60").get_json()["slots"]
+
+    starts = [parse(slot["start_at_utc"]) for slot in slots]
+    assert starts == sorted(starts)
+    assert {slot["timezone"] for slot in slots} == {"Pacific/Kiritimati", "Pacific/Pago_Pago", "UTC"}
+    for slot in slots:
+        tz, _ = main.resolve_timezone(slot["timezone"])
+        assert main.local_to_utc(parse(slot["start_at"]), tz) == parse(slot["start_at_utc"])
+
+
+def test_window_is_read_in_utc(clinic):
+    window_from = datetime.combine(datetime.utcnow().date() + timedelta(days=2), time(0))
+    window_to = window_from + timedelta(days=1)
+
+    response = clinic.get(
+        f"/slots/search?specialty=Pediatría&limit=100&from={window_from.isoformat()}Z&to={window_to.isoformat()}Z"
+    )
+
+    slots = response.get_json()["slots"]
+    # Cada proveedor abre 3 horas al día y todas caen una vez en cualquier día UTC.
+    assert len(slots) == 3 * 2 * 3
+    assert all(window_from <= parse(slot["start_at_utc"]) for slot in slots)
+    assert all(parse(slot["end_at_utc"]) <= window_to for slot in slots)